@@ -0,0 +1,226 @@
+# Adaptive concurrency of the requests sent to CCCBDB (AIMD, as TCP congestion control does): the number of
+# requests allowed in flight grows by one while the recent latencies and errors stay under their targets,
+# and is cut in half on timeouts, HTTP 429/5xx and unrecognized pages. After several overload failures in a
+# row a circuit breaker pauses every request, then lets a single one through to probe the server.
+import threading
+import time
+from collections import deque
+
+from cccbdb_failures import TRANSIENT, classify_exception, status_failure
+
+DEFAULT_TARGET_P95 = 2.0
+DEFAULT_MAX_ERROR_RATE = 0.05
+
+
+class AdaptiveLimiter:
+    """
+    Additive-increase / multiplicative-decrease limit on the requests in flight, with a circuit breaker.
+
+    Every window requests the p95 latency and the error rate of the last window requests are checked:
+    the limit grows by increase when both are under their targets and is multiplied by decrease
+    otherwise. An overload failure (timeout, connection error, HTTP 429/5xx, unrecognized page) also
+    cuts the limit right away, at most once per p95 latency so that the requests already in flight when
+    the server got busy do not cut it again. failure_threshold overload failures in a row open the
+    circuit: no request is sent for open_seconds (doubled every time the probe fails, up to
+    max_open_seconds), then the limit is at its minimum and the first success closes the circuit.
+
+    With a rate limiter, its rate follows the limit: max_rate * limit / maximum requests per second.
+
+    Args:
+        maximum: Largest number of requests in flight, i.e. the number of workers
+        minimum: Smallest number of requests in flight
+        initial: Limit to start with, defaults to half of maximum
+        target_p95: Largest acceptable p95 latency of a window, in seconds
+        max_error_rate: Largest acceptable fraction of overload failures in a window
+        window: Number of requests between two changes of the limit
+        increase: Requests added to the limit after a good window
+        decrease: Factor the limit is multiplied by on overload
+        failure_threshold: Overload failures in a row that open the circuit
+        open_seconds: Pause of an open circuit
+        max_open_seconds: Longest pause of an open circuit
+        rate_limiter: cccbdb_client.TokenBucket whose rate follows the limit, or None
+        metrics: scrape_metrics.Metrics the limit is recorded in, or None
+        log_interval: Seconds between two printed lines with the limit, 0 to only print the changes
+    """
+
+    def __init__(self, maximum, minimum=1, initial=None, target_p95=DEFAULT_TARGET_P95,
+                 max_error_rate=DEFAULT_MAX_ERROR_RATE, window=20, increase=1, decrease=0.5, failure_threshold=5,
+                 open_seconds=30, max_open_seconds=300, rate_limiter=None, metrics=None, log_interval=30):
+        if not 1 <= minimum <= maximum:
+            raise ValueError("The limits need 1 <= minimum <= maximum")
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(initial if initial is not None else max(minimum, maximum // 2))
+        self.target_p95 = target_p95
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.increase = increase
+        self.decrease = decrease
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.rate_limiter = rate_limiter
+        self.max_rate = rate_limiter.rate if rate_limiter is not None else None
+        self.metrics = metrics
+        self.log_interval = log_interval
+        self.in_flight = 0
+        self.failures_in_a_row = 0
+        self.open_until = None
+        self.opened = 0
+        self.history = []  # (seconds since the start, limit, reason) of every change of the limit
+        self._latencies = deque(maxlen=window)
+        self._errors = deque(maxlen=window)
+        self._since_change = 0
+        self._peak = 0  # most requests in flight since the last check of the window
+        self._last_cut = float('-inf')
+        self._next_open_seconds = open_seconds
+        self._started = time.monotonic()
+        self._last_log = self._started
+        self._condition = threading.Condition()
+        self._changed('start')
+
+    def allowed(self):
+        """Number of requests allowed in flight now."""
+        return max(self.minimum, int(self.limit))
+
+    def acquire(self):
+        """Wait until a request may be sent. Returns the seconds waited."""
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self.open_until is not None and now < self.open_until:
+                    self._condition.wait(self.open_until - now)
+                elif self.in_flight >= self.allowed():
+                    self._condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+            self._peak = max(self._peak, self.in_flight)
+        return time.monotonic() - start
+
+    def release(self, seconds, overload=False):
+        """
+        Record a finished request.
+
+        Args:
+            seconds: Response time of the request
+            overload: The request failed because the server is overloaded, see is_overload()
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self._record(seconds, overload)
+            self._condition.notify_all()
+
+    def report_overload(self, reason='garbage'):
+        """Record an overload the response status did not show, e.g. an unrecognized page."""
+        with self._condition:
+            # the request was counted as a success when it was released
+            if self._errors:
+                self._errors[-1] = True
+            self._overload(time.monotonic(), reason)
+            self._condition.notify_all()
+
+    def _record(self, seconds, overload):
+        self._latencies.append(seconds)
+        self._errors.append(overload)
+        self._since_change += 1
+        now = time.monotonic()
+        if overload:
+            self._overload(now, 'overload')
+            return
+        self.failures_in_a_row = 0
+        if self.open_until is not None:
+            # the probe got through, the circuit closes
+            self.open_until = None
+            self._next_open_seconds = self.open_seconds
+            self._changed('circuit closed')
+        if self._since_change >= self.window:
+            p95, error_rate = self.p95(), self.error_rate()
+            if p95 > self.target_p95 or error_rate > self.max_error_rate:
+                self._cut(now, f'p95 {p95:.2f} s, {error_rate:.0%} errors')
+            elif self.limit < self.maximum and self._peak >= self.allowed():
+                # only a limit that is reached is raised, an idle one says nothing about the server
+                self.limit = min(self.maximum, self.limit + self.increase)
+                self._changed(f'p95 {p95:.2f} s, {error_rate:.0%} errors')
+            self._since_change = 0
+            self._peak = self.in_flight
+        self._log(now)
+
+    def _overload(self, now, reason):
+        self.failures_in_a_row += 1
+        if self.failures_in_a_row >= self.failure_threshold and (self.open_until is None or now >= self.open_until):
+            self.open_until = now + self._next_open_seconds
+            self.opened += 1
+            self.limit = self.minimum
+            self._last_cut = now
+            self._changed(f'circuit open for {self._next_open_seconds:.0f} s after {self.failures_in_a_row} failures')
+            self._next_open_seconds = min(self.max_open_seconds, self._next_open_seconds * 2)
+            if self.metrics is not None:
+                self.metrics.inc('circuit_opens_total')
+            return
+        # the requests sent before the cut answer within about one p95 latency, their failures are no news
+        if now - self._last_cut >= max(self.p95(), 0.1):
+            self._cut(now, reason)
+
+    def _cut(self, now, reason):
+        self._last_cut = now
+        self._since_change = 0
+        limit = max(self.minimum, self.limit * self.decrease)
+        if limit != self.limit:
+            self.limit = limit
+            self._changed(reason)
+
+    def p95(self):
+        """p95 of the latencies of the last window requests."""
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+    def error_rate(self):
+        """Fraction of overload failures in the last window requests."""
+        return sum(self._errors) / len(self._errors) if self._errors else 0.0
+
+    def _changed(self, reason):
+        elapsed = time.monotonic() - self._started
+        self.history.append((round(elapsed, 3), self.allowed(), reason))
+        if self.rate_limiter is not None:
+            self.rate_limiter.set_rate(self.max_rate * self.allowed() / self.maximum)
+        if self.metrics is not None:
+            self.metrics.set('concurrency_limit', self.allowed())
+            # the reason without its numbers: start, p95, overload, garbage or circuit
+            self.metrics.inc('limit_changes_total', reason=reason.split(' ')[0])
+        if reason != 'start':
+            print(f"Concurrency limit {self.allowed()}/{self.maximum} at {elapsed:.1f} s ({reason})")
+
+    def _log(self, now):
+        if self.log_interval and now - self._last_log >= self.log_interval:
+            self._last_log = now
+            print(f"Concurrency limit {self.allowed()}/{self.maximum}, {self.in_flight} in flight, "
+                  f"p95 {self.p95():.2f} s, {self.error_rate():.0%} errors")
+
+    def summary(self):
+        """Dictionary with the current limit, the number of times the circuit opened and the history of the limit."""
+        with self._condition:
+            return {'limit': self.allowed(), 'maximum': self.maximum, 'circuit_opens': self.opened,
+                    'history': list(self.history)}
+
+
+def is_overload(response=None, exception=None):
+    """True for the responses and exceptions that mean the server is overloaded (cccbdb_failures.TRANSIENT)."""
+    if exception is not None:
+        return classify_exception(exception).category == TRANSIENT
+    failure = status_failure(response)
+    return failure is not None and failure.category == TRANSIENT
+
+
+def add_adaptive_arguments(parser):
+    """Add the --adaptive, --target-p95 and --max-error-rate options to an argparse parser."""
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adapt the requests in flight (up to --workers) and the rate (up to --max-rate) '
+                             'to the latency and errors of CCCBDB')
+    parser.add_argument('--target-p95', type=float, default=DEFAULT_TARGET_P95,
+                        help=f'p95 latency in seconds the adaptive limit keeps under (default: {DEFAULT_TARGET_P95})')
+    parser.add_argument('--max-error-rate', type=float, default=DEFAULT_MAX_ERROR_RATE,
+                        help=f'fraction of overload errors the adaptive limit keeps under (default: {DEFAULT_MAX_ERROR_RATE})')
@@ -0,0 +1,157 @@
+# Compares the HTML extraction backends of cccbdb_extract.py on a corpus of saved CCCBDB pages:
+# pages per second for every backend and page kind, and whether every backend reads the same values
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+from cccbdb_extract import EXTRACTORS, get_extractor
+from http_cache import DEFAULT_CACHE_DIR
+
+# sub directory of the corpus -> what is read from its pages
+PAGE_KINDS = {
+    'dipole': lambda extractor, document: _grid_values(*extractor.method_grid(document)),
+    'quadrupole': lambda extractor, document: _grid_values(*extractor.method_grid(document)),
+    'rotational': lambda extractor, document: extractor.rotational_constants(document),
+    'selection': lambda extractor, document: extractor.selection_options(document),
+}
+
+
+def _grid_values(grid, failure):
+    # comparable form of a MethodGrid
+    if grid is None:
+        return failure
+    return grid.methods, grid.bases, grid.values.tobytes(), grid.status.tobytes()
+
+
+# data pages in the response cache whose kind is known from the URL
+DATA_PAGE_KINDS = {
+    'dipole2x.asp': 'dipole',
+    'quadrupole2x.asp': 'quadrupole',
+    'rotcalc2x.asp': 'rotational',
+}
+
+
+def load_corpus(corpus_dir):
+    """
+    Read the pages of a corpus directory with one sub directory per page kind
+    (dipole, quadrupole, rotational, selection), each holding saved pages.
+
+    Returns:
+        Dictionary from page kind to a list of (file name, page text)
+    """
+    corpus = {}
+    for kind in PAGE_KINDS:
+        directory = os.path.join(corpus_dir, kind)
+        if not os.path.isdir(directory):
+            continue
+        pages = []
+        for file_name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, file_name), 'r', encoding='utf-8', errors='replace') as page_file:
+                pages.append((file_name, page_file.read()))
+        if pages:
+            corpus[kind] = pages
+    return corpus
+
+
+def export_cache_corpus(cache_dir, corpus_dir):
+    """
+    Copy the data and selection pages of the response cache (see http_cache.py) into a corpus directory.
+    Pages of the formula search that land directly on a data page are skipped, their kind
+    depends on the entry page of the session and cannot be told from the URL.
+
+    Returns:
+        Number of pages written
+    """
+    extractor = get_extractor('bs4')
+    with closing(sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'))) as db:
+        entries = db.execute('SELECT DISTINCT blob, url FROM entries WHERE status_code = 200').fetchall()
+
+    written = 0
+    for blob, url in entries:
+        with open(os.path.join(cache_dir, 'blobs', blob[:2], blob), 'rb') as blob_file:
+            text = blob_file.read().decode('utf-8', errors='replace')
+        kind = DATA_PAGE_KINDS.get(url.rsplit('/', 1)[-1].split('?')[0])
+        if kind is None and extractor.selection_options(extractor.document(text)) is not None:
+            kind = 'selection'
+        if kind is None:
+            continue
+        os.makedirs(os.path.join(corpus_dir, kind), exist_ok=True)
+        with open(os.path.join(corpus_dir, kind, blob + '.html'), 'w', encoding='utf-8') as page_file:
+            page_file.write(text)
+        written += 1
+    return written
+
+
+def run_backend(extractor, kind, pages):
+    """Parse and read every page once. Returns the results in page order."""
+    read = PAGE_KINDS[kind]
+    return [read(extractor, extractor.document(text)) for _, text in pages]
+
+
+def benchmark(corpus, backends, repeat=5):
+    """
+    Time every backend on every page kind of the corpus and compare their results with
+    those of the first backend.
+
+    Returns:
+        List of dictionaries with kind, backend, pages, seconds (best of repeat runs),
+        pages_per_second and mismatches (file names whose results differ)
+    """
+    extractors = [get_extractor(name) for name in backends]
+    rows = []
+    for kind, pages in corpus.items():
+        reference = None
+        for extractor in extractors:
+            results = run_backend(extractor, kind, pages)  # also warms up the backend
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run_backend(extractor, kind, pages)
+                best = min(best, time.perf_counter() - start)
+
+            if reference is None:
+                reference = results
+            mismatches = [name for (name, _), ours, theirs in zip(pages, results, reference) if ours != theirs]
+            rows.append({
+                'kind': kind,
+                'backend': extractor.name,
+                'pages': len(pages),
+                'seconds': best,
+                'pages_per_second': len(pages) / best if best > 0 else float('inf'),
+                'mismatches': mismatches,
+            })
+    return rows
+
+
+def print_report(rows):
+    print(f"{'page kind':<12}{'backend':<9}{'pages':>7}{'pages/sec':>12}{'speed-up':>10}  same results")
+    baseline = {}
+    for row in rows:
+        baseline.setdefault(row['kind'], row['pages_per_second'])
+        speed_up = row['pages_per_second'] / baseline[row['kind']]
+        same = 'yes' if not row['mismatches'] else f"NO ({len(row['mismatches'])} pages, e.g. {row['mismatches'][0]})"
+        print(f"{row['kind']:<12}{row['backend']:<9}{row['pages']:>7}{row['pages_per_second']:>12.1f}{speed_up:>9.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the CCCBDB HTML extraction backends on saved pages")
+    parser.add_argument('corpus_dir', help='directory with dipole/, quadrupole/, rotational/ and selection/ sub directories of saved pages')
+    parser.add_argument('--backends', nargs='+', choices=list(EXTRACTORS), default=list(EXTRACTORS),
+                        help='backends to compare, the results of the first one are the reference')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per backend and page kind, the fastest one is reported')
+    parser.add_argument('--from-cache', nargs='?', const=DEFAULT_CACHE_DIR, default=None, metavar='CACHE_DIR',
+                        help='first copy the data and selection pages of the response cache into the corpus')
+    args = parser.parse_args()
+
+    if args.from_cache:
+        print(f"Copied {export_cache_corpus(args.from_cache, args.corpus_dir)} pages from {args.from_cache}")
+    corpus = load_corpus(args.corpus_dir)
+    if not corpus:
+        sys.exit(f"No pages found in {args.corpus_dir}")
+    rows = benchmark(corpus, args.backends, args.repeat)
+    print_report(rows)
+    # a non-zero exit status when the backends disagree, so the comparison can run in scripts
+    sys.exit(1 if any(row['mismatches'] for row in rows) else 0)
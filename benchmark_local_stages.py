@@ -0,0 +1,435 @@
+# Times the stages that do not touch the network on synthetic molecule tables of growing size, with the
+# peak memory of every stage, and keeps the numbers as JSON so the runs of two commits can be compared
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from table_io import FORMATS, add_format_arguments, format_from_args, read_table, write_table
+
+try:
+    import resource
+except ImportError:  # not on Windows, psutil is used there when it is installed
+    resource = None
+
+# point group -> (share of the molecules, rotor of its rotational constants)
+POINT_GROUPS = {
+    'C1': (0.30, 'asymmetric'),
+    'Cs': (0.20, 'asymmetric'),
+    'C2v': (0.15, 'asymmetric'),
+    'C2h': (0.03, 'asymmetric'),
+    'C2': (0.03, 'asymmetric'),
+    'D2h': (0.03, 'asymmetric'),
+    'C3v': (0.08, 'prolate'),
+    'C3': (0.02, 'prolate'),
+    'C4v': (0.01, 'prolate'),
+    'D3h': (0.03, 'oblate'),
+    'D6h': (0.01, 'oblate'),
+    'C∞v': (0.06, 'linear'),
+    'D∞h': (0.03, 'linear'),
+    'Td': (0.015, 'spherical'),
+    'Oh': (0.005, 'spherical'),
+}
+# category of the vibrational data -> share of the rows, the ions and radicals are filtered out
+CATEGORIES = {'neutral': 0.85, 'anion': 0.05, 'cation': 0.05, 'radical': 0.05}
+STATES = {'1Σ+': 0.6, '1Σg+': 0.1, '2Π': 0.1, '1A1': 0.2}
+VIBRATIONAL_COLUMNS = ['Index', 'Category', 'Name', 'Formula', 'State', 'Symmetry', 'Frequency', 'Intensity']
+
+DEFAULT_SIZES = ['10k', '100k', '1M']
+
+
+def parse_size(text):
+    """Number of rows of a size such as 10000, 10k or 10M."""
+    text = text.strip().lower()
+    factor = {'k': 10 ** 3, 'm': 10 ** 6}.get(text[-1:], 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+def _choice(rng, shares, count):
+    return rng.choice(np.array(list(shares), dtype=object), size=count, p=np.array(list(shares.values())) / sum(shares.values()))
+
+
+def _element(symbol, counts):
+    # 0 -> '', 1 -> 'C', 2 -> 'C2', ... without formatting every cell
+    labels = np.array([''] + [symbol] + [f"{symbol}{i}" for i in range(2, int(counts.max(initial=1)) + 1)], dtype=object)
+    return labels[counts]
+
+
+def synthetic_formulas(rng, count):
+    """Hill ordered formulas of organic molecules, C1-C12 with H, N, O and one kind of halogen."""
+    carbons = rng.integers(1, 13, count)
+    hydrogens = rng.integers(0, 2 * carbons + 3)
+    nitrogens = rng.choice([0, 0, 0, 0, 1, 1, 2], count)
+    oxygens = rng.choice([0, 0, 0, 1, 1, 2, 3], count)
+    halogens = rng.choice([0, 0, 0, 0, 0, 0, 1, 2], count)
+    halogen = rng.choice(['F', 'Cl', 'Br'], count)
+    formulas = _element('C', carbons) + _element('H', hydrogens)
+    for symbol in ('Br', 'Cl', 'F'):
+        formulas = formulas + np.where(halogen == symbol, _element(symbol, halogens), '')
+    return formulas + _element('N', nitrogens) + _element('O', oxygens)
+
+
+def rotational_constants(rng, rotors):
+    """Rotational constants in cm⁻¹ (one for a linear rotor, NaN for the missing ones) of every rotor."""
+    count = len(rotors)
+    a = rng.uniform(0.05, 10, count).round(5)
+    b = (a * rng.uniform(0.1, 0.9, count)).round(5)
+    c = (b * rng.uniform(0.5, 0.99, count)).round(5)
+    constants = np.column_stack([a, b, c])
+    constants[rotors == 'linear', 1:] = np.nan
+    constants[rotors == 'prolate', 2] = b[rotors == 'prolate']
+    constants[rotors == 'oblate', 1] = a[rotors == 'oblate']
+    constants[rotors == 'spherical', 1:] = a[rotors == 'spherical', None]
+    return constants
+
+
+def generate_tables(rows, directory, table_format='csv', seed=0):
+    """
+    Write the synthetic inputs of the stages for tables of rows rows. Files that are already
+    in directory are reused, they only depend on rows and seed.
+
+    The inputs are:
+        vibrations: vibrational data as written by html_to_csv.py, 1 to 6 rows per molecule,
+            with ions, radicals and non Σ states
+        molecules: one row per molecule in the columns of the vibrational data
+        point_groups: point group list as written by get_point_group_from_cccbdb.py, with 90% of
+            the molecules and as many other ones
+        constants: the molecules with their point group and rotational constants
+        dipoles: the constants with a dipole moment, NaN for 10% of the molecules
+
+    Returns:
+        Dictionary from input name to file path
+    """
+    os.makedirs(directory, exist_ok=True)
+    extension = FORMATS[table_format]
+    paths = {
+        'vibrations': os.path.join(directory, 'vibrations.csv'),
+        'molecules': os.path.join(directory, 'molecules.csv'),
+        'point_groups': os.path.join(directory, 'point_groups.csv'),
+        'constants': os.path.join(directory, 'constants' + extension),
+        'dipoles': os.path.join(directory, 'dipoles' + extension),
+    }
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+
+    rng = np.random.default_rng(seed)
+    names = np.array([f"compound {i}" for i in range(rows)], dtype=object)
+    formulas = synthetic_formulas(rng, rows)
+    molecules = pd.DataFrame({
+        'Index': np.arange(rows),
+        'Category': 'neutral',
+        'Name': names,
+        'Formula': formulas,
+        'State': _choice(rng, {'1Σ+': 0.85, '1Σg+': 0.15}, rows),
+        'Symmetry': 'a1',
+        'Frequency': rng.uniform(100, 4000, rows).round(1),
+        'Intensity': rng.uniform(0, 100, rows).round(2),
+    })
+    molecules.to_csv(paths['molecules'], index=False)
+
+    # 1 to 6 vibrations of rows / 3 molecules, 1 in 20 of them an ion or a radical
+    vibrations_of = rng.integers(1, 7, rows // 3 + 1)
+    owner = np.repeat(np.arange(len(vibrations_of)), vibrations_of)[:rows]
+    vibrations = pd.DataFrame({
+        'Index': np.arange(rows),
+        'Category': _choice(rng, CATEGORIES, len(vibrations_of))[owner],
+        'Name': names[owner],
+        'Formula': formulas[owner],
+        'State': _choice(rng, STATES, len(vibrations_of))[owner],
+        'Symmetry': rng.choice(['a1', 'a2', 'b1', 'b2', 'e'], rows),
+        'Frequency': rng.uniform(100, 4000, rows).round(1),
+        'Intensity': rng.uniform(0, 100, rows).round(2),
+    }, columns=VIBRATIONAL_COLUMNS)
+    vibrations.to_csv(paths['vibrations'], index=False)
+
+    point_groups = _choice(rng, {group: share for group, (share, _) in POINT_GROUPS.items()}, rows)
+    listed = rng.random(rows) < 0.9
+    others = rows - int(listed.sum())
+    pd.DataFrame({
+        'Point Group': np.concatenate([point_groups[listed], rng.choice(list(POINT_GROUPS), others)]),
+        'Neutral Formula': np.concatenate([formulas[listed], synthetic_formulas(rng, others)]),
+        'Neutral Name': np.concatenate([names[listed], [f"other compound {i}" for i in range(others)]]),
+        'Formula Anion': None, 'Name Anion': None, 'Formula Cation': None, 'Name Cation': None,
+    }).to_csv(paths['point_groups'], index=False, encoding='utf-8-sig')
+
+    rotors = np.array([POINT_GROUPS[group][1] for group in point_groups], dtype=object)
+    constants = rotational_constants(rng, rotors)
+    with_constants = molecules.assign(**{
+        'Point Group': point_groups,
+        'Rotational Constant 1': constants[:, 0],
+        'Rotational Constant 2': constants[:, 1],
+        'Rotational Constant 3': constants[:, 2],
+    })
+    write_table(with_constants, paths['constants'])
+    dipoles = rng.exponential(1.5, rows).round(3)
+    dipoles[rng.random(rows) < 0.1] = np.nan
+    write_table(with_constants.assign(**{'Dipole Moment': dipoles}), paths['dipoles'])
+    return paths
+
+
+def _partition(paths, output_dir, extension, verbose=False):
+    # the output partitioning of filter_dipole.py, on values that were already looked up; verbose passes
+    # the formulas as filter_dipole.py --verbose does, its lines go to os.devnull instead of the report
+    from value_filter import partition_by_value
+
+    df = read_table(paths['dipoles'])
+    values = df.pop('Dipole Moment')
+    formulas = df.iloc[:, 3] if verbose else None
+
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            outputs = partition_by_value(df, values, 'Dipole Moment', 0.5, formulas=formulas)
+        for name, frame in zip(('good', 'no_value', 'discarded', 'joined'), outputs):
+            write_table(frame, os.path.join(output_dir, f'5_dipole_{name}{extension}'))
+    return run
+
+
+def _stage_runner(stage, paths, output_dir, extension, chunksize):
+    # the function that runs a stage once on the inputs; what it needs before that is prepared here
+    if stage == 'ions_and_radicals':
+        from filter_for_ions_and_radicals import filter_ions_and_radicals
+        return lambda: filter_ions_and_radicals(paths['vibrations'], os.path.join(output_dir, '1_ions_and_radicals.csv'))
+    if stage == 'doubled_formulas':
+        from remove_doubled_formulas import remove_doubled_formulas
+        return lambda: remove_doubled_formulas(paths['vibrations'], os.path.join(output_dir, '2_doubled_formulas.csv'))
+    if stage == 'point_group':
+        from filter_point_group import search_point_group
+        return lambda: search_point_group(paths['molecules'], paths['point_groups'],
+                                          os.path.join(output_dir, '3_point_group' + extension))
+    if stage == 'rotor_shapes':
+        from prolate_oblate_check import analyze_molecular_shapes
+        return lambda: analyze_molecular_shapes(paths['constants'])
+    if stage == 'fraction':
+        from fraction_calculator import calculate_fraction
+        return lambda: calculate_fraction(paths['dipoles'], os.path.join(output_dir, '5_fraction' + extension), chunksize=chunksize)
+    if stage == 'dipole_partition':
+        return _partition(paths, output_dir, extension)
+    if stage == 'dipole_partition_verbose':
+        return _partition(paths, output_dir, extension, verbose=True)
+    raise ValueError(f"Unknown stage {stage}")
+
+
+STAGES = ['ions_and_radicals', 'doubled_formulas', 'point_group', 'rotor_shapes', 'fraction', 'dipole_partition',
+          'dipole_partition_verbose']
+
+
+def _proc_status_mb(field):
+    # VmRSS / VmHWM of /proc/self/status on Linux, in MB, None elsewhere
+    try:
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    """Highest resident memory of this process so far in MB, None when it cannot be read."""
+    # VmHWM belongs to this process alone, ru_maxrss on Linux also counts the parent the process was started from
+    peak = _proc_status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB on Linux
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().peak_wset / 1024 ** 2
+
+
+def reset_peak_rss():
+    """
+    Start the peak memory of this process over from its current memory, where Linux allows it.
+
+    Returns:
+        Current resident memory in MB after the reset, None if the peak could not be reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return None
+    return _proc_status_mb('VmRSS')
+
+
+def _measure(stage, paths, output_dir, extension, chunksize, results):
+    # runs in a fresh process, so that the peak memory is the one of this stage alone
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        run = _stage_runner(stage, paths, output_dir, extension, chunksize)
+        before = reset_peak_rss()
+        if before is None:
+            before = peak_rss_mb()
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+    after = peak_rss_mb()
+    results.put({'seconds': seconds, 'peak_rss_mb': after,
+                 'rss_increase_mb': None if after is None or before is None else after - before})
+
+
+def measure_stage(stage, paths, output_dir, extension, chunksize=None):
+    """
+    Run a stage once in a new process.
+
+    Returns:
+        Dictionary with seconds, peak_rss_mb (the whole process) and rss_increase_mb (the peak
+        memory the stage added to the process, once its inputs were prepared)
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(stage, paths, output_dir, extension, chunksize, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if process.exitcode:
+        raise RuntimeError(f"Stage {stage} failed with exit code {process.exitcode}")
+    return result
+
+
+def benchmark(sizes, stages=STAGES, table_format='csv', work_dir='benchmark_data', seed=0, repeat=3, chunksize=None):
+    """
+    Time every stage on the synthetic tables of every size.
+
+    Args:
+        sizes: Numbers of rows
+        stages: Names of the stages to run, see STAGES
+        table_format: Format of the tables written by filter_point_group.py and the later stages
+        work_dir: Directory of the generated inputs (reused between runs) and the outputs
+        seed: Seed of the generated tables
+        repeat: Runs per stage and size, each in a new process; the fastest time and the highest
+            peak memory are reported
+        chunksize: chunksize of fraction_calculator.py, None for the whole table at once
+
+    Returns:
+        List of dictionaries with stage, rows, format, seconds, rows_per_second, peak_rss_mb and rss_increase_mb
+    """
+    rows = []
+    extension = FORMATS[table_format]
+    for size in sizes:
+        data_dir = os.path.join(work_dir, f'rows_{size}_seed_{seed}')
+        start = time.perf_counter()
+        paths = generate_tables(size, data_dir, table_format, seed)
+        print(f"{size} rows: inputs ready in {data_dir} after {time.perf_counter() - start:.1f} s")
+        output_dir = os.path.join(data_dir, 'outputs')
+        os.makedirs(output_dir, exist_ok=True)
+        for stage in stages:
+            runs = [measure_stage(stage, paths, output_dir, extension, chunksize) for _ in range(repeat)]
+            seconds = min(run['seconds'] for run in runs)
+            peaks = [run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None]
+            increases = [run['rss_increase_mb'] for run in runs if run['rss_increase_mb'] is not None]
+            rows.append({
+                'stage': stage,
+                'rows': size,
+                'format': table_format,
+                'seconds': seconds,
+                'rows_per_second': size / seconds if seconds > 0 else float('inf'),
+                'peak_rss_mb': max(peaks) if peaks else None,
+                'rss_increase_mb': max(increases) if increases else None,
+            })
+            print_report(rows[-1:], header=False)
+    return rows
+
+
+def environment():
+    """The versions and the commit a run was made with, stored next to its results."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import pyarrow
+        pyarrow_version = pyarrow.__version__
+    except ImportError:
+        pyarrow_version = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'pyarrow': pyarrow_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _mb(value):
+    return f"{value:.0f}" if value is not None else '-'
+
+
+def print_report(rows, header=True):
+    if header:
+        print(f"{'stage':<25}{'rows':>11}{'format':>8}{'seconds':>10}{'rows/sec':>13}{'peak MB':>9}{'+MB':>8}")
+    for row in rows:
+        print(f"{row['stage']:<25}{row['rows']:>11}{row['format']:>8}{row['seconds']:>10.3f}"
+              f"{row['rows_per_second']:>13.0f}{_mb(row['peak_rss_mb']):>9}{_mb(row['rss_increase_mb']):>8}")
+
+
+def compare(rows, baseline, tolerance=1.2):
+    """
+    Compare the times with those of a baseline run (the JSON of an earlier run) of the same
+    stages, sizes and format.
+
+    Returns:
+        List of (stage, rows, format, slow-down) of the stages more than tolerance times slower
+    """
+    before = {(row['stage'], row['rows'], row['format']): row for row in baseline['results']}
+    regressions = []
+    print(f"Compared with {baseline['environment'].get('commit') or 'the baseline'}:")
+    for row in rows:
+        old = before.get((row['stage'], row['rows'], row['format']))
+        if old is None:
+            continue
+        ratio = row['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+        flag = '  SLOWER' if ratio > tolerance else ''
+        print(f"{row['stage']:<25}{row['rows']:>11}{row['format']:>8}{old['seconds']:>10.3f} -> {row['seconds']:.3f} s "
+              f"({ratio:.2f}x){flag}")
+        if ratio > tolerance:
+            regressions.append((row['stage'], row['rows'], row['format'], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the local (non-network) stages on synthetic molecule tables")
+    parser.add_argument('--rows', nargs='+', default=DEFAULT_SIZES,
+                        help='table sizes, e.g. 10k 100k 1M 10M (default: 10k 100k 1M)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='stages to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage and size, the fastest one is reported')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated tables')
+    parser.add_argument('--chunksize', type=int, default=None, help='chunksize of the fraction stage')
+    parser.add_argument('--work-dir', default='benchmark_data', help='directory of the generated tables and the outputs')
+    parser.add_argument('--json', default=None, help='write the results to this JSON file')
+    parser.add_argument('--compare', default=None, metavar='JSON', help='compare the times with those of an earlier --json file')
+    parser.add_argument('--tolerance', type=float, default=1.2,
+                        help='slow-down from which --compare reports a regression (default: 1.2)')
+    add_format_arguments(parser)
+    args = parser.parse_args()
+
+    table_format = format_from_args(args)
+    results = benchmark([parse_size(size) for size in args.rows], args.stages, table_format, args.work_dir,
+                        args.seed, args.repeat, args.chunksize)
+    print()
+    print_report(results)
+    run = {'environment': environment(), 'seed': args.seed, 'repeat': args.repeat, 'chunksize': args.chunksize,
+           'results': results}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump(run, json_file, indent=2)
+        print(f"Results saved to {args.json}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as json_file:
+            regressions = compare(results, json.load(json_file), args.tolerance)
+        # a non-zero exit status on a regression, so the comparison can run in scripts
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,535 @@
+# Shared HTTP client for the scripts that scrape the NIST CCCBDB website
+# (rotational_constant.py, filter_dipole.py and filter_quadrupole.py)
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import requests
+
+from adaptive_limit import AdaptiveLimiter, add_adaptive_arguments, is_overload
+from cccbdb_extract import EXTRACTORS, get_extractor
+from cccbdb_failures import DEFAULT_NEGATIVE_TTL, NegativeCache, RetryPolicy
+from checkpoint import molecule_key
+from concurrent_scraper import SingleFlight
+from http_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DEFAULT_TTL, CacheMiss, HTTPCache, request_key
+from method_grid import GridStore
+from property_store import add_store_arguments, store_from_args
+from scrape_metrics import Metrics, add_metrics_arguments
+from tracing import add_tracing_arguments, span, tracing_from_args
+from which_index import WhichIndex
+
+
+BASE_URL = 'https://cccbdb.nist.gov'
+# environment variable that points every scraper at another server, e.g. a local cccbdb_simulator.py
+BASE_URL_ENV = 'CCCBDB_BASE_URL'
+
+# the formula search replaces the molecule selected in a session, the selection form refines it
+SEARCH_PAGE = 'getformx.asp'
+SELECT_PAGE = 'gotonex.asp'
+# page -> phase of a lookup the metrics of its requests are recorded under, the other pages are data pages ('fetch')
+PHASES = {SEARCH_PAGE: 'search', SELECT_PAGE: 'select'}
+
+# headers sent with every form submission, the referer is added per request
+DEFAULT_HEADERS = {
+    'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+    'accept-language': 'en-US,en;q=0.7',
+    'cache-control': 'max-age=0',
+    'content-type': 'application/x-www-form-urlencoded',
+    'origin': BASE_URL,
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36'
+}
+
+
+def default_base_url():
+    """The root URL of CCCBDB, or the one in the CCCBDB_BASE_URL environment variable."""
+    return (os.environ.get(BASE_URL_ENV) or BASE_URL).rstrip('/')
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that caps the request rate of every worker together.
+
+    Args:
+        rate: Tokens added per second, i.e. the sustained requests per second
+        capacity: Largest burst of requests, defaults to one second worth of tokens
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("The rate of a token bucket must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def set_rate(self, rate):
+        """Change the sustained rate, e.g. to follow an adaptive_limit.AdaptiveLimiter."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+
+
+class CCCBDBClient:
+    """
+    Keeps a pool of warmed keep-alive sessions to the CCCBDB server.
+
+    The server stores the selected molecule in the cookie state of a session, so
+    a session is leased to one worker at a time. A session remembers which entry
+    page (dipole1x.asp, quadrupole1x.asp, rotcalc1x.asp) it has visited, and the
+    warm-up GET is only repeated when a worker needs a different entry page.
+
+    With a cache, every response is stored under a key made of the request and the
+    state-changing requests before it (entry page, formula search, selected 'which'
+    value). Those requests are only sent to the server when a later page of the
+    same session is not in the cache.
+
+    Args:
+        pool_size: Maximum number of sessions, i.e. one per concurrent worker
+        base_url: Root URL of the CCCBDB website, defaults to default_base_url()
+        timeout: Timeout in seconds for every request
+        cache: HTTPCache serving repeated requests from disk, or None
+        offline: Only serve from the cache and raise CacheMiss instead of using the network
+        max_rate: Cap on the requests per second sent to the server by all workers together, or None
+        retry_policy: RetryPolicy shared by every lookup of the run, defaults to RetryPolicy()
+        negative_cache: NegativeCache of lookups CCCBDB has no value for, or None
+        extractor: cccbdb_extract backend that parses the pages, defaults to lxml when installed
+        grid_store: method_grid.GridStore keeping the method x basis set table of every dipole and
+            quadrupole page, or None
+        method: Method of the dipole and quadrupole values, None for the default ('HF')
+        basis: Basis set of the dipole and quadrupole values, None for the first one with a value
+        property_store: property_store.PropertyStore every lookup is recorded in, or None
+        metrics: scrape_metrics.Metrics the requests, parse and sleep times are recorded in, defaults to new Metrics()
+        metrics_json: File print_stats() writes the JSON summary of the metrics to, or None
+        metrics_prom: File print_stats() writes the metrics to in the Prometheus text format, or None
+        limiter: adaptive_limit.AdaptiveLimiter deciding how many requests are sent at once, or None
+        which_index: which_index.WhichIndex of the option every molecule was resolved to, so that a
+            later lookup skips the formula search, or None
+    """
+
+    def __init__(self, pool_size=4, base_url=None, timeout=30, cache=None, offline=False, max_rate=None,
+                 retry_policy=None, negative_cache=None, extractor=None, grid_store=None, method=None, basis=None,
+                 property_store=None, metrics=None, metrics_json=None, metrics_prom=None, limiter=None,
+                 which_index=None):
+        if offline and cache is None:
+            raise ValueError("Offline mode needs a cache")
+        self.pool_size = pool_size
+        self.base_url = (base_url or default_base_url()).rstrip('/')
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.rate_limiter = TokenBucket(max_rate) if max_rate else None
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.negative_cache = negative_cache
+        self.extractor = extractor if extractor is not None else get_extractor()
+        self.grid_store = grid_store
+        self.method = method
+        self.basis = basis
+        self.property_store = property_store
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics_json = metrics_json
+        self.metrics_prom = metrics_prom
+        self.limiter = limiter
+        self.which_index = which_index
+        self.lookups = SingleFlight()  # one lookup per molecule and properties for the lifetime of the client
+        self.misses = Counter()  # (property, failure category) of every lookup that gave up
+        self._failures = {}  # molecule_key() -> failure category by property of the last lookup that missed a value
+        self._idle = queue.LifoQueue()  # LIFO so the most recently used (warmest) session is reused first
+        self._sessions = []
+        self._lock = threading.Lock()
+        self._counts = {'leases': 0, 'warmups': 0, 'warmups_skipped': 0}
+
+    def url(self, page):
+        """Return the absolute URL of a CCCBDB page such as 'getformx.asp'."""
+        if page.startswith('http'):
+            return page
+        return f'{self.base_url}/{page}'
+
+    def headers(self, referer):
+        """Return a copy of the default headers with the given referer page or URL."""
+        headers = dict(DEFAULT_HEADERS)
+        headers['origin'] = self.base_url
+        headers['referer'] = self.url(referer)
+        return headers
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _new_session(self):
+        session = requests.Session()
+        session.cccbdb_entry_page = None  # entry page this session was last warmed on
+        session.cccbdb_chain = []         # state-changing requests that define the selected molecule
+        session.cccbdb_synced = 0         # how many of them the server has actually seen
+        self._sessions.append(session)
+        return session
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._sessions) < self.pool_size:
+                return self._new_session()
+        # every session is leased, wait for a worker to hand one back
+        return self._idle.get()
+
+    @contextmanager
+    def session(self, entry_page):
+        """
+        Lease a session that has visited the given entry page.
+
+        The warm-up GET is sent together with the first request that is not
+        served from the cache.
+
+        Args:
+            entry_page: CCCBDB entry page for the property, e.g. 'dipole1x.asp'
+
+        Yields:
+            A requests.Session to pass to get() and post(), returned to the pool afterwards
+        """
+        session = self._acquire()
+        self._count('leases')
+        try:
+            if session.cccbdb_entry_page != entry_page:
+                session.cccbdb_entry_page = entry_page
+                session.cccbdb_chain = [('GET', self.url(entry_page), None)]
+                session.cccbdb_synced = 0
+            else:
+                self._count('warmups_skipped')
+            yield session
+        except Exception:
+            # the server state of this session is unknown now, warm it up again next time
+            self.mark_cold(session)
+            raise
+        finally:
+            self._idle.put(session)
+
+    def mark_cold(self, session):
+        """
+        Make the next lease of a session visit its entry page again, e.g. after reading
+        the data page of another property, which may change where a search lands.
+        """
+        session.cccbdb_entry_page = None
+
+    def get(self, session, page, referer=None):
+        """GET a page in the given session, see request()."""
+        return self.request(session, 'GET', page, referer=referer)
+
+    def post(self, session, page, data, referer=None):
+        """POST a form in the given session, see request()."""
+        return self.request(session, 'POST', page, data, referer)
+
+    def request(self, session, method, page, data=None, referer=None):
+        """
+        Send a request in a leased session, or serve it from the cache.
+
+        A formula search (getformx.asp) replaces the selected molecule of the session
+        and a selection (gotonex.asp) refines it, every other page only reads it.
+
+        Args:
+            session: Session leased with session()
+            method: 'GET' or 'POST'
+            page: CCCBDB page or absolute URL
+            data: Form data of a POST
+            referer: Referer page or URL, defaults to the entry page of the session
+
+        Returns:
+            The requests.Response, or a CachedResponse, with the cache_key it is stored under (None
+            when it is not cached) for discard()
+        """
+        url = self.url(page)
+        step = (method, url, data)
+        chain = session.cccbdb_chain
+        if page == SEARCH_PAGE:
+            context, new_chain = chain[:1], chain[:1] + [step]
+        elif page == SELECT_PAGE:
+            context, new_chain = chain, chain + [step]
+        else:
+            context, new_chain = chain, chain
+
+        key = None
+        if self.cache is not None:
+            key = request_key(method, url, data, context)
+            cached = self.cache.get(key)
+            self.metrics.inc('cache_requests_total', result='miss' if cached is None else 'hit')
+            if cached is not None:
+                # the server only still agrees with the part of the chain this request kept
+                session.cccbdb_synced = min(session.cccbdb_synced, len(context))
+                session.cccbdb_chain = new_chain
+                cached.cache_key = key
+                return cached
+            if self.offline:
+                raise CacheMiss(f"{method} {url} is not in the cache (offline mode)")
+
+        # replay the state-changing requests that were served from the cache so far
+        for replay_method, replay_url, replay_data in context[session.cccbdb_synced:]:
+            replayed = self._send(session, replay_method, replay_url, replay_data, chain[0][1])
+            if replayed.status_code != 200:
+                # the server did not take the step, the request would read the page of another molecule
+                # or property: its failure is the answer, and the next request replays the step again
+                replayed.cache_key = None
+                return replayed
+            session.cccbdb_synced += 1
+
+        response = self._send(session, method, url, data, referer or chain[0][1])
+        session.cccbdb_chain = new_chain
+        session.cccbdb_synced = len(new_chain)
+        response.cache_key = None
+        if key is not None and response.status_code == 200:
+            # the lookups discard() the pages they do not recognize, e.g. those of an overloaded server
+            self.cache.put(key, response)
+            response.cache_key = key
+        return response
+
+    def discard(self, key):
+        """
+        Drop a response from the cache by its cache_key, so that a retry downloads it again.
+        Called for the pages a lookup found transient (unrecognized page, missing data table).
+        """
+        if self.cache is not None and key is not None:
+            self.cache.invalidate(key)
+            self.metrics.inc('cache_discards_total')
+
+    def _send(self, session, method, url, data, referer):
+        metrics = self.metrics
+        if self.limiter is None:
+            return self._send_request(session, method, url, data, referer)
+        with span('adaptive_limit'):
+            metrics.observe('limit_wait_seconds', self.limiter.acquire())
+        start = time.perf_counter()
+        try:
+            response = self._send_request(session, method, url, data, referer)
+        except Exception as e:
+            self.limiter.release(time.perf_counter() - start, is_overload(exception=e))
+            raise
+        self.limiter.release(time.perf_counter() - start, is_overload(response))
+        return response
+
+    def _send_request(self, session, method, url, data, referer):
+        metrics = self.metrics
+        if self.rate_limiter is not None:
+            with span('rate_limit'):
+                metrics.observe('rate_limit_wait_seconds', self.rate_limiter.acquire())
+        warmup = (method, url, data) == session.cccbdb_chain[0]
+        page = url.rsplit('/', 1)[-1]
+        phase = 'warmup' if warmup else PHASES.get(page, 'fetch')
+        start = time.perf_counter()
+        try:
+            with span(phase, page=page, form=data):
+                if warmup:
+                    self._count('warmups')
+                    response = session.get(url, timeout=self.timeout)
+                else:
+                    response = session.request(method, url, data=data, headers=self.headers(referer),
+                                               allow_redirects=True, timeout=self.timeout)
+        except Exception as e:
+            metrics.observe('request_seconds', time.perf_counter() - start, phase=phase)
+            metrics.inc('request_errors_total', phase=phase, error=type(e).__name__)
+            raise
+        metrics.observe('request_seconds', time.perf_counter() - start, phase=phase)
+        metrics.inc('requests_total', phase=phase, status=response.status_code)
+        metrics.inc('response_bytes_total', len(response.content), phase=phase)
+        return response
+
+    def report_overload(self, reason='garbage'):
+        """Tell the adaptive limiter about an overloaded server the response status did not show, e.g. an unrecognized page."""
+        if self.limiter is not None:
+            self.limiter.report_overload(reason)
+
+    def record_miss(self, prop, category):
+        """Count a property lookup that gave up, by failure category."""
+        with self._lock:
+            self.misses[(prop, category)] += 1
+        self.metrics.inc('misses_total', property=prop, category=category)
+
+    def record_failures(self, formula, name, failures):
+        """Remember the failure category of every property the last lookup of a molecule gave up on."""
+        key = molecule_key(formula, name)
+        with self._lock:
+            if failures:
+                self._failures[key] = dict(failures)
+            else:
+                self._failures.pop(key, None)
+
+    def failures_of(self, formula, name):
+        """Failure category by property of the last lookup of a molecule, empty when it found every value."""
+        with self._lock:
+            return dict(self._failures.get(molecule_key(formula, name), {}))
+
+    def stats(self):
+        """
+        Return the pool counters together with the connection reuse counts
+        reported by the urllib3 connection pools of every session.
+        """
+        connections = 0
+        requests_sent = 0
+        with self._lock:
+            counts = dict(self._counts)
+            sessions = list(self._sessions)
+        for session in sessions:
+            for adapter in session.adapters.values():
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    connections += pool.num_connections
+                    requests_sent += pool.num_requests
+        counts['sessions'] = len(sessions)
+        counts['connections_opened'] = connections
+        counts['requests'] = requests_sent
+        counts['connections_reused'] = max(requests_sent - connections, 0)
+        if self.cache is not None:
+            counts['cache_hits'] = self.cache.hits
+            counts['cache_misses'] = self.cache.misses
+        counts['retries'] = self.retry_policy.retries
+        if self.negative_cache is not None:
+            counts['negative_hits'] = self.negative_cache.hits
+        if self.grid_store is not None:
+            counts['grid_hits'] = self.grid_store.hits
+        if self.which_index is not None:
+            counts['which_hits'] = self.which_index.hits
+            counts['which_forgotten'] = self.which_index.forgotten
+        with self._lock:
+            counts['misses'] = {f'{prop}/{category}': count for (prop, category), count in sorted(self.misses.items())}
+        return counts
+
+    def print_stats(self):
+        """Print a one-line summary of session and connection reuse."""
+        stats = self.stats()
+        summary = (f"CCCBDB client: {stats['requests']} requests over {stats['connections_opened']} connections "
+                   f"({stats['connections_reused']} reused), {stats['sessions']} sessions, "
+                   f"{stats['warmups']} warm-ups ({stats['warmups_skipped']} skipped)")
+        if self.cache is not None:
+            summary += f", cache {stats['cache_hits']} hits / {stats['cache_misses']} misses"
+        summary += f", {stats['retries']} retries"
+        if self.negative_cache is not None:
+            summary += f", {stats['negative_hits']} known misses skipped"
+        if self.grid_store is not None:
+            summary += f", {stats['grid_hits']} values read from stored grids"
+        if self.which_index is not None:
+            summary += f", {stats['which_hits']} searches skipped with indexed ids ({stats['which_forgotten']} stale)"
+        if self.limiter is not None:
+            limiter = self.limiter.summary()
+            summary += f", concurrency limit {limiter['limit']}/{limiter['maximum']} (circuit opened {limiter['circuit_opens']} times)"
+        print(summary)
+        if stats['misses']:
+            print("Lookups without value by cause: " + ", ".join(f"{key}={count}" for key, count in stats['misses'].items()))
+        phases = self.metrics.phase_summary()
+        if phases:
+            print(f"Time by phase: {phases}, {self.metrics.molecules_per_second():.2f} molecules/sec")
+        if self.metrics_json or self.metrics_prom:
+            self.metrics.write(self.metrics_json, self.metrics_prom)
+            print("Metrics saved to " + " and ".join(path for path in (self.metrics_json, self.metrics_prom) if path))
+
+    def close(self):
+        """Close every session of the pool."""
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        self._idle = queue.LifoQueue()
+
+
+def add_client_arguments(parser):
+    """Add the command line options that configure the shared client to an argparse parser."""
+    parser.add_argument('--base-url', default=None,
+                        help=f'root URL of CCCBDB, e.g. of a local cccbdb_simulator.py (default: ${BASE_URL_ENV} or {BASE_URL})')
+    parser.add_argument('--offline', action='store_true',
+                        help='only serve pages from the cache, never use the network')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write the response cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='directory of the response cache')
+    parser.add_argument('--cache-ttl-days', type=float, default=DEFAULT_TTL / 86400,
+                        help='days before a cached page is downloaded again')
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2,
+                        help='disk budget of the cache, least recently used pages are evicted beyond it')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of molecules looked up at once, each in its own pooled session')
+    parser.add_argument('--refresh-negatives', action='store_true',
+                        help='check again the lookups CCCBDB had no value for in previous runs')
+    parser.add_argument('--negative-ttl-days', type=float, default=DEFAULT_NEGATIVE_TTL / 86400,
+                        help='days before a lookup CCCBDB had no value for is checked again')
+    parser.add_argument('--retry-budget', type=int, default=None,
+                        help='total number of retries of transient failures allowed for the run')
+    parser.add_argument('--max-rate', type=float, default=2.0,
+                        help='requests per second sent to CCCBDB by all workers together')
+    parser.add_argument('--method', default=None,
+                        help='method of the dipole and quadrupole values, e.g. B3LYP (default: HF)')
+    parser.add_argument('--basis', default=None,
+                        help='basis set of the dipole and quadrupole values (default: the first one with a value)')
+    add_store_arguments(parser)
+    add_metrics_arguments(parser)
+    add_tracing_arguments(parser)
+    add_adaptive_arguments(parser)
+    parser.add_argument('--parser', choices=['auto', *EXTRACTORS], default='auto',
+                        help='HTML extraction backend, auto uses lxml when it is installed')
+
+
+def client_from_args(args):
+    """Build a client from the options added by add_client_arguments()."""
+    cache = None
+    negative_cache = None
+    grid_store = None
+    which_index = None
+    if not args.no_cache:
+        cache = HTTPCache(args.cache_dir, ttl=args.cache_ttl_days * 86400, max_bytes=int(args.cache_max_mb * 1024 ** 2))
+        negative_cache = NegativeCache(os.path.join(args.cache_dir, 'negative.sqlite'),
+                                       ttl=args.negative_ttl_days * 86400, refresh=args.refresh_negatives)
+        grid_store = GridStore(os.path.join(args.cache_dir, 'grids.sqlite'), ttl=args.cache_ttl_days * 86400)
+        # the option a molecule resolves to does not change, a stale entry is forgotten when it is used
+        which_index = WhichIndex(os.path.join(args.cache_dir, 'which.sqlite'))
+    # the trace and profile are written when the script exits
+    tracing_from_args(args)
+    # the metrics files are also updated during a long run, so a collector sees its progress
+    metrics = Metrics()
+    metrics.start_export(args.metrics_json, args.metrics_prom, args.metrics_interval)
+    client = CCCBDBClient(pool_size=args.workers, base_url=args.base_url, cache=cache, offline=args.offline, max_rate=args.max_rate,
+                          retry_policy=RetryPolicy(budget=args.retry_budget), negative_cache=negative_cache,
+                          extractor=get_extractor(args.parser), grid_store=grid_store, method=args.method,
+                          basis=args.basis, property_store=store_from_args(args), metrics=metrics,
+                          metrics_json=args.metrics_json, metrics_prom=args.metrics_prom, which_index=which_index)
+    if args.adaptive:
+        # --workers and --max-rate become the ceilings of the adaptive limit
+        client.limiter = AdaptiveLimiter(args.workers, target_p95=args.target_p95, max_error_rate=args.max_error_rate,
+                                         rate_limiter=client.rate_limiter, metrics=metrics)
+    return client
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the client shared by every scraper, creating it on first use."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = CCCBDBClient()
+        return _default_client
+
+
+def set_client(client):
+    """Replace the shared client, e.g. to change the pool size or base URL."""
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
@@ -0,0 +1,270 @@
+# Reads the values out of CCCBDB pages, with a BeautifulSoup backend and a faster lxml backend
+from bs4 import BeautifulSoup
+
+from cccbdb_failures import MISSING_METHOD, PARSE_FAILURE, TRANSIENT, Failure
+from method_grid import MethodGrid
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # lxml is optional, the BeautifulSoup backend works without it
+    etree = None
+    lxml_html = None
+
+
+def parse_selection_options(selection_table):
+    """
+    Collect the ground state / minimum options of a CCCBDB selection page.
+
+    Args:
+        selection_table: The bordered table of the selection page
+
+    Returns:
+        List of dictionaries with the keys value (the 'which' id), formula, name and row_text
+    """
+    ground_min_options = []
+    radio_buttons = selection_table.find_all('input', type='radio', attrs={'name': 'which'})
+
+    for radio in radio_buttons:
+        row = radio.find_parent('tr')
+        row_text = row.get_text().lower()
+
+        if 'ground' in row_text and 'minimum' in row_text:
+            which_value = radio.get('value')
+
+            # Extract molecule name
+            cells = row.find_all('td')
+            molecule_formula = ""
+            molecule_name = ""
+
+            # Try to identify formula and name cells
+            for i, cell in enumerate(cells):
+                if i == 1 and cell.has_attr('rowspan'):  # Usually formula cell
+                    molecule_formula = cell.text.strip()
+                elif i == 2 and cell.has_attr('rowspan'):  # Usually name cell
+                    molecule_name = cell.text.strip()
+
+            # If we still don't have a name, try another approach
+            if not molecule_name:
+                for cell in cells:
+                    cell_text = cell.text.strip()
+                    if len(cell_text) > 3 and cell_text.lower() not in ['ground', 'minimum']:
+                        if not molecule_formula:
+                            molecule_formula = cell_text
+                        else:
+                            molecule_name = cell_text
+                            break
+
+            ground_min_options.append({
+                'value': which_value,
+                'formula': molecule_formula,
+                'name': molecule_name,
+                'row_text': row_text
+            })
+
+    return ground_min_options
+
+
+def parse_rotational_constants(soup):
+    """
+    Read the rotational constants from the "num bordered" cell of table2.
+
+    Returns:
+        Tuple (list of constants, failure) where failure is a cccbdb_failures.Failure when no value was found
+    """
+    table2 = soup.find('table', id='table2')
+    if not table2:
+        return None, Failure(TRANSIENT, "Could not find rotational constants table")
+
+    bordered_cell = table2.find('td', class_='num bordered')
+    if not bordered_cell:
+        return None, Failure(MISSING_METHOD, "Could not find cell with class 'num bordered'")
+
+    # The values are separated by <BR> tags
+    return _constants(bordered_cell.get_text(separator='<BR>', strip=True), bordered_cell.text)
+
+
+def parse_method_grid(soup):
+    """
+    Read every method / basis set value of table2 of a dipole or quadrupole data page.
+
+    Returns:
+        Tuple (method_grid.MethodGrid, failure) where failure is a cccbdb_failures.Failure when there is no table
+    """
+    table2 = soup.find('table', id='table2')
+    if not table2:
+        return None, Failure(TRANSIENT, "Could not find data table")
+
+    rows = []
+    for tr in table2.find_all('tr'):
+        row = []
+        for cell in tr.find_all(['th', 'td'], recursive=False):
+            link = cell.a
+            row.append((cell.name, ' '.join(cell.get('class', [])), cell.get_text().strip(),
+                        link.get_text() if link else None))
+        rows.append(row)
+    return MethodGrid.from_rows(rows), None
+
+
+def _constants(cell_content, cell_text):
+    try:
+        return [float(val.strip()) for val in cell_content.split('<BR>')], None
+    except ValueError:
+        return None, Failure(PARSE_FAILURE, f"Could not convert {cell_text} to float values")
+
+
+class BeautifulSoupExtractor:
+    """
+    Parses the whole page with BeautifulSoup and html.parser. Slow, but needs nothing
+    besides bs4; it is the reference the other backends are compared with.
+    """
+
+    name = 'bs4'
+
+    def document(self, text):
+        """Parse a page once, the result is passed to the other methods."""
+        return BeautifulSoup(text, 'html.parser')
+
+    def selection_options(self, document):
+        """The ground state / minimum options of a selection page, None if the page is not one."""
+        selection_table = document.find('table', {'border': '1'})
+        selection_form = document.find('form', {'action': 'gotonex.asp'})
+        if not (selection_table and selection_form):
+            return None
+        return parse_selection_options(selection_table)
+
+    def has_data_table(self, document):
+        return document.find('table', id='table2') is not None
+
+    def rotational_constants(self, document):
+        return parse_rotational_constants(document)
+
+    def method_grid(self, document):
+        return parse_method_grid(document)
+
+
+if etree is not None:
+    # compiled once, every page is matched against the same expressions
+    _SELECTION_TABLE = etree.XPath("(//table[@border='1'])[1]")
+    _HAS_SELECTION_FORM = etree.XPath("boolean(//form[@action='gotonex.asp'])")
+    _RADIOS = etree.XPath(".//input[@type='radio'][@name='which']")
+    _ROW = etree.XPath("ancestor::tr[1]")
+    _CELLS = etree.XPath(".//td")
+    _TABLE2 = etree.XPath("(//table[@id='table2'])[1]")
+    _FIRST_VALUE_CELL = etree.XPath("(.//td[normalize-space(@class)='num bordered'])[1]")
+    _FIRST_LINK = etree.XPath("(.//a)[1]")
+    _TEXTS = etree.XPath(".//text()")
+    _ROWS = etree.XPath(".//tr")
+    _ROW_CELLS = etree.XPath("th|td")
+
+
+def _text(element):
+    # like BeautifulSoup's .text: all the text in the element, without comments
+    return ''.join(_TEXTS(element))
+
+
+class LxmlExtractor:
+    """
+    Parses the page with lxml and goes straight to the needed tables and cells with
+    precompiled XPath expressions. Gives the same results as BeautifulSoupExtractor
+    on well formed pages; run benchmark_extraction.py on a saved corpus to compare them.
+    """
+
+    name = 'lxml'
+
+    def __init__(self):
+        if etree is None:
+            raise ImportError("The lxml backend needs lxml: pip install lxml")
+
+    def document(self, text):
+        """Parse a page once, the result is passed to the other methods."""
+        return lxml_html.document_fromstring(text if text.strip() else '<html></html>')
+
+    def selection_options(self, document):
+        """The ground state / minimum options of a selection page, None if the page is not one."""
+        tables = _SELECTION_TABLE(document)
+        if not (tables and _HAS_SELECTION_FORM(document)):
+            return None
+
+        ground_min_options = []
+        for radio in _RADIOS(tables[0]):
+            row = _ROW(radio)[0]
+            row_text = _text(row).lower()
+            if not ('ground' in row_text and 'minimum' in row_text):
+                continue
+
+            cells = _CELLS(row)
+            molecule_formula = ""
+            molecule_name = ""
+            for i, cell in enumerate(cells):
+                if i == 1 and 'rowspan' in cell.attrib:
+                    molecule_formula = _text(cell).strip()
+                elif i == 2 and 'rowspan' in cell.attrib:
+                    molecule_name = _text(cell).strip()
+
+            if not molecule_name:
+                for cell in cells:
+                    cell_text = _text(cell).strip()
+                    if len(cell_text) > 3 and cell_text.lower() not in ['ground', 'minimum']:
+                        if not molecule_formula:
+                            molecule_formula = cell_text
+                        else:
+                            molecule_name = cell_text
+                            break
+
+            ground_min_options.append({
+                'value': radio.get('value'),
+                'formula': molecule_formula,
+                'name': molecule_name,
+                'row_text': row_text
+            })
+        return ground_min_options
+
+    def has_data_table(self, document):
+        return bool(_TABLE2(document))
+
+    def rotational_constants(self, document):
+        tables = _TABLE2(document)
+        if not tables:
+            return None, Failure(TRANSIENT, "Could not find rotational constants table")
+
+        cells = _FIRST_VALUE_CELL(tables[0])
+        if not cells:
+            return None, Failure(MISSING_METHOD, "Could not find cell with class 'num bordered'")
+
+        # the same as get_text(separator='<BR>', strip=True) of BeautifulSoup
+        texts = [text.strip() for text in _TEXTS(cells[0])]
+        return _constants('<BR>'.join(text for text in texts if text), _text(cells[0]))
+
+    def method_grid(self, document):
+        tables = _TABLE2(document)
+        if not tables:
+            return None, Failure(TRANSIENT, "Could not find data table")
+
+        rows = []
+        for tr in _ROWS(tables[0]):
+            row = []
+            for cell in _ROW_CELLS(tr):
+                links = _FIRST_LINK(cell)
+                row.append((cell.tag, ' '.join(cell.get('class', '').split()), _text(cell).strip(),
+                            _text(links[0]) if links else None))
+            rows.append(row)
+        return MethodGrid.from_rows(rows), None
+
+
+EXTRACTORS = {
+    'bs4': BeautifulSoupExtractor,
+    'lxml': LxmlExtractor,
+}
+
+
+def get_extractor(name='auto'):
+    """
+    Return an extractor by name: 'bs4', 'lxml', or 'auto' for lxml when it is installed
+    and BeautifulSoup otherwise.
+    """
+    if name == 'auto':
+        name = 'lxml' if etree is not None else 'bs4'
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor {name}, choose from {', '.join(EXTRACTORS)} or auto")
+    return EXTRACTORS[name]()
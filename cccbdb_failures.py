@@ -0,0 +1,126 @@
+# Why a CCCBDB lookup failed, and which failures are worth retrying
+import random
+import threading
+from collections import namedtuple
+
+import requests
+
+from checkpoint import molecule_key
+from json_store import JSONStore
+
+
+# the formula (or a ground state / minimum of it) is not in CCCBDB
+NOT_FOUND = 'not_found'
+# the molecule is there but the page has no value for the method (no HF row, or an empty value cell)
+MISSING_METHOD = 'missing_method'
+# the value cell is there but could not be read, or the scraper itself failed
+PARSE_FAILURE = 'parse_failure'
+# network errors, timeouts, HTTP 429/5xx and unrecognized pages returned by an overloaded server
+TRANSIENT = 'transient'
+# offline mode and the page is not in the cache
+NOT_CACHED = 'not_cached'
+
+PERMANENT = (NOT_FOUND, MISSING_METHOD, PARSE_FAILURE)
+# misses that mean CCCBDB does not have the value, remembered by the NegativeCache
+NEGATIVE = (NOT_FOUND, MISSING_METHOD)
+ALL_CATEGORIES = (NOT_FOUND, MISSING_METHOD, PARSE_FAILURE, TRANSIENT, NOT_CACHED)
+
+Failure = namedtuple('Failure', ['category', 'message'])
+
+
+def status_failure(response):
+    """Return a TRANSIENT Failure for HTTP 429 and 5xx responses, None otherwise."""
+    if response.status_code == 429 or response.status_code >= 500:
+        return Failure(TRANSIENT, f"HTTP {response.status_code} for {response.url}")
+    return None
+
+
+def classify_exception(exception):
+    """Map an exception raised during a lookup to a Failure."""
+    if isinstance(exception, requests.RequestException):
+        return Failure(TRANSIENT, f"{type(exception).__name__}: {exception}")
+    return Failure(PARSE_FAILURE, f"{type(exception).__name__}: {exception}")
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter for transient failures, with a retry budget per run.
+
+    The n-th retry waits base_delay * 2 ** (n - 1) seconds, capped at max_delay, and
+    shortened by a random fraction of up to jitter so that concurrent workers do not
+    retry in lockstep. Permanent failures are never retried.
+
+    Args:
+        max_retries: Number of attempts per lookup
+        base_delay: Delay in seconds before the first retry
+        max_delay: Longest delay between two attempts
+        jitter: Largest fraction (0 to 1) taken off a delay at random
+        budget: Total number of retries allowed for the run, None for no limit
+    """
+
+    def __init__(self, max_retries=3, base_delay=2, max_delay=60, jitter=0.5, budget=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.budget = budget
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def should_retry(self, failure):
+        return failure.category == TRANSIENT
+
+    def take_retry(self):
+        """Use up one retry of the budget. Returns False once the budget is exhausted."""
+        with self._lock:
+            if self.budget is not None and self.retries >= self.budget:
+                return False
+            self.retries += 1
+            return True
+
+    def delay(self, attempt, base_delay=None):
+        """Seconds to wait after the given (1-based) failed attempt."""
+        base = self.base_delay if base_delay is None else base_delay
+        backoff = min(self.max_delay, base * 2 ** (attempt - 1))
+        return backoff * (1 - self.jitter * random.random())
+
+
+DEFAULT_NEGATIVE_TTL = 90 * 24 * 3600  # 90 days
+
+
+class NegativeCache:
+    """
+    Persistent record of the (formula, name, property, method) lookups CCCBDB has no value for.
+
+    Args:
+        path: SQLite file of the cache
+        ttl: Seconds after which a miss is checked again on CCCBDB
+        refresh: Ignore the recorded misses and check every lookup again (new misses are still recorded)
+    """
+
+    def __init__(self, path, ttl=DEFAULT_NEGATIVE_TTL, refresh=False):
+        self.refresh = refresh
+        self.hits = 0
+        self._lock = threading.Lock()  # the workers of a run share the cache
+        self._store = JSONStore(path, table='negatives', ttl=ttl)
+
+    @staticmethod
+    def _key(formula, name, prop, method):
+        return molecule_key(formula, name) + (prop, method)
+
+    def get(self, formula, name, prop, method):
+        """Return the failure category of a known miss, or None."""
+        if self.refresh:
+            return None
+        category = self._store.get(self._key(formula, name, prop, method))
+        if category is not None:
+            with self._lock:
+                self.hits += 1
+        return category
+
+    def put(self, formula, name, prop, method, category):
+        if category in NEGATIVE:
+            self._store.put(self._key(formula, name, prop, method), category)
+
+    def forget(self, formula, name, prop, method):
+        self._store.delete(self._key(formula, name, prop, method))
@@ -0,0 +1,650 @@
+# Fetches several CCCBDB properties of a molecule (dipole moment, quadrupole moment and
+# rotational constants) with a single search and selection per molecule
+import argparse
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from cccbdb_client import add_client_arguments, client_from_args, get_client, set_client
+from checkpoint import molecule_key
+from cccbdb_failures import NOT_CACHED, NOT_FOUND, TRANSIENT, Failure, classify_exception, status_failure
+from concurrent_scraper import fetch_values
+from http_cache import CacheMiss
+from table_io import add_format_arguments, find_table, format_from_args, read_table, with_format, write_table
+from tracing import span
+
+
+# For every property: the entry page that routes the formula search to the property,
+# and the data page that can be read with a plain GET once a molecule is selected
+PROPERTY_PAGES = {
+    'rotational': ('rotcalc1x.asp', 'rotcalc2x.asp'),
+    'dipole': ('dipole1x.asp', 'dipole2x.asp'),
+    'quadrupole': ('quadrupole1x.asp', 'quadrupole2x.asp'),
+}
+ALL_PROPERTIES = ('rotational', 'dipole', 'quadrupole')
+
+# computational method whose value is read for each property by default
+PROPERTY_METHODS = {
+    'rotational': None,
+    'dipole': 'HF',
+    'quadrupole': 'HF',
+}
+
+PROPERTY_LABELS = {
+    'rotational': 'Rotational constants',
+    'dipole': 'Dipole moment',
+    'quadrupole': 'Quadrupole moment',
+}
+
+# columns written to the CSV files for each property
+PROPERTY_COLUMNS = {
+    'rotational': ['Rotational Constant 1', 'Rotational Constant 2', 'Rotational Constant 3'],
+    'dipole': ['Dipole Moment'],
+    'quadrupole': ['Quadrupole Moment'],
+}
+
+
+def select_option(ground_min_options, name=None):
+    """Pick the option whose name matches the given name, or the first option."""
+    if len(ground_min_options) > 1 and name:
+        # Try to find the option matching the specified name
+        for option in ground_min_options:
+            if option['name'] and name.lower() in option['name'].lower():
+                return option
+    # If no name specified, no match found or only one option, use the first option
+    return ground_min_options[0]
+
+
+# extractor method that reads each property from its data page
+PARSERS = {
+    'rotational': 'rotational_constants',
+    'dipole': 'method_grid',
+    'quadrupole': 'method_grid',
+}
+# properties whose data page is a method x basis set table, read into a method_grid.MethodGrid
+GRID_PROPERTIES = ('dipole', 'quadrupole')
+
+
+def parse_property(extractor, prop, document):
+    """
+    Read a property from a page parsed by extractor.document().
+
+    Returns:
+        Tuple (value, failure), for GRID_PROPERTIES the value is the MethodGrid of the page
+    """
+    return getattr(extractor, PARSERS[prop])(document)
+
+
+def method_key(prop, method=None, basis=None):
+    """The method (and basis set) a property value is read for, e.g. 'HF' or 'B3LYP/6-31G*'."""
+    if prop not in GRID_PROPERTIES:
+        return PROPERTY_METHODS[prop]
+    method = method or PROPERTY_METHODS[prop]
+    return method if basis is None else f"{method}/{basis}"
+
+
+def indexed_option(client, formula, name):
+    """
+    The option a molecule was resolved to before, from the which index of the client.
+
+    Returns:
+        Dictionary with which, cccbdb_name and options, or None when the formula has to be searched
+    """
+    # the cached pages of offline mode were downloaded after a search, a direct selection is not among them
+    if client.which_index is None or client.offline:
+        return None
+    return client.which_index.get(formula, name)
+
+
+def resolve_molecule(client, session, formula, name, option=None):
+    """
+    Search a formula and, if CCCBDB shows a selection page, select the molecule.
+
+    The entry page the session was leased for decides the data page the server
+    lands on after the search. With a which index on the client, a molecule
+    resolved before is selected right away with its 'which' id; when that does not
+    lead to a data page any more, the entry is forgotten and the formula searched.
+
+    Args:
+        option: Option of the selection page to select (a dictionary with value and name, see
+            isomer_options()) instead of the one matching name
+
+    Returns:
+        Tuple (landing page parsed by client.extractor, selected option or None, cccbdb_failures.Failure or None,
+        the response of the landing page or None)
+    """
+    extractor = client.extractor
+    indexed = indexed_option(client, formula, name) if option is None else None
+    if indexed is not None:
+        shortcut = {'name': indexed['cccbdb_name'], 'value': indexed['which']}
+    else:
+        shortcut = option
+    if shortcut is not None:
+        response = client.post(session, 'gotonex.asp', {'which': shortcut['value']})
+        failure = status_failure(response)
+        if failure:
+            return None, None, failure, None
+        with client.metrics.timer('parse_seconds', page='selection'), span('parse', page='selection'):
+            document = extractor.document(response.text)
+        if extractor.has_data_table(document):
+            print(f"Selected option: {shortcut['name']} with value: {shortcut['value']} without a search")
+            return document, shortcut, None, response
+        print(f"Option {shortcut['value']} of {formula} does not lead to a data page, searching again")
+        client.discard(response.cache_key)
+        if indexed is not None:
+            client.which_index.forget(formula, name)
+
+    # Post the form data to search for the formula
+    response = client.post(session, 'getformx.asp', {'formula': formula, 'submit1': 'Submit'})
+    failure = status_failure(response)
+    if failure:
+        return None, None, failure, None
+
+    # Check if the page shows no results
+    if "No entries found" in response.text:
+        return None, None, Failure(NOT_FOUND, f"No entries found for {formula}"), None
+
+    # Check which page we landed on
+    with client.metrics.timer('parse_seconds', page='search'), span('parse', page='search'):
+        document = extractor.document(response.text)
+        ground_min_options = extractor.selection_options(document)
+
+    if ground_min_options is not None:
+        print("Landed on selection page with multiple options")
+        if not ground_min_options:
+            return None, None, Failure(NOT_FOUND, "No ground/minimum options found"), None
+
+        if option is None:
+            selected_option = select_option(ground_min_options, name)
+        else:
+            selected_option = next((entry for entry in ground_min_options if entry['value'] == option['value']), None)
+            if selected_option is None:
+                return None, None, Failure(NOT_FOUND, f"Option {option['value']} is not on the selection page"), None
+        print(f"Selected option: {selected_option['name']} with value: {selected_option['value']}")
+        if client.which_index is not None:
+            client.which_index.put(formula, name, selected_option, ground_min_options)
+
+        # Submit the selection form, the referer is the selection page
+        response = client.post(session, 'gotonex.asp', {'which': selected_option['value']}, referer=response.url)
+        failure = status_failure(response)
+        if failure:
+            return None, None, failure, None
+        with client.metrics.timer('parse_seconds', page='selection'), span('parse', page='selection'):
+            return extractor.document(response.text), selected_option, None, response
+
+    if extractor.has_data_table(document):
+        print("Directly landed on data page")
+        return document, None, None, response
+
+    # an overloaded server answers with pages we do not recognize, so this is worth a retry (of the server,
+    # not of the cache)
+    client.report_overload()
+    client.discard(response.cache_key)
+    return None, None, Failure(TRANSIENT, "Landed on unrecognized page"), None
+
+
+def fetch_molecule_properties(formula, name=None, properties=ALL_PROPERTIES, max_retries=None, retry_delay=None, client=None,
+                              method=None, basis=None, option=None):
+    """
+    Resolve a molecule once and read every requested property in the same session.
+
+    Lookups are remembered by the client for the rest of the run: asking again for the
+    same molecule_key() and properties, or while the first lookup is still in flight in
+    another worker, returns the same record without any request.
+
+    The search is routed through the entry page of the first property, the landing
+    page is parsed for that property and the data pages of the other properties are
+    read with plain GETs. Dipole and quadrupole pages are read into a MethodGrid of every
+    method and basis set; with a grid store on the client the grids are kept, and a later
+    lookup of the molecule with any method or basis set is answered from the store without
+    any request. Only properties that failed for a transient reason are
+    retried, with a new search, exponential backoff and jitter, as long as the retry
+    budget of the client's RetryPolicy lasts. Permanent misses (not found, missing
+    method, parse failure) are given up right away, and with a negative cache the
+    lookups CCCBDB has no value for are remembered and not sent again.
+
+    Args:
+        formula: Chemical formula searched on CCCBDB
+        name: Molecule name used to choose between several ground state options
+        properties: Any of 'rotational', 'dipole' and 'quadrupole'
+        max_retries: Number of attempts, defaults to the client's RetryPolicy
+        retry_delay: Delay in seconds before the first retry, defaults to the client's RetryPolicy
+        client: CCCBDBClient whose pooled sessions are used, defaults to the shared client
+        method: Method of the dipole and quadrupole values, defaults to the method of the client,
+            then to PROPERTY_METHODS ('HF')
+        basis: Basis set of the dipole and quadrupole values, defaults to the basis set of the client,
+            None for the first one with a value
+        option: Option of the selection page to look up, selected by its 'which' id, instead of
+            the one matching name (see fetch_isomer_properties())
+
+    Returns:
+        Dictionary with formula, name, cccbdb_name, which, one entry per property
+        (None when the property could not be found) and 'failures', the failure
+        category of every property without value
+    """
+    if client is None:
+        client = get_client()
+    method = method or client.method
+    basis = basis if basis is not None else client.basis
+    key = (molecule_key(formula, name), tuple(properties), method, basis, option and option['value'])
+    return client.lookups.do(key, lambda: _fetch_molecule_properties(formula, name, properties, max_retries,
+                                                                     retry_delay, client, method, basis, option))
+
+
+def _fetch_molecule_properties(formula, name, properties, max_retries, retry_delay, client, method, basis, option=None):
+    metrics = client.metrics
+    with metrics.timer('molecule_seconds'):
+        record = _lookup_molecule(formula, name, properties, max_retries, retry_delay, client, method, basis, option)
+    found = all(record[prop] is not None for prop in properties)
+    metrics.inc('molecules_total', result='found' if found else 'missing')
+    return record
+
+
+def new_record(formula, name, properties):
+    """The record of a lookup before anything is known, see fetch_molecule_properties()."""
+    record = {'formula': formula, 'name': name, 'cccbdb_name': None, 'which': None}
+    record.update({prop: None for prop in properties})
+    return record
+
+
+def select_value(client, record, prop, value, failure, method=None, basis=None):
+    """
+    Turn what parse_property() read into the value of the record: the whole grid of a dipole /
+    quadrupole page is kept in the grid store of the client, then the method is looked up in it.
+
+    Returns:
+        Tuple (value, failure)
+    """
+    if prop not in GRID_PROPERTIES or value is None:
+        return value, failure
+    if client.grid_store is not None:
+        client.grid_store.put(record['formula'], record['name'], prop, value, record['cccbdb_name'], record['which'])
+    return value.select(method or PROPERTY_METHODS[prop], basis)
+
+
+def stored_answers(client, record, missing, failures, methods, method=None, basis=None):
+    """
+    Answer the properties of missing whose grid was downloaded before from the grid store, and
+    give up on those CCCBDB is known not to have from the negative cache. The answered
+    properties are removed from missing.
+
+    Returns:
+        Set of the properties given up as known misses
+    """
+    formula, name = record['formula'], record['name']
+    metrics = client.metrics
+    grid_store = client.grid_store
+    if grid_store is not None:
+        for prop in [prop for prop in missing if prop in GRID_PROPERTIES]:
+            stored = grid_store.get(formula, name, prop)
+            if stored is None:
+                continue
+            grid, record['cccbdb_name'], record['which'] = stored
+            print(f"Read the {methods[prop]} {PROPERTY_LABELS[prop].lower()} of {formula} from the stored grid")
+            metrics.inc('stored_values_total', source='grid_store', property=prop)
+            value, failure = grid.select(method or PROPERTY_METHODS[prop], basis)
+            if value is None:
+                failures[prop] = failure
+            else:
+                record[prop] = value
+            missing.remove(prop)
+
+    # skip the properties CCCBDB is already known not to have
+    negative_cache = client.negative_cache
+    if negative_cache is not None:
+        for prop in list(missing):
+            category = negative_cache.get(formula, name, prop, methods[prop])
+            if category is not None:
+                print(f"Known miss ({category}) for {PROPERTY_LABELS[prop].lower()} of {formula}, skipping")
+                metrics.inc('stored_values_total', source='negative_cache', property=prop)
+                failures[prop] = Failure(category, "known miss")
+                missing.remove(prop)
+    return set(failures)
+
+
+def finish_record(client, record, properties, failures, methods, known_misses=()):
+    """
+    Complete a record once its lookup is over: the failure category of every property without
+    value, the misses counted and remembered in the negative cache, and the lookup recorded in
+    the property store.
+    """
+    formula, name = record['formula'], record['name']
+    negative_cache = client.negative_cache
+    record['failures'] = {prop: failure.category for prop, failure in failures.items()}
+    client.record_failures(formula, name, record['failures'])
+    for prop, category in record['failures'].items():
+        client.record_miss(prop, category)
+        if negative_cache is not None and prop not in known_misses:
+            negative_cache.put(formula, name, prop, methods[prop], category)
+    if negative_cache is not None and negative_cache.refresh:
+        # a recheck may have found a value for a former miss
+        for prop in properties:
+            if record[prop] is not None:
+                negative_cache.forget(formula, name, prop, methods[prop])
+    if client.property_store is not None:
+        client.property_store.record_lookup(record, methods)
+    return record
+
+
+def _lookup_molecule(formula, name, properties, max_retries, retry_delay, client, method, basis, option=None):
+    metrics = client.metrics
+    policy = client.retry_policy
+    if max_retries is None:
+        max_retries = policy.max_retries
+
+    record = new_record(formula, name, properties)
+    missing = list(properties)
+    failures = {}
+    methods = {prop: method_key(prop, method, basis) for prop in properties}
+
+    def read(prop, document):
+        with metrics.timer('parse_seconds', page=prop), span('parse', page=prop):
+            value, failure = parse_property(client.extractor, prop, document)
+        return select_value(client, record, prop, value, failure, method, basis)
+
+    known_misses = stored_answers(client, record, missing, failures, methods, method, basis)
+
+    for attempt in range(1, max_retries + 1):
+        if not missing:
+            break
+        print(f"Attempt {attempt}/{max_retries} for {formula}" + (f" with name: {name}" if name else ""))
+
+        with span('attempt', formula=formula, attempt=attempt):
+            try:
+                landing_prop = missing[0]
+                entry_page = PROPERTY_PAGES[landing_prop][0]
+                with client.session(entry_page) as session:
+                    document, selected_option, failure, landing_response = resolve_molecule(client, session, formula,
+                                                                                              name, option)
+
+                    if failure is None:
+                        if selected_option:
+                            record['cccbdb_name'] = selected_option['name']
+                            record['which'] = selected_option['value']
+
+                        for prop in list(missing):
+                            # the landing page belongs to the property the search was routed through and is
+                            # its data page, a value it does not have is not on a second download of it either
+                            if prop == landing_prop:
+                                value, failure = read(prop, document)
+                                if value is None and failure.category == TRANSIENT:
+                                    client.discard(landing_response.cache_key)
+                            else:
+                                value = None
+                                data_response = client.get(session, PROPERTY_PAGES[prop][1])
+                                client.mark_cold(session)
+                                failure = status_failure(data_response)
+                                if failure is None:
+                                    with metrics.timer('parse_seconds', page=prop), span('parse', page=prop):
+                                        data_document = client.extractor.document(data_response.text)
+                                    value, failure = read(prop, data_document)
+                                    if value is None and failure.category == TRANSIENT:
+                                        client.discard(data_response.cache_key)
+
+                            if value is None:
+                                print(f"{failure.message} for {PROPERTY_LABELS[prop].lower()} of {formula} on attempt {attempt}")
+                                failures[prop] = failure
+                            else:
+                                record[prop] = value
+                                missing.remove(prop)
+                                failures.pop(prop, None)
+                    else:
+                        print(f"{failure.message} on attempt {attempt}")
+                        failures.update((prop, failure) for prop in missing)
+
+            except CacheMiss as e:
+                # retrying cannot help in offline mode
+                print(f"{e}, giving up on {formula}")
+                failures.update((prop, Failure(NOT_CACHED, str(e))) for prop in missing)
+                break
+            except Exception as e:
+                print(f"An error occurred for {formula} on attempt {attempt}: {str(e)}")
+                failure = classify_exception(e)
+                if failure.category != TRANSIENT:
+                    traceback.print_exc()
+                failures.update((prop, failure) for prop in missing)
+
+        # permanent misses are not retried, only the properties that failed transiently
+        missing = [prop for prop in missing if policy.should_retry(failures[prop])]
+        if not missing or attempt == max_retries:
+            break
+        if not policy.take_retry():
+            print(f"Retry budget of {policy.budget} exhausted, giving up on {formula}")
+            break
+        for category in sorted({failures[prop].category for prop in missing}):
+            metrics.inc('retries_total', category=category)
+        delay = policy.delay(attempt, retry_delay)
+        print(f"Retrying in {delay:.1f} seconds...")
+        with span('sleep', reason='retry', seconds=delay):
+            time.sleep(delay)
+        metrics.observe('sleep_seconds', delay, reason='retry')
+
+    return finish_record(client, record, properties, failures, methods, known_misses)
+
+
+def isomer_options(client, formula, properties=ALL_PROPERTIES, max_retries=None):
+    """
+    The ground state / minimum options of the selection page of a formula, from the which index
+    of the client or with one search (retried on transient failures).
+
+    Returns:
+        Tuple (list of options, each a dictionary with value and name, or None when the search does
+        not show a selection page, cccbdb_failures.Failure or None)
+    """
+    if client.which_index is not None and not client.offline:
+        options = client.which_index.options(formula)
+        if options:
+            return options, None
+    policy = client.retry_policy
+    max_retries = policy.max_retries if max_retries is None else max_retries
+    extractor = client.extractor
+    failure = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            with client.session(PROPERTY_PAGES[properties[0]][0]) as session:
+                response = client.post(session, 'getformx.asp', {'formula': formula, 'submit1': 'Submit'})
+                failure = status_failure(response)
+                if failure is None:
+                    if "No entries found" in response.text:
+                        return None, Failure(NOT_FOUND, f"No entries found for {formula}")
+                    with client.metrics.timer('parse_seconds', page='search'), span('parse', page='search'):
+                        document = extractor.document(response.text)
+                        options = extractor.selection_options(document)
+                    if options is not None or extractor.has_data_table(document):
+                        break
+                    client.report_overload()
+                    client.discard(response.cache_key)
+                    failure = Failure(TRANSIENT, "Landed on unrecognized page")
+        except CacheMiss as e:
+            return None, Failure(NOT_CACHED, str(e))
+        except Exception as e:
+            failure = classify_exception(e)
+        if not policy.should_retry(failure) or attempt == max_retries or not policy.take_retry():
+            return None, failure
+        client.metrics.inc('retries_total', category=failure.category)
+        delay = policy.delay(attempt)
+        print(f"{failure.message} for the options of {formula}, retrying in {delay:.1f} seconds...")
+        with span('sleep', reason='retry', seconds=delay):
+            time.sleep(delay)
+        client.metrics.observe('sleep_seconds', delay, reason='retry')
+
+    if options and client.which_index is not None:
+        # every isomer can be selected without a search from now on
+        for option in options:
+            client.which_index.put(formula, option['name'], option, options)
+    return options, None
+
+
+def fetch_isomer_properties(formula, name=None, properties=ALL_PROPERTIES, client=None, method=None, basis=None):
+    """
+    Look up every ground state / minimum isomer of a formula: the selection page is read once
+    and the options are looked up concurrently, each selected by its 'which' id in its own session.
+
+    Returns:
+        List of records (see fetch_molecule_properties()), one per isomer with its cccbdb_name and
+        which; a single record when CCCBDB shows no selection page for the formula
+    """
+    if client is None:
+        client = get_client()
+    options, failure = isomer_options(client, formula, properties)
+    if not options:
+        if failure is not None and failure.category != TRANSIENT:
+            print(f"{failure.message}, no isomers of {formula}")
+        # a formula without selection page is one molecule, looked up as usual (with a second search, the
+        # lookup reads every property with its retries and stores)
+        return [fetch_molecule_properties(formula, name, properties, client=client, method=method, basis=basis)]
+    print(f"Looking up {len(options)} isomers of {formula}")
+
+    def fetch(option):
+        return fetch_molecule_properties(formula, option['name'] or name, properties, client=client, method=method,
+                                         basis=basis, option=option)
+
+    # the sessions of the client limit the isomers looked up at once
+    with ThreadPoolExecutor(min(len(options), client.pool_size)) as pool:
+        return list(pool.map(fetch, options))
+
+
+def fetch_property(prop, formula, name=None, max_retries=None, retry_delay=None, client=None, method=None, basis=None):
+    """Fetch a single property, returning its value or None."""
+    record = fetch_molecule_properties(formula, name, [prop], max_retries, retry_delay, client, method, basis)
+    value = record[prop]
+    if value is not None:
+        molecule_name = record['cccbdb_name'] or "unknown"
+        print(f"{PROPERTY_LABELS[prop]} for {formula} ({molecule_name}): {value}")
+    return value
+
+
+def record_to_columns(record, properties):
+    """Flatten the property values of a record into the CSV columns of PROPERTY_COLUMNS."""
+    columns = {}
+    for prop in properties:
+        value = record.get(prop)
+        if prop == 'rotational':
+            constants = list(value or [])[:3]
+            constants += [None] * (3 - len(constants))
+            columns.update(zip(PROPERTY_COLUMNS[prop], constants))
+        else:
+            columns[PROPERTY_COLUMNS[prop][0]] = value
+    return columns
+
+
+# columns of the isomer each row of an --all-isomers output belongs to
+ISOMER_COLUMNS = ['CCCBDB Name', 'CCCBDB Which']
+
+
+def expand_isomer_rows(df, records_per_row, properties):
+    """
+    One output row per isomer: every input row is repeated for each record of its molecule, with the
+    CCCBDB name, which id and property columns of the record, in one merge.
+
+    Args:
+        df: Input rows
+        records_per_row: For every row of df, the list of records of fetch_isomer_properties(), or None
+        properties: Properties whose PROPERTY_COLUMNS are added
+    """
+    rows = []
+    for position, records in enumerate(records_per_row):
+        for record in records or [None]:
+            row = record_to_columns(record or {}, properties)
+            row.update({'_row': position, ISOMER_COLUMNS[0]: record and record['cccbdb_name'],
+                        ISOMER_COLUMNS[1]: record and record['which']})
+            rows.append(row)
+    columns = ['_row', *ISOMER_COLUMNS, *[column for prop in properties for column in PROPERTY_COLUMNS[prop]]]
+    isomers = pd.DataFrame(rows, columns=columns)
+    expanded = df.reset_index(drop=True).merge(isomers, how='left', left_index=True, right_on='_row')
+    return expanded.drop(columns='_row').reset_index(drop=True)
+
+
+def extract_properties_to_csv(input_csv, output_csv, properties=ALL_PROPERTIES, delay=1, client=None, workers=1,
+                              staged=False, parse_processes=None, queue_size=None, all_isomers=False):
+    """
+    Fetch every requested property for the molecules of the input CSV in a single pass.
+
+    Parameters:
+    input_csv (str): Path to input CSV, Parquet or Arrow file, name in the 3rd and formula in the 4th column
+    output_csv (str): Path to output file, the input columns plus one column per value; its extension chooses the format
+    properties (tuple): Properties to fetch, see PROPERTY_PAGES
+    delay (int): Delay in seconds between molecules to avoid overwhelming the server
+    client (CCCBDBClient): Client whose pooled sessions are reused, defaults to the shared client
+    workers (int): Number of molecules looked up at once, the delay is only used with a single worker
+    staged (bool): Download with workers threads and parse the pages in a pool of parse_processes processes,
+        connected by queues of queue_size pages, see staged_scraper.py
+    parse_processes (int): Number of parse processes of the staged lookup, defaults to the number of CPUs
+    queue_size (int): Capacity of the queues of the staged lookup
+    all_isomers (bool): Look up every ground state / minimum isomer of a formula instead of the one matching
+        the name, the output has one row per isomer with its CCCBDB name and which id
+    """
+    if staged and all_isomers:
+        raise ValueError("The staged lookup selects one option per molecule, it cannot look up all isomers")
+    if client is None:
+        client = get_client()
+
+    df = read_table(input_csv)
+
+    # the name is in the 3rd and the formula in the 4th column
+    def fetch(formula, name, client=None):
+        if all_isomers:
+            return fetch_isomer_properties(formula, name, properties, client=client)
+        return fetch_molecule_properties(formula, name, properties, client=client)
+
+    if staged:
+        # staged_scraper builds on this module
+        from staged_scraper import DEFAULT_QUEUE_SIZE, fetch_records_staged
+        records = fetch_records_staged(zip(df.iloc[:, 3], df.iloc[:, 2]), properties, client, workers, parse_processes,
+                                       queue_size or DEFAULT_QUEUE_SIZE)
+    else:
+        records = fetch_values(fetch, zip(df.iloc[:, 3], df.iloc[:, 2]), workers, delay, client)
+
+    if all_isomers:
+        for formula, isomers in zip(df.iloc[:, 3], records):
+            for record in isomers or []:
+                print(f"Properties for {formula} ({record['cccbdb_name']}): "
+                      + ", ".join(f"{prop}={record[prop]}" for prop in properties))
+        result = expand_isomer_rows(df, records, properties)
+    else:
+        rows = []
+        for formula, record in zip(df.iloc[:, 3], records):
+            if record is None:
+                record = {prop: None for prop in properties}
+            rows.append(record_to_columns(record, properties))
+            print(f"Properties for {formula}: " + ", ".join(f"{prop}={record[prop]}" for prop in properties))
+        result = pd.concat([df, pd.DataFrame(rows, index=df.index)], axis=1)
+    write_table(result, output_csv)
+    print(f"Results saved to {output_csv}")
+    print(f"Total molecules processed: {len(df)}")
+    if all_isomers:
+        print(f"Isomer rows written: {len(result)}")
+    for prop in properties:
+        print(f"Molecules with {PROPERTY_LABELS[prop].lower()}: {result[PROPERTY_COLUMNS[prop][0]].notna().sum()}")
+    client.print_stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch rotational constants, dipole and quadrupole moments from CCCBDB")
+    add_client_arguments(parser)
+    add_format_arguments(parser)
+    parser.add_argument('--staged', action='store_true',
+                        help='download with --workers threads and parse the pages in a separate pool of processes')
+    parser.add_argument('--parse-processes', type=int, default=None,
+                        help='number of parse processes with --staged, 0 to parse in a thread (default: number of CPUs)')
+    parser.add_argument('--queue-size', type=int, default=None,
+                        help='capacity of the queues between the stages with --staged (default: 64)')
+    parser.add_argument('--all-isomers', action='store_true',
+                        help='look up every ground state / minimum isomer of a formula, one output row per isomer')
+    args = parser.parse_args()
+    if args.staged and args.all_isomers:
+        parser.error("--all-isomers cannot be combined with --staged")
+    set_client(client_from_args(args))
+    table_format = format_from_args(args)
+
+    extract_properties_to_csv(
+        find_table(with_format("molecule_filter_TOC/2025_05_13_change_order/4_filtered_with_point_group.csv", table_format)),
+        with_format("molecule_filter_TOC/2025_05_13_change_order/5_properties.csv", table_format),
+        workers=args.workers,
+        staged=args.staged,
+        parse_processes=args.parse_processes,
+        queue_size=args.queue_size,
+        all_isomers=args.all_isomers
+    )
@@ -0,0 +1,553 @@
+# Local stand-in for the CCCBDB website, to run and load-test the scrapers without sending a single request
+# to NIST. Implements the entry pages, the formula search, the isomer selection and the data pages with
+# session cookies, serves molecules from a fixture file or generated ones, and injects latency and errors.
+import argparse
+import contextlib
+import html
+import http.server
+import io
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+
+# entry page -> property whose data page a formula search lands on, as on CCCBDB
+ENTRY_PAGES = {
+    'rotcalc1x.asp': 'rotational',
+    'dipole1x.asp': 'dipole',
+    'quadrupole1x.asp': 'quadrupole',
+}
+DATA_PAGES = {
+    'rotcalc2x.asp': 'rotational',
+    'dipole2x.asp': 'dipole',
+    'quadrupole2x.asp': 'quadrupole',
+}
+SEARCH_PAGE = 'getformx.asp'
+POINT_GROUP_PAGE = 'pglistx.asp'
+SELECT_PAGE = 'gotonex.asp'
+SESSION_COOKIE = 'ASPSESSIONIDSIMULATOR'
+
+METHODS = ('HF', 'B3LYP', 'MP2', 'CCSD(T)')
+BASES = ('STO-3G', '3-21G', '6-31G*', 'cc-pVTZ')
+ERROR_STATUSES = (429, 500, 503)
+
+ELEMENTS = ('C', 'H', 'N', 'O', 'F', 'Cl', 'S')
+
+
+class Fixtures:
+    """
+    The molecules the simulator knows, grouped by formula.
+
+    Every molecule is a dictionary with:
+        formula, name, which: the formula, the name and the 'which' id of the selection form
+        ground: False for an excited state or transition state row of a selection page
+        rotational: List of one to three rotational constants, or None
+        dipole, quadrupole: Dictionary from method to a dictionary from basis set to value, or None
+        point_group: Optional point group for pglistx.asp, guessed from the rotational constants without it
+        pages: Optional dictionary from property to a saved page, served instead of the generated one
+    """
+
+    def __init__(self, molecules):
+        self.molecules = list(molecules)
+        self.by_formula = {}
+        self.by_which = {}
+        for molecule in self.molecules:
+            self.by_formula.setdefault(molecule['formula'], []).append(molecule)
+            self.by_which[str(molecule['which'])] = molecule
+
+    @classmethod
+    def load(cls, path):
+        """Read the molecules of a JSON fixture file; saved pages are relative to the file."""
+        with open(path, 'r', encoding='utf-8') as fixture_file:
+            molecules = json.load(fixture_file)['molecules']
+        directory = os.path.dirname(os.path.abspath(path))
+        for molecule in molecules:
+            for prop, page in molecule.get('pages', {}).items():
+                with open(os.path.join(directory, page), 'r', encoding='utf-8', errors='replace') as page_file:
+                    molecule['pages'][prop] = page_file.read()
+        return cls(molecules)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as fixture_file:
+            json.dump({'molecules': self.molecules}, fixture_file, indent=1, ensure_ascii=False)
+
+
+def _formula(rng):
+    counts = {'C': rng.randint(1, 8), 'H': rng.randint(0, 14)}
+    for element in rng.sample(ELEMENTS[2:], rng.randint(0, 2)):
+        counts[element] = rng.randint(1, 3)
+    return ''.join(element + (str(counts[element]) if counts[element] > 1 else '')
+                   for element in ELEMENTS if counts.get(element))
+
+
+def _grid(rng, scale, missing_ratio):
+    # values for most method / basis set pairs, HF is left out of a molecule with missing_ratio
+    grid = {}
+    for method in METHODS:
+        if method == 'HF' and rng.random() < missing_ratio:
+            continue
+        grid[method] = {basis: round(scale * rng.uniform(0.8, 1.2), 3) for basis in BASES if rng.random() < 0.8}
+    return grid
+
+
+def _rotational(rng):
+    kind = rng.random()
+    a = round(rng.uniform(0.05, 10), 5)
+    if kind < 0.15:
+        return [a]  # linear
+    b = round(a * rng.uniform(0.1, 0.9), 5)
+    if kind < 0.35:
+        return [a, b, b]  # prolate symmetric top
+    if kind < 0.45:
+        return [a, a, b]  # oblate symmetric top
+    return [a, b, round(b * rng.uniform(0.5, 0.99), 5)]
+
+
+def synthetic_fixtures(count, seed=0, isomer_ratio=0.1, missing_value_ratio=0.05):
+    """
+    Generate the molecules of count formulas.
+
+    Args:
+        count: Number of formulas
+        seed: Seed of the generator, the same seed gives the same molecules
+        isomer_ratio: Fraction of the formulas with two or three ground state isomers (a selection
+            page) and a transition state row
+        missing_value_ratio: Fraction of the molecules without an HF dipole / quadrupole value
+    """
+    rng = random.Random(seed)
+    molecules = []
+    formulas = set()
+    while len(formulas) < count:
+        formula = _formula(rng)
+        if formula in formulas:
+            continue
+        formulas.add(formula)
+        isomers = rng.randint(2, 3) if rng.random() < isomer_ratio else 1
+        for isomer in range(isomers):
+            molecules.append({
+                'formula': formula,
+                'name': f"{formula} isomer {isomer + 1}" if isomers > 1 else f"{formula} molecule",
+                'which': str(len(molecules) + 1),
+                'ground': True,
+                'rotational': _rotational(rng),
+                'dipole': _grid(rng, rng.uniform(0, 4), missing_value_ratio),
+                'quadrupole': _grid(rng, rng.uniform(-5, 5), missing_value_ratio),
+            })
+        if isomers > 1:
+            molecules.append({'formula': formula, 'name': f"{formula} transition state", 'which': str(len(molecules) + 1),
+                              'ground': False, 'rotational': None, 'dipole': None, 'quadrupole': None})
+    return Fixtures(molecules)
+
+
+def write_input(fixtures, path, not_found_ratio=0.0, seed=0):
+    """
+    Write an input CSV for the scrapers (name in the 3rd, formula in the 4th column) with every ground
+    state molecule of the fixtures, plus not_found_ratio of molecules the simulator does not know.
+
+    Returns:
+        Number of rows written
+    """
+    import pandas as pd
+
+    rng = random.Random(seed)
+    molecules = [molecule for molecule in fixtures.molecules if molecule.get('ground', True)]
+    unknown = int(round(len(molecules) * not_found_ratio / (1 - not_found_ratio))) if not_found_ratio < 1 else 0
+    rows = [(molecule['name'], molecule['formula']) for molecule in molecules]
+    rows += [(f"Unknown molecule {i}", f"Xx{i + 1}") for i in range(unknown)]
+    rng.shuffle(rows)
+    pd.DataFrame({
+        'Index': range(len(rows)),
+        'Category': 'neutral',
+        'Name': [name for name, _ in rows],
+        'Formula': [formula for _, formula in rows],
+        'State': '1Σ',
+        'Symmetry': 'a1',
+        'Frequency': [round(rng.uniform(100, 4000), 1) for _ in rows],
+        'Intensity': [round(rng.uniform(0, 100), 2) for _ in rows],
+    }).to_csv(path, index=False)
+    return len(rows)
+
+
+def render_grid(grid):
+    """A dipole / quadrupole data page with the method x basis set table (table2) of a grid."""
+    if not grid:
+        return "<html><body><h2>No data</h2><table id='table2'><tr><th>Methods</th></tr></table></body></html>"
+    bases = [basis for basis in BASES if any(basis in values for values in grid.values())]
+    rows = ["<tr><th></th>" + "".join(f"<th>{html.escape(basis)}</th>" for basis in bases) + "</tr>"]
+    for method in METHODS:
+        if method not in grid:
+            continue
+        cells = "".join(f"<td class='num bordered'><a href='x.asp?m={method}&b={basis}'>{grid[method][basis]}</a></td>"
+                        if basis in grid[method] else "<td class='bordered'></td>" for basis in bases)
+        rows.append(f"<tr><th class='nowrap'>{html.escape(method)}</th>{cells}</tr>")
+    return "<html><body><table id='table2' border='0'>" + "".join(rows) + "</table></body></html>"
+
+
+def render_rotational(constants):
+    if not constants:
+        return "<html><body><table id='table2'><tr><th>Rotational constants</th></tr></table></body></html>"
+    cell = "<BR>".join(str(value) for value in constants)
+    return (f"<html><body><table id='table2'><tr><th>Rotational Constants (cm<sup>-1</sup>)</th>"
+            f"<td class='num bordered'>{cell}</td></tr></table></body></html>")
+
+
+def render_data_page(molecule, prop):
+    if prop in molecule.get('pages', {}):
+        return molecule['pages'][prop]
+    if prop == 'rotational':
+        return render_rotational(molecule.get('rotational'))
+    return render_grid(molecule.get(prop))
+
+
+def point_group(molecule):
+    """The point group of a molecule, from the fixture or guessed from its rotational constants."""
+    if molecule.get('point_group'):
+        return molecule['point_group']
+    constants = molecule.get('rotational') or []
+    if len(constants) == 1:
+        return 'C∞v'
+    if len(constants) == 3 and (constants[1] == constants[2] or constants[0] == constants[1]):
+        return 'C3v'
+    return 'Cs' if len(constants) == 3 else 'C1'
+
+
+def render_point_group_list(molecules):
+    """The list of the point groups of all molecules (pglistx.asp) read by get_point_group_from_cccbdb.py."""
+    rows = []
+    for i, molecule in enumerate(molecule for molecule in molecules if molecule.get('ground', True)):
+        rows.append(f"<tr class='{'palegreenback' if i % 2 else 'whiteback'}'><td>{html.escape(point_group(molecule))}</td>"
+                    f"<td>{html.escape(molecule['formula'])}</td><td>{html.escape(molecule['name'])}</td></tr>")
+    return "<html><body><table><tr><th>Point group</th><th>Formula</th><th>Name</th></tr>" + "".join(rows) + "</table></body></html>"
+
+
+def render_selection_page(molecules):
+    rows = []
+    for molecule in molecules:
+        state = "ground</td><td>minimum" if molecule.get('ground', True) else "excited</td><td>transition state"
+        rows.append(f"<tr><td><input type='radio' name='which' value='{html.escape(str(molecule['which']))}'></td>"
+                    f"<td rowspan='1'>{html.escape(molecule['formula'])}</td><td rowspan='1'>{html.escape(molecule['name'])}</td>"
+                    f"<td>{state}</td></tr>")
+    return ("<html><body><form action='gotonex.asp' method='post'><table border='1'>"
+            "<tr><th></th><th>Formula</th><th>Name</th><th>State</th><th></th></tr>"
+            + "".join(rows) + "</table><input type='submit'></form></body></html>")
+
+
+class SimulatorConfig:
+    """
+    Behaviour of the simulated server.
+
+    Args:
+        latency_ms: Median response time in milliseconds
+        latency_sigma: Spread of the log-normal response time, 0 for a constant latency
+        error_rate: Fraction of the requests answered with HTTP 429, 500 or 503
+        seed: Seed of the latency and error generator
+        capacity: Requests the server handles at once without slowing down, or None for no limit. Beyond
+            it every request is slower in proportion, and the share of requests over the capacity is
+            answered with a "server busy" page (HTTP 200), as an overloaded CCCBDB does
+    """
+
+    def __init__(self, latency_ms=0.0, latency_sigma=0.0, error_rate=0.0, seed=0, capacity=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        """Return (seconds to wait, error status or None) for one request."""
+        with self.lock:
+            latency = self.latency_ms / 1000
+            if latency and self.latency_sigma:
+                latency *= math.exp(self.rng.gauss(0, self.latency_sigma))
+            status = self.rng.choice(ERROR_STATUSES) if self.rng.random() < self.error_rate else None
+        return latency, status
+
+    def overload(self, in_flight):
+        """Return (latency factor, True to answer 'server busy') for a request with in_flight requests being served."""
+        if not self.capacity or in_flight <= self.capacity:
+            return 1.0, False
+        with self.lock:
+            busy = self.rng.random() < (in_flight - self.capacity) / in_flight
+        return in_flight / self.capacity, busy
+
+
+class SimulatorHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real server
+    disable_nagle_algorithm = True  # headers and body are written separately, Nagle would hold the body for a delayed ACK
+
+    def log_message(self, format, *args):
+        pass
+
+    def _session(self):
+        cookies = self.headers.get('Cookie', '')
+        for part in cookies.split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == SESSION_COOKIE and value in self.server.sessions:
+                return value, self.server.sessions[value], False
+        session_id = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.sessions[session_id] = {'property': None, 'molecule': None}
+        return session_id, self.server.sessions[session_id], True
+
+    def _send(self, status, body, session_id, new_session):
+        content = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        if new_session:
+            self.send_header('Set-Cookie', f'{SESSION_COOKIE}={session_id}; path=/')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _handle(self, method):
+        page = urllib.parse.urlsplit(self.path).path.lstrip('/')
+        form = {}
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length', 0))
+            form = {key: values[0] for key, values in urllib.parse.parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        session_id, session, new_session = self._session()
+        server = self.server
+
+        latency, error = server.config.draw()
+        with server.lock:
+            server.in_flight += 1
+            in_flight = server.in_flight
+        slowdown, busy = server.config.overload(in_flight)
+        try:
+            if latency:
+                time.sleep(latency * slowdown)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        with server.lock:
+            server.counts['requests'] += 1
+            server.counts[f'{method} {page}'] += 1
+            if error:
+                server.counts[f'error {error}'] += 1
+            if busy:
+                server.counts['busy'] += 1
+        if error:
+            return self._send(error, f"<html><body>Error {error}</body></html>", session_id, new_session)
+        if busy:
+            return self._send(200, "<html><body>The server is busy, please try again later</body></html>",
+                              session_id, new_session)
+
+        if page in ENTRY_PAGES:
+            session['property'] = ENTRY_PAGES[page]
+            session['molecule'] = None
+            return self._send(200, f"<html><body><form action='{SEARCH_PAGE}' method='post'>"
+                                   "<input name='formula'><input type='submit' name='submit1'></form></body></html>",
+                              session_id, new_session)
+        if page == SEARCH_PAGE and method == 'POST':
+            molecules = server.fixtures.by_formula.get(form.get('formula', '').strip(), [])
+            session['molecule'] = None
+            if not molecules:
+                with server.lock:
+                    server.counts['not found'] += 1
+                return self._send(200, "<html><body>No entries found</body></html>", session_id, new_session)
+            if len(molecules) > 1:
+                return self._send(200, render_selection_page(molecules), session_id, new_session)
+            session['molecule'] = molecules[0]
+            return self._send(200, render_data_page(molecules[0], session['property'] or 'dipole'), session_id, new_session)
+        if page == SELECT_PAGE and method == 'POST':
+            molecule = server.fixtures.by_which.get(form.get('which'))
+            if molecule is None:
+                return self._send(200, "<html><body>Please select a molecule</body></html>", session_id, new_session)
+            session['molecule'] = molecule
+            return self._send(200, render_data_page(molecule, session['property'] or 'dipole'), session_id, new_session)
+        if page == POINT_GROUP_PAGE:
+            return self._send(200, render_point_group_list(server.fixtures.molecules), session_id, new_session)
+        if page in DATA_PAGES:
+            session['property'] = DATA_PAGES[page]
+            if session['molecule'] is None:
+                return self._send(200, "<html><body>Please select a molecule first</body></html>", session_id, new_session)
+            return self._send(200, render_data_page(session['molecule'], DATA_PAGES[page]), session_id, new_session)
+        return self._send(404, "<html><body>Not found</body></html>", session_id, new_session)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class SimulatorServer(http.server.ThreadingHTTPServer):
+    """
+    The simulated CCCBDB server, one thread per connection.
+
+    Args:
+        fixtures: Fixtures with the molecules
+        config: SimulatorConfig
+        host, port: Address to listen on, port 0 picks a free port
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixtures, config=None, host='127.0.0.1', port=0):
+        super().__init__((host, port), SimulatorHandler)
+        self.fixtures = fixtures
+        self.config = config or SimulatorConfig()
+        self.sessions = {}
+        self.counts = Counter()
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve in a background thread. Returns the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def benchmark(server, input_csv, properties=('dipole',), workers=4, max_rate=None, staged=False, parse_processes=None,
+              adaptive=False, which_index=None):
+    """
+    Look up every molecule of input_csv on a running simulator and measure the throughput,
+    with the staged pipeline of staged_scraper.py when staged is true and under an
+    adaptive_limit.AdaptiveLimiter with workers as its maximum when adaptive is true. With
+    which_index (a which_index.WhichIndex), the molecules resolved before skip the formula search.
+
+    Returns:
+        Dictionary with molecules, seconds, molecules_per_second, requests, the server counts
+        and the client's lookups without value by cause
+    """
+    import pandas as pd
+
+    from adaptive_limit import AdaptiveLimiter
+    from cccbdb_client import CCCBDBClient
+    from cccbdb_failures import RetryPolicy
+    from cccbdb_properties import fetch_molecule_properties
+    from concurrent_scraper import fetch_values
+    from staged_scraper import StagedLookup
+
+    df = pd.read_csv(input_csv)
+    client = CCCBDBClient(pool_size=workers, base_url=server.url, max_rate=max_rate,
+                          retry_policy=RetryPolicy(base_delay=0.05, max_delay=0.5), which_index=which_index)
+    if adaptive:
+        client.limiter = AdaptiveLimiter(workers, target_p95=0.5, window=10, open_seconds=1, max_open_seconds=5,
+                                         rate_limiter=client.rate_limiter, metrics=client.metrics, log_interval=0)
+
+    def fetch(formula, name, client=None):
+        return fetch_molecule_properties(formula, name, properties, client=client)
+
+    requests_before = server.counts['requests']
+    start = time.perf_counter()
+    # the per-molecule messages of the scrapers are not part of the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        if staged:
+            lookup = StagedLookup(client, properties, workers, parse_processes)
+            records = lookup.run(zip(df.iloc[:, 3], df.iloc[:, 2]))
+        else:
+            records = fetch_values(fetch, zip(df.iloc[:, 3], df.iloc[:, 2]), workers, 0, client)
+    seconds = time.perf_counter() - start
+    client.close()
+    if staged:
+        lookup.report()
+    found = sum(1 for record in records if record and any(record[prop] is not None for prop in properties))
+    return {
+        'molecules': len(df),
+        'with_value': found,
+        'workers': workers,
+        'staged': staged,
+        'properties': list(properties),
+        'seconds': seconds,
+        'molecules_per_second': len(df) / seconds if seconds > 0 else float('inf'),
+        'requests': server.counts['requests'] - requests_before,
+        'server': dict(server.counts),
+        'misses': client.stats()['misses'],
+        'phases': client.metrics.phase_summary(),
+        'metrics': client.metrics.summary(),
+        'limiter': client.limiter.summary() if adaptive else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local CCCBDB stand-in for testing and benchmarking the scrapers")
+    corpus = parser.add_mutually_exclusive_group()
+    corpus.add_argument('--fixtures', default=None, help='JSON file with the molecules to serve')
+    corpus.add_argument('--synthetic', type=int, default=1000, help='number of generated formulas (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated molecules, latencies and errors')
+    parser.add_argument('--isomer-ratio', type=float, default=0.1, help='fraction of generated formulas with a selection page of isomers')
+    parser.add_argument('--missing-value-ratio', type=float, default=0.05, help='fraction of generated molecules without HF values')
+    parser.add_argument('--save-fixtures', default=None, help='write the generated molecules to this JSON file')
+    parser.add_argument('--write-input', default=None, metavar='CSV', help='write an input CSV for the scrapers with every molecule')
+    parser.add_argument('--not-found-ratio', type=float, default=0.05,
+                        help='fraction of the rows of --write-input with formulas the simulator does not know')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='median response time in milliseconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.0, help='spread of the log-normal response time, 0 for constant')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 429/500/503')
+    parser.add_argument('--capacity', type=int, default=None,
+                        help='requests served at once before the server slows down and answers "server busy" pages')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on, 0 for any free port')
+    parser.add_argument('--bench', action='store_true', help='look up every molecule of the input once, print molecules/sec and exit')
+    parser.add_argument('--properties', nargs='+', default=['dipole'], choices=list(ENTRY_PAGES.values()),
+                        help='properties looked up by --bench')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent lookups of --bench')
+    parser.add_argument('--staged', action='store_true', help='benchmark the staged pipeline of staged_scraper.py')
+    parser.add_argument('--adaptive', action='store_true', help='benchmark with the adaptive concurrency limit, up to --workers')
+    parser.add_argument('--which-index', default=None, metavar='SQLITE',
+                        help='benchmark with this which index, a second run skips the searches of the isomers resolved by the first')
+    parser.add_argument('--parse-processes', type=int, default=None, help='parse processes of --staged (default: number of CPUs)')
+    parser.add_argument('--json', default=None, help='write the --bench result to this JSON file')
+    args = parser.parse_args()
+
+    if args.fixtures:
+        fixtures = Fixtures.load(args.fixtures)
+    else:
+        fixtures = synthetic_fixtures(args.synthetic, args.seed, args.isomer_ratio, args.missing_value_ratio)
+    if args.save_fixtures:
+        fixtures.save(args.save_fixtures)
+    input_csv = args.write_input
+    if args.bench and input_csv is None:
+        input_csv = 'simulator_input.csv'
+    if input_csv:
+        rows = write_input(fixtures, input_csv, args.not_found_ratio, args.seed)
+        print(f"Wrote {rows} molecules to {input_csv}")
+
+    config = SimulatorConfig(args.latency_ms, args.latency_sigma, args.error_rate, args.seed, args.capacity)
+    server = SimulatorServer(fixtures, config, args.host, args.port)
+    print(f"CCCBDB simulator with {len(fixtures.molecules)} molecules on {server.url}")
+
+    if args.bench:
+        server.start()
+        which_index = None
+        if args.which_index:
+            from which_index import WhichIndex
+            which_index = WhichIndex(args.which_index)
+        result = benchmark(server, input_csv, args.properties, args.workers, staged=args.staged,
+                           parse_processes=args.parse_processes, adaptive=args.adaptive, which_index=which_index)
+        server.shutdown()
+        print(f"{result['molecules']} molecules in {result['seconds']:.2f} s with {result['workers']} workers: "
+              f"{result['molecules_per_second']:.1f} molecules/sec, {result['requests']} requests, "
+              f"{result['with_value']} with a value")
+        if result['misses']:
+            print("Lookups without value by cause: " + ", ".join(f"{key}={count}" for key, count in result['misses'].items()))
+        print(f"Time by phase: {result['phases']}")
+        if result['limiter']:
+            print(f"Concurrency limit {result['limiter']['limit']}/{result['workers']} at the end, circuit opened "
+                  f"{result['limiter']['circuit_opens']} times, {len(result['limiter']['history'])} changes")
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as json_file:
+                json.dump(result, json_file, indent=2)
+        sys.exit(0)
+
+    print(f"Point the scrapers at it with {server.url}, e.g.: CCCBDB_BASE_URL={server.url} python filter_dipole.py --no-cache --max-rate 0")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Requests served: " + ", ".join(f"{key}={count}" for key, count in sorted(server.counts.items())))
@@ -0,0 +1,98 @@
+# Append-only journal that lets the scraping filters resume after a crash
+import json
+import os
+import threading
+
+
+def molecule_key(formula, name):
+    """
+    Canonical key of a molecule: the stripped formula and the stripped, lower case name.
+
+    Names are compared case-insensitively when a CCCBDB option is selected, so rows that
+    only differ in the case of the name are the same lookup. A missing (NaN) name is None.
+    """
+    name = name.strip().lower() if isinstance(name, str) else None
+    return str(formula).strip(), name or None
+
+
+def journal_key(formula, name, method=None):
+    """
+    Key of a molecule in the journal, the JSON form of molecule_key() and, when given, of the
+    method (and basis set) the value was read for, e.g. 'HF' or 'B3LYP/6-31G*'.
+    """
+    key = list(molecule_key(formula, name))
+    if method is not None:
+        key.append(method)
+    return json.dumps(key, ensure_ascii=False)
+
+
+class Journal:
+    """
+    One JSON line per processed molecule, flushed and fsync'd before the next one starts.
+    Only the molecules that are done are recorded: those with a value and those CCCBDB has
+    no value for, not the lookups that gave up on a timeout or server error.
+
+    Args:
+        path: File of the journal
+        method: Method (and basis set) of the values, see cccbdb_properties.method_key(). A resumed
+            run with another --method or --basis does not take the values of the interrupted one
+    """
+
+    def __init__(self, path, method=None):
+        self.path = path
+        self.method = method
+        self._lock = threading.Lock()
+
+    def key(self, formula, name):
+        """The journal_key() of a molecule in this journal."""
+        return journal_key(formula, name, self.method)
+
+    def load(self):
+        """
+        Read every record of the journal.
+
+        Returns:
+            Dictionary from key() to the stored value. A line cut off by a crash
+            is ignored, and a molecule recorded twice keeps its last value.
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r', encoding='utf-8') as journal_file:
+            content = journal_file.read()
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record['key']] = record['value']
+        if content and not content.endswith('\n'):
+            # terminate the cut off line so the next record starts on its own line
+            with self._lock, open(self.path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write('\n')
+        return records
+
+    def append(self, key, value, failures=None):
+        """
+        Durably record the value of one molecule.
+
+        Args:
+            failures: Failure category by property of a molecule without value, e.g. {'dipole': 'not_found'}
+        """
+        record = {'key': key, 'value': value}
+        if failures:
+            record['failures'] = failures
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write(line)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def clear(self):
+        """Start a new, empty journal."""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            open(self.path, 'w', encoding='utf-8').close()
@@ -0,0 +1,171 @@
+# Runs CCCBDB lookups for many molecules at once
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cccbdb_failures import PERMANENT
+from checkpoint import molecule_key
+from tracing import span
+
+
+class SingleFlight:
+    """
+    Runs a function once per key. Callers asking for a key that is in flight wait for
+    the running call and share its result, later callers get the remembered result.
+    Exceptions are passed to the waiting callers but not remembered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def do(self, key, function):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+        if owner:
+            try:
+                future.set_result(function())
+            except BaseException as e:
+                with self._lock:
+                    del self._futures[key]
+                future.set_exception(e)
+                raise
+        return future.result()
+
+    def clear(self):
+        """Forget the remembered results."""
+        with self._lock:
+            self._futures = {key: future for key, future in self._futures.items() if not future.done()}
+
+
+def _fetch_or_none(fetch, formula, name, client, journal=None):
+    # a failed lookup must not cancel the lookups of the other molecules
+    try:
+        with span('molecule', formula=formula, name=name):
+            value = fetch(formula, name, client=client)
+    except Exception as e:
+        print(f"Error processing {formula}: {e}")
+        return None
+    if journal is not None:
+        failures = None
+        if value is None:
+            failures = _permanent_failures(client, formula, name)
+            if failures is None:
+                # a give-up on a timeout, server error or the retry budget is not done, a resumed run retries it
+                return None
+        journal.append(journal.key(formula, name), value, failures)
+    return value
+
+
+def _permanent_failures(client, formula, name):
+    # the failure categories of a lookup without value when they are all permanent (CCCBDB has no value), None
+    # when one of them is transient or they are unknown, e.g. without a client to ask
+    failures = client.failures_of(formula, name) if client is not None else {}
+    if failures and all(category in PERMANENT for category in failures.values()):
+        return failures
+    return None
+
+
+def _requests_sent(client):
+    # requests (and failed attempts) sent to CCCBDB so far, None without a client to ask
+    if client is None:
+        return None
+    return client.metrics.counter('requests_total') + client.metrics.counter('request_errors_total')
+
+
+async def _fetch_all(fetch, molecules, workers, client, journal):
+    loop = asyncio.get_running_loop()
+    # the executor runs at most workers lookups at once, the others wait in its queue
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return await asyncio.gather(*(loop.run_in_executor(executor, _fetch_or_none, fetch, formula, name, client, journal)
+                                      for formula, name in molecules))
+
+
+def fetch_values(fetch, molecules, workers=1, delay=1, client=None, journal=None, resume=False, known=None):
+    """
+    Look up a value for every molecule, in the order of the molecules.
+
+    Rows with the same molecule_key() are looked up once and the value is given to
+    every one of them.
+
+    With one worker the molecules are fetched one after the other with a pause of
+    delay seconds in between, as the filters always did, except after the lookups
+    the caches of the client answered without a request. With more workers the
+    lookups run concurrently on an asyncio event loop. Each lookup leases its own
+    session (and cookie jar) from the client, and the token bucket of the client
+    caps the requests per second of all workers together, so no delay is added.
+
+    With a journal every value is recorded as soon as it is fetched, and the
+    returned values are read back from the journal. With resume=True the molecules
+    already in the journal are not fetched again, otherwise the journal starts empty.
+    A molecule without value is only journaled when the client knows it failed for a
+    permanent reason (not found, missing method, parse failure), so that a resume after
+    a network outage looks up again the molecules the outage made give up.
+
+    The molecules in known (e.g. the unchanged molecules of an incremental update, see
+    delta.py) are not fetched, they get the value given there.
+
+    Args:
+        fetch: Function called as fetch(formula, name, client=client), e.g. get_dipole_moment
+        molecules: List of (formula, name) tuples
+        workers: Number of lookups running at once
+        delay: Pause in seconds after each molecule when there is a single worker
+        client: CCCBDBClient passed on to fetch
+        journal: checkpoint.Journal, or None
+        resume: Skip the molecules that are already in the journal
+        known: Dictionary from molecule_key() to the value of molecules that are not fetched, or None
+
+    Returns:
+        List of the values returned by fetch, None where the lookup failed
+    """
+    molecules = list(molecules)
+    # every distinct molecule is looked up once, with the formula and name of its first row
+    keys = [molecule_key(formula, name) for formula, name in molecules]
+    distinct = {}
+    for key, molecule in zip(keys, molecules):
+        distinct.setdefault(key, molecule)
+    if len(distinct) < len(molecules):
+        print(f"{len(molecules)} rows, {len(distinct)} distinct molecules to look up")
+    pending = list(distinct.values())
+    known = known or {}
+    if known:
+        pending = [(formula, name) for key, (formula, name) in distinct.items() if key not in known]
+        print(f"{len(distinct) - len(pending)} of {len(distinct)} molecules taken from the previous run, {len(pending)} to look up")
+
+    if journal is not None:
+        if resume:
+            done = journal.load()
+            pending = [(formula, name) for formula, name in pending if journal.key(formula, name) not in done]
+            print(f"Resuming from {journal.path}: {len(distinct) - len(known) - len(pending)} of {len(distinct) - len(known)} molecules already processed")
+        else:
+            journal.clear()
+
+    if workers <= 1:
+        values = []
+        for formula, name in pending:
+            sent = _requests_sent(client)
+            values.append(_fetch_or_none(fetch, formula, name, client, journal))
+            if sent is not None and _requests_sent(client) == sent:
+                # answered from the caches (response, negative or grid cache), the server saw nothing
+                continue
+            # add a delay to avoid overwhelming the server
+            with span('sleep', reason='delay', seconds=delay):
+                time.sleep(delay)
+            if client is not None:
+                client.metrics.observe('sleep_seconds', delay, reason='delay')
+    else:
+        values = asyncio.run(_fetch_all(fetch, pending, workers, client, journal))
+
+    if journal is None:
+        fetched = dict(known)
+        fetched.update((molecule_key(formula, name), value) for (formula, name), value in zip(pending, values))
+        return [fetched[key] for key in keys]
+    # rebuild the values of every row, including the resumed ones, from the journal
+    done = journal.load()
+    return [known[key] if key in known else done.get(journal.key(formula, name))
+            for key, (formula, name) in zip(keys, molecules)]
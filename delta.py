@@ -0,0 +1,118 @@
+# Row level diff of a new input against the outputs of a previous run, so that a scraper only looks up
+# the molecules that were added or changed and takes the values of the others from the previous run
+import math
+import os
+
+import pandas as pd
+
+from checkpoint import molecule_key
+from table_io import read_table
+
+
+def read_previous(paths):
+    """
+    Read the outputs of a previous run into one DataFrame. Missing and empty outputs are skipped.
+
+    Args:
+        paths: Path or list of paths of output tables
+
+    Returns:
+        DataFrame of all rows of the outputs, None if there is none
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    frames = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        try:
+            # round_trip reads back exactly the floats the previous run wrote to CSV
+            frames.append(read_table(path, float_precision='round_trip'))
+        except pd.errors.EmptyDataError:
+            continue  # an empty output is written as a CSV without header
+    frames = [frame for frame in frames if len(frame.columns)]
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def _keys(df, formula_column, name_column):
+    return [molecule_key(formula, name) for formula, name in zip(df.iloc[:, formula_column], df.iloc[:, name_column])]
+
+
+def _row_hashes(df, columns):
+    # the cells are compared as text; numbers with 12 significant digits, so that 1 and 1.0, or a float
+    # read with and without the round_trip parser, are the same
+    text = pd.DataFrame({
+        position: df[column].map('{:.12g}'.format) if pd.api.types.is_numeric_dtype(df[column]) else df[column].astype(str)
+        for position, column in enumerate(columns)
+    })
+    return pd.util.hash_pandas_object(text, index=False).to_numpy()
+
+
+def known_values(previous, current, values_of, formula_column=3, name_column=2):
+    """
+    Diff the molecules of a new input against the outputs of a previous run, by molecule_key().
+
+    A molecule is unchanged when every row of it in the new input is also in the previous
+    outputs with the same content in all the columns of the new input. Molecules that are
+    new or whose rows changed have to be looked up; the molecules that are only in the
+    previous outputs are dropped, since the outputs are rebuilt from the new input.
+
+    An unchanged molecule the previous run found no value for is looked up again: the outputs do not
+    say why it had none. A lookup CCCBDB has no value for (not found, missing method, parse failure)
+    is answered by the negative cache without a request, a transient failure is retried.
+
+    Args:
+        previous: DataFrame of the previous outputs (see read_previous), or None
+        current: DataFrame of the new input
+        values_of: Function values_of(previous) returning the looked up value stored in every row
+            of the previous outputs, None where the previous run found none
+        formula_column: Position of the formula column (the 4th, as in every stage)
+        name_column: Position of the name column (the 3rd)
+
+    Returns:
+        Dictionary from molecule_key() to the value of every unchanged molecule with a value
+    """
+    current_keys = _keys(current, formula_column, name_column)
+    if previous is None or len(previous) == 0:
+        print(f"Incremental update: no previous outputs, all {len(set(current_keys))} molecules are looked up")
+        return {}
+
+    columns = list(current.columns)
+    previous_keys = _keys(previous, formula_column, name_column)
+    if not set(columns) <= set(previous.columns):
+        unchanged_rows = set()
+    else:
+        unchanged_rows = set(zip(previous_keys, _row_hashes(previous, columns)))
+
+    # a molecule with several rows is only unchanged when all of them are
+    unchanged = {}
+    for key, row_hash in zip(current_keys, _row_hashes(current, columns)):
+        unchanged[key] = unchanged.get(key, True) and (key, row_hash) in unchanged_rows
+
+    known = {}
+    without_value = set()
+    for key, value in zip(previous_keys, values_of(previous)):
+        if not unchanged.get(key) or key in known or key in without_value:
+            continue
+        if value is None:
+            without_value.add(key)
+        else:
+            known[key] = value
+
+    previous_molecules = set(previous_keys)
+    added = sum(1 for key in unchanged if key not in previous_molecules)
+    changed = len(unchanged) - added - len(known) - len(without_value)
+    removed = len(previous_molecules - set(unchanged))
+    print(f"Incremental update: {added} added, {changed} changed, {len(known)} unchanged "
+          f"(values of the previous run reused), {len(without_value)} unchanged without value (looked up again), "
+          f"{removed} removed molecules")
+    return known
+
+
+def column_values(previous, column):
+    """The floats of a column of the previous outputs, None for the empty cells and the rows without the column."""
+    if column not in previous.columns:
+        return [None] * len(previous)
+    return [None if math.isnan(value) else value for value in pd.to_numeric(previous[column], errors='coerce').tolist()]
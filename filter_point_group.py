@@ -1,7 +1,13 @@
+import argparse
 import csv
 import re
 
-def search_point_group(input_file, input_database, output_csv):
+import pandas as pd
+
+from property_store import add_store_arguments, store_from_args
+from table_io import add_format_arguments, format_from_args, infer_types, table_format, with_format, write_table
+
+def search_point_group(input_file, input_database, output_csv, store=None):
     
     # Read input file (input data)
     with open(input_file, "r", newline="", encoding="utf-8-sig") as input:
@@ -28,12 +34,18 @@ def search_point_group(input_file, input_database, output_csv):
     header_row = input_rows[0] + ["Point Group"]  # Add proper column name
     output_rows.append(header_row)
     
+    # Point groups of all the molecules, found or not, for the property store (formula in column 3)
+    store_rows = []
+
     # Process data rows and filter based on point group requirements
     for row_input in input_rows[1:]:  # Skip header row
         molecule_input = row_input[2]  # Assuming the molecule name is in column 2 (index 2)
         
         # Find the corresponding point group in the database
         point_group = point_group_dict.get(molecule_input, "No Point Group Found")
+        if store is not None and len(row_input) > 3:
+            store_rows.append({'formula': row_input[3], 'name': molecule_input,
+                               'point_group': point_group_dict.get(molecule_input)})
         
         # Only include molecules with qualifying point groups
         if is_qualifying_point_group(point_group):
@@ -41,10 +53,17 @@ def search_point_group(input_file, input_database, output_csv):
             row_with_point_group.append(point_group)
             output_rows.append(row_with_point_group)
     
-    # Write output to CSV
-    with open(output_csv, "w", newline="", encoding="utf-8-sig") as output:
-        writer_output = csv.writer(output)
-        writer_output.writerows(output_rows)
+    # Write output to CSV, or to a Parquet / Arrow file with the column types pandas would read from the CSV
+    if table_format(output_csv) == 'csv':
+        with open(output_csv, "w", newline="", encoding="utf-8-sig") as output:
+            writer_output = csv.writer(output)
+            writer_output.writerows(output_rows)
+    else:
+        write_table(infer_types(pd.DataFrame(output_rows[1:], columns=output_rows[0])), output_csv)
+
+    # every molecule and its point group is also upserted into the property store
+    if store is not None:
+        store.upsert(store_rows)
 
 def is_qualifying_point_group(point_group):
     """
@@ -94,7 +113,13 @@ def is_qualifying_point_group(point_group):
         return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the molecules whose point group is C3 / C3v or higher")
+    add_store_arguments(parser)
+    add_format_arguments(parser)
+    args = parser.parse_args()
+
+    # the inputs come from CSV only stages, the output is written in the chosen format
     input_file_name = "molecule_filter_TOC/2025_05_13_change_order/2_filtered_for_duplicated_vibrations.csv"
     input_database_file_name = "molecule_filter_TOC/2025_05_13_change_order/point_groups_from_cccbdb.csv"
-    output_file_name = "molecule_filter_TOC/2025_05_13_change_order/3_filtered_with_point_group.csv"
-    search_point_group(input_file_name, input_database_file_name, output_file_name)
\ No newline at end of file
+    output_file_name = with_format("molecule_filter_TOC/2025_05_13_change_order/3_filtered_with_point_group.csv", format_from_args(args))
+    search_point_group(input_file_name, input_database_file_name, output_file_name, store=store_from_args(args))
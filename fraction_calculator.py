@@ -1,48 +1,100 @@
+import argparse
 import pandas as pd
 import numpy as np
 
-def calculate_fraction(input_csv, output_csv):
-    # Load the input CSV file
-    df = pd.read_csv(input_csv)
-
-    # Initialize new columns for Stark values
-    df["Stark 1"] = np.nan
-    df["Stark 2"] = np.nan
-    df["Stark 3"] = np.nan
-
-    for index, row in df.iterrows():
-        try:
-            dipole_moment = row.iloc[13]
-            rotational_constant_1 = row.iloc[9]
-            rotational_constant_2 = row.iloc[10]
-            rotational_constant_3 = row.iloc[11]
-            molecule_name = row.iloc[1]
-
-            # Check and compute each Stark value if possible
-            if pd.notna(rotational_constant_1) and rotational_constant_1 != 0:
-                df.at[index, "Stark 1"] = dipole_moment**2 / rotational_constant_1
-            else:
-                print(f"{molecule_name} does not have a valid rotational constant 1")
-
-            if pd.notna(rotational_constant_2) and rotational_constant_2 != 0:
-                df.at[index, "Stark 2"] = dipole_moment**2 / rotational_constant_2
-            else:
-                print(f"{molecule_name} does not have a valid rotational constant 2")
-
-            if pd.notna(rotational_constant_3) and rotational_constant_3 != 0:
-                df.at[index, "Stark 3"] = dipole_moment**2 / rotational_constant_3
-            else:
-                print(f"{molecule_name} does not have a valid rotational constant 3")
-        
-        except Exception as e:
-            print(f"Error processing row {index} ({molecule_name}): {e}")
-
-    # Save the modified DataFrame to output CSV
-    df.to_csv(output_csv, index=False)
+from property_store import add_store_arguments, store_from_args
+from table_io import TableWriter, add_format_arguments, find_table, format_from_args, iter_table, with_format
+
+DIPOLE_COLUMN = "Dipole Moment"
+CONSTANT_COLUMNS = ("Rotational Constant 1", "Rotational Constant 2", "Rotational Constant 3")
+STARK_COLUMNS = ("Stark 1", "Stark 2", "Stark 3")
+
+
+def stark_values(dipole_moments, rotational_constants):
+    """
+    Computes dipole² / rotational constant for all molecules and all three constants at once.
+
+    Args:
+        dipole_moments: Array of length N with the dipole moment of each molecule
+        rotational_constants: Array of shape (N, 3) with the rotational constants
+
+    Returns:
+        Array of shape (N, 3) with the Stark values, NaN where the constant is missing or
+        zero, and a boolean array of shape (N, 3) that is True where the constant is valid
+    """
+    dipole_moments = np.asarray(dipole_moments, dtype=float)
+    rotational_constants = np.asarray(rotational_constants, dtype=float)
+    valid = ~np.isnan(rotational_constants) & (rotational_constants != 0)
+    stark = np.full(rotational_constants.shape, np.nan)
+    np.divide((dipole_moments ** 2)[:, None], rotational_constants, out=stark, where=valid)
+    return stark, valid
+
+
+def _numeric_columns(df, columns):
+    # cells that are not numbers count as missing, like empty ones
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"Column(s) {missing} not found, the file has the columns {list(df.columns)}")
+    return df[list(columns)].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+
+def add_fractions(df, dipole_column=DIPOLE_COLUMN, constant_columns=CONSTANT_COLUMNS):
+    """
+    Adds the Stark 1, 2 and 3 columns (dipole² / rotational constant 1, 2 and 3) to df.
+
+    Returns:
+        The number of molecules without a valid (missing or zero) rotational constant,
+        one count per constant column
+    """
+    dipole_moments = _numeric_columns(df, [dipole_column])[:, 0]
+    stark, valid = stark_values(dipole_moments, _numeric_columns(df, constant_columns))
+    for i, column in enumerate(STARK_COLUMNS):
+        df[column] = stark[:, i]
+    return (~valid).sum(axis=0)
+
+
+def calculate_fraction(input_csv, output_csv, dipole_column=DIPOLE_COLUMN, constant_columns=CONSTANT_COLUMNS,
+                       chunksize=None, store=None):
+    """
+    Calculates dipole² / rotational constant for every molecule of input_csv and saves the
+    input with the Stark 1, 2 and 3 columns added to output_csv.
+
+    Args:
+        input_csv: CSV, Parquet or Arrow file with the dipole moments and the rotational constants
+        output_csv: File the results are saved to, its extension chooses the format
+        dipole_column: Header of the dipole moment column
+        constant_columns: Headers of the three rotational constant columns
+        chunksize: Read, compute and write chunksize rows at a time, so files of any size
+            fit in memory. None processes the whole file at once
+        store: property_store.PropertyStore the Stark values are upserted into, or None
+    """
+    total = 0
+    invalid = np.zeros(len(constant_columns), dtype=int)
+    # Parquet and Arrow inputs are memory-mapped, a chunk is only converted when it is processed
+    with TableWriter(output_csv) as writer:
+        for df in iter_table(input_csv, chunksize):
+            invalid += add_fractions(df, dipole_column, constant_columns)
+            writer.write(df)
+            if store is not None:
+                store.upsert_frame(df, dict(zip(STARK_COLUMNS, ("stark_1", "stark_2", "stark_3"))))
+            total += len(df)
+
+    for column, count in zip(constant_columns, invalid):
+        if count:
+            print(f"{count} molecules do not have a valid {column.lower()}")
     print(f"Results saved to {output_csv}")
-    print(f"Total molecules processed: {len(df)}")
+    print(f"Total molecules processed: {total}")
 
 
-input_csv = "molecule_filter_TOC/2025_05_13_change_order/5_dipole_moment.csv"
-output_csv = "molecule_filter_TOC/2025_05_13_change_order/5_fraction.csv"
-potato = calculate_fraction(input_csv, output_csv)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate dipole² / rotational constant for every molecule")
+    parser.add_argument('input_csv', nargs='?', default=None, help='CSV, Parquet or Arrow file (default: 5_dipole_moment)')
+    parser.add_argument('output_csv', nargs='?', default=None, help='output file, its extension chooses the format (default: 5_fraction)')
+    parser.add_argument('--chunksize', type=int, default=None, help='process the file this many rows at a time')
+    add_store_arguments(parser)
+    add_format_arguments(parser)
+    args = parser.parse_args()
+    table_format = format_from_args(args)
+    input_csv = args.input_csv or find_table(with_format("molecule_filter_TOC/2025_05_13_change_order/5_dipole_moment.csv", table_format))
+    output_csv = args.output_csv or with_format("molecule_filter_TOC/2025_05_13_change_order/5_fraction.csv", table_format)
+    calculate_fraction(input_csv, output_csv, chunksize=args.chunksize, store=store_from_args(args))
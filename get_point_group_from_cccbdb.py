@@ -4,6 +4,8 @@ import re
 from bs4 import BeautifulSoup
 import csv
 
+from cccbdb_client import default_base_url
+
 def clean_html(input_string):
     """Remove HTML tags from input string."""
     # Ensure the input is a string (in case it's a BeautifulSoup Tag object)
@@ -17,7 +19,7 @@ def clean_html(input_string):
 
 def get_point_groups():
     """Fetch the point groups from the given URL and store them in a CSV."""
-    url = 'https://cccbdb.nist.gov/pglistx.asp'  # URL of the webpage containing the table
+    url = f'{default_base_url()}/pglistx.asp'  # URL of the webpage containing the table, CCCBDB_BASE_URL points it elsewhere
 
     # Fetch the webpage content
     try:
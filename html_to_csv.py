@@ -1,42 +1,61 @@
+import argparse
 import os
 import pandas as pd
 from bs4 import BeautifulSoup
 
-# Path to the saved HTML file
-html_file = "C:/Users/mirela_en/Desktop/python/molecule_filter/nist_data_extraction_after_misha/saved_page.html.html"  # Ensure you save the webpage as 'saved_page.html'
 
-if not os.path.exists(html_file):
-    print(f"Error: {html_file} not found. Please save the webpage and try again.")
-    exit()
+def html_to_csv(html_file, output_filename="vibrational_frequencies.csv"):
+    """
+    Converts the vibrational data table of a saved NIST page to CSV.
 
-# Read the HTML content
-with open(html_file, "r", encoding="utf-8") as file:
-    soup = BeautifulSoup(file, "html.parser")
+    Args:
+        html_file: Path to the saved HTML file
+        output_filename: CSV file the table is saved to
+    """
+    if not os.path.exists(html_file):
+        raise FileNotFoundError(f"{html_file} not found. Please save the webpage and try again.")
 
-# Find the table
-table = soup.find("table", {"border": "1"})
+    # Read the HTML content
+    with open(html_file, "r", encoding="utf-8") as file:
+        soup = BeautifulSoup(file, "html.parser")
 
-# Extract table headers
-headers = [header.get_text(strip=True) for header in table.find_all("th")]
+    # Find the table
+    table = soup.find("table", {"border": "1"})
 
-# Extract table rows
-rows = []
-for row in table.find_all("tr"):
-    cols = row.find_all("td")
-    if cols:  # Only process non-empty rows
-        cols = [col.get_text(strip=True) if not col.find("a") else col.find("a").get_text(strip=True) for col in cols]
-        rows.append(cols)
+    # Extract table headers
+    headers = [header.get_text(strip=True) for header in table.find_all("th")]
 
-# Create a DataFrame
-df = pd.DataFrame(rows, columns=headers)
+    # Extract table rows
+    rows = []
+    for row in table.find_all("tr"):
+        cols = row.find_all("td")
+        if cols:  # Only process non-empty rows
+            cols = [col.get_text(strip=True) if not col.find("a") else col.find("a").get_text(strip=True) for col in cols]
+            rows.append(cols)
 
-# Remove any empty rows if necessary
-df = df.dropna(how='all')
+    # Create a DataFrame
+    df = pd.DataFrame(rows, columns=headers)
 
-# Display the first few rows
-print(df.head())
+    # Remove any empty rows if necessary
+    df = df.dropna(how='all')
 
-# Save to CSV
-output_filename = "vibrational_frequencies.csv"
-df.to_csv(output_filename, index=False)
-print(f"Data saved to {output_filename}")
\ No newline at end of file
+    # Display the first few rows
+    print(df.head())
+
+    # Save to CSV
+    df.to_csv(output_filename, index=False)
+    print(f"Data saved to {output_filename}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the vibrational data table of a saved NIST page to CSV")
+    # Path to the saved HTML file
+    parser.add_argument('html_file', nargs='?', default="C:/Users/mirela_en/Desktop/python/molecule_filter/nist_data_extraction_after_misha/saved_page.html.html")  # Ensure you save the webpage as 'saved_page.html'
+    parser.add_argument('output_filename', nargs='?', default="vibrational_frequencies.csv")
+    args = parser.parse_args()
+
+    try:
+        html_to_csv(args.html_file, args.output_filename)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        exit()
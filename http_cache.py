@@ -0,0 +1,221 @@
+# Persistent on-disk cache for the pages downloaded from the CCCBDB website
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+
+DEFAULT_CACHE_DIR = '.cccbdb_cache'
+DEFAULT_TTL = 30 * 24 * 3600        # 30 days
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2  # 512 MB
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a page is not in the cache."""
+
+
+class CachedResponse:
+    """The parts of a requests.Response that the scrapers use, read back from the cache."""
+
+    from_cache = True
+    cache_key = None
+
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+def request_key(method, url, data=None, context=()):
+    """
+    Build the cache key of a request.
+
+    Args:
+        method: 'GET' or 'POST'
+        url: Absolute URL of the request
+        data: Form data of the request
+        context: Requests that set the server side state the response depends on,
+                 e.g. the entry page, the formula search and the selected 'which' value
+
+    Returns:
+        Hex digest identifying the request
+    """
+    payload = json.dumps([method.upper(), url, sorted((data or {}).items()), list(context)],
+                         separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class HTTPCache:
+    """
+    Content-addressed response cache with a per-entry TTL and LRU eviction.
+
+    Response bodies are stored once per distinct content under blobs/, and an SQLite
+    index maps request keys to blobs. SQLite serialises writers and blobs are written
+    to a temporary file and renamed, so several processes can share one directory.
+
+    Args:
+        directory: Directory of the cache
+        ttl: Default time to live of an entry in seconds
+        max_bytes: Disk budget for the stored bodies, least recently used entries are evicted beyond it
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # the sessions of a run share the cache
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+        self._index = os.path.join(directory, 'index.sqlite')
+        with closing(self._connect()) as db, db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                       'key TEXT PRIMARY KEY, blob TEXT NOT NULL, url TEXT, status_code INTEGER, '
+                       'expires_at REAL NOT NULL, last_access REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)')
+            # the stored bytes are kept up to date by every put and delete, so a put does not scan the index
+            db.execute('CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            if 'refs' not in [row[1] for row in db.execute('PRAGMA table_info(blobs)')]:
+                # a cache written before the reference counts: count them once
+                db.execute('ALTER TABLE blobs ADD COLUMN refs INTEGER NOT NULL DEFAULT 0')
+                db.execute('UPDATE blobs SET refs = (SELECT COUNT(*) FROM entries WHERE entries.blob = blobs.hash)')
+                db.execute('DELETE FROM totals')
+            if db.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone() is None:
+                orphans = [row[0] for row in db.execute('SELECT hash FROM blobs WHERE refs <= 0')]
+                db.execute('DELETE FROM blobs WHERE refs <= 0')
+                db.execute("INSERT INTO totals (name, value) SELECT 'bytes', COALESCE(SUM(size), 0) FROM blobs")
+            else:
+                orphans = []
+        self._remove_blobs(orphans)
+
+    def _connect(self):
+        return sqlite3.connect(self._index, timeout=60)
+
+    def _blob_path(self, blob):
+        return os.path.join(self.directory, 'blobs', blob[:2], blob)
+
+    def get(self, key):
+        """Return the CachedResponse stored under key, or None if it is missing or expired."""
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            row = db.execute('SELECT blob, url, status_code, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or row[3] < now:
+                self._count('misses')
+                return None
+            db.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+        try:
+            with open(self._blob_path(row[0]), 'rb') as blob_file:
+                content = blob_file.read()
+        except FileNotFoundError:
+            # evicted by another process between the lookup and the read
+            self._count('misses')
+            return None
+        self._count('hits')
+        return CachedResponse(row[1], row[2], content)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def put(self, key, response, ttl=None):
+        """Store the body, final URL and status code of a response under key."""
+        content = response.content
+        blob = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(blob)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_path, path)
+
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with closing(self._connect()) as db, db:
+            db.execute('BEGIN IMMEDIATE')
+            previous = db.execute('SELECT blob FROM entries WHERE key = ?', (key,)).fetchone()
+            if db.execute('INSERT OR IGNORE INTO blobs (hash, size, refs) VALUES (?, ?, 0)', (blob, len(content))).rowcount:
+                db.execute("UPDATE totals SET value = value + ? WHERE name = 'bytes'", (len(content),))
+            db.execute('UPDATE blobs SET refs = refs + 1 WHERE hash = ?', (blob,))
+            db.execute('INSERT OR REPLACE INTO entries (key, blob, url, status_code, expires_at, last_access) '
+                       'VALUES (?, ?, ?, ?, ?, ?)', (key, blob, response.url, response.status_code, expires_at, now))
+            orphans = self._release(db, [previous[0]] if previous else [])
+            total = self._total(db)
+        self._remove_blobs(orphans)
+        if total > self.max_bytes:
+            self.evict()
+
+    def invalidate(self, key):
+        """Drop the entry stored under key, e.g. a page an overloaded server answered instead of the real one."""
+        with closing(self._connect()) as db, db:
+            db.execute('BEGIN IMMEDIATE')
+            orphans = self._delete(db, db.execute('SELECT key, blob FROM entries WHERE key = ?', (key,)).fetchall())
+        self._remove_blobs(orphans)
+
+    def evict(self):
+        """Drop expired entries, then least recently used entries until the bodies fit in max_bytes."""
+        with closing(self._connect()) as db, db:
+            db.execute('BEGIN IMMEDIATE')
+            orphans = self._delete(db, db.execute('SELECT key, blob FROM entries WHERE expires_at < ?',
+                                                  (time.time(),)).fetchall())
+            total = self._total(db)
+            if total > self.max_bytes:
+                for key, blob in db.execute('SELECT key, blob FROM entries ORDER BY last_access').fetchall():
+                    orphans += self._delete(db, [(key, blob)])
+                    if self._total(db) <= self.max_bytes:
+                        break
+        self._remove_blobs(orphans)
+
+    def _delete(self, db, entries):
+        # entries is a list of (key, blob), returns the blobs no entry refers to any more
+        db.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, _ in entries])
+        return self._release(db, [blob for _, blob in entries])
+
+    @staticmethod
+    def _release(db, blobs):
+        # one reference less to each blob, the blobs without reference are deleted and their size subtracted
+        orphans = []
+        for blob in blobs:
+            db.execute('UPDATE blobs SET refs = refs - 1 WHERE hash = ?', (blob,))
+            row = db.execute('SELECT size FROM blobs WHERE hash = ? AND refs <= 0', (blob,)).fetchone()
+            if row is not None:
+                db.execute('DELETE FROM blobs WHERE hash = ?', (blob,))
+                db.execute("UPDATE totals SET value = value - ? WHERE name = 'bytes'", (row[0],))
+                orphans.append(blob)
+        return orphans
+
+    @staticmethod
+    def _total(db):
+        return db.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0]
+
+    def _remove_blobs(self, blobs):
+        for blob in blobs:
+            try:
+                os.remove(self._blob_path(blob))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Remove every entry of the cache."""
+        with closing(self._connect()) as db, db:
+            db.execute('BEGIN IMMEDIATE')
+            orphans = self._delete(db, db.execute('SELECT key, blob FROM entries').fetchall())
+        self._remove_blobs(orphans)
+
+    def stats(self):
+        """Return the number of entries, the stored bytes and the hits and misses of this process."""
+        with closing(self._connect()) as db:
+            entries = db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            size = self._total(db)
+        return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
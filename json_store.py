@@ -0,0 +1,70 @@
+# Small persistent key/value store on SQLite, shared by several processes
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+
+class JSONStore:
+    """
+    Maps keys (tuples of strings/numbers/None) to JSON values, with an optional expiry per entry.
+
+    Every call opens its own SQLite connection, so one store can be used from
+    several threads and processes at the same time.
+
+    Args:
+        path: SQLite file of the store
+        table: Table of the file holding this store, several stores can share a file
+        ttl: Default time to live of an entry in seconds, None for entries that never expire
+    """
+
+    def __init__(self, path, table='store', ttl=None):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table}")
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                       '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, updated_at REAL NOT NULL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(list(key) if isinstance(key, tuple) else key, ensure_ascii=False)
+
+    def get(self, key, default=None):
+        """Return the value stored under key, or default if it is missing or expired."""
+        with closing(self._connect()) as db:
+            row = db.execute(f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (self._key(key),)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def put(self, key, value, ttl=None):
+        """Store value under key, expiring after ttl seconds (defaults to the ttl of the store)."""
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+        with closing(self._connect()) as db, db:
+            db.execute(f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, updated_at) VALUES (?, ?, ?, ?)',
+                       (self._key(key), json.dumps(value, ensure_ascii=False), expires_at, now))
+
+    def delete(self, key):
+        with closing(self._connect()) as db, db:
+            db.execute(f'DELETE FROM {self.table} WHERE key = ?', (self._key(key),))
+
+    def purge_expired(self):
+        """Delete the expired entries. Returns how many were deleted."""
+        with closing(self._connect()) as db, db:
+            return db.execute(f'DELETE FROM {self.table} WHERE expires_at < ?', (time.time(),)).rowcount
+
+    def __len__(self):
+        with closing(self._connect()) as db:
+            return db.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
@@ -0,0 +1,177 @@
+# Every method / basis set value of a CCCBDB dipole or quadrupole page, kept so that another
+# method or basis set can be read later without downloading the page again
+import math
+import sys
+import threading
+
+import numpy as np
+
+from cccbdb_failures import MISSING_METHOD, PARSE_FAILURE, Failure
+from checkpoint import molecule_key
+from json_store import JSONStore
+
+# state of a cell of the grid
+EMPTY = 0  # no value for this method and basis set
+VALUE = 1
+UNREADABLE = 2  # a value cell whose text is not a number
+NO_LINK = 3  # a value cell without a link, no value but where a basis set=None lookup stops
+
+
+class MethodGrid:
+    """
+    The method x basis set table (table2) of a CCCBDB data page as a float matrix.
+
+    The labels are interned, so the many grids of a run share one copy of each method
+    and basis set name.
+
+    Args:
+        methods: Method of each row, e.g. 'HF', 'B3LYP'
+        bases: Basis set of each column, e.g. '6-31G*'
+        values: Float array of shape (methods, bases), NaN where there is no value
+        status: int8 array of the same shape with EMPTY, VALUE, UNREADABLE or NO_LINK for every cell
+    """
+
+    __slots__ = ('methods', 'bases', 'values', 'status')
+
+    def __init__(self, methods, bases, values, status):
+        self.methods = tuple(sys.intern(method) for method in methods)
+        self.bases = tuple(sys.intern(basis) for basis in bases)
+        self.values = np.asarray(values, dtype=float).reshape(len(self.methods), len(self.bases))
+        self.status = np.asarray(status, dtype=np.int8).reshape(self.values.shape)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build a grid from the rows of table2, as read by an extractor.
+
+        Args:
+            rows: One list per table row of (tag, class, text, link text) tuples, one per th/td
+                cell, with the class normalized to single spaces and link text None without a link.
+                The first row of only th cells holds the basis sets, the rows that start with
+                a th followed by td cells are the methods.
+        """
+        bases = None
+        methods = []
+        cells = []
+        for row in rows:
+            if not row:
+                continue
+            tags = [cell[0] for cell in row]
+            if bases is None and len(row) > 1 and all(tag == 'th' for tag in tags):
+                bases = [cell[2] for cell in row[1:]]
+            elif tags[0] == 'th' and 'td' in tags[1:]:
+                methods.append(row[0][2])
+                cells.append([cell for cell in row[1:] if cell[0] == 'td'])
+
+        width = max([len(row) for row in cells] + [len(bases or [])])
+        if bases is None or len(bases) < width:
+            # no (complete) header row, the columns are numbered
+            bases = list(bases or []) + [str(i) for i in range(len(bases or []), width)]
+        values = np.full((len(methods), width), np.nan)
+        status = np.zeros((len(methods), width), dtype=np.int8)
+        for i, row in enumerate(cells):
+            for j, (_, class_name, _, link_text) in enumerate(row):
+                if class_name != 'num bordered':
+                    continue
+                if link_text is None:
+                    status[i, j] = NO_LINK
+                    continue
+                try:
+                    values[i, j] = float(link_text.strip())
+                    status[i, j] = VALUE
+                except ValueError:
+                    status[i, j] = UNREADABLE
+        return cls(methods, bases, values, status)
+
+    def __len__(self):
+        return int((self.status == VALUE).sum())
+
+    def _method_row(self, method):
+        # the exact method name first, otherwise the first row containing it as the scraper always did
+        if method in self.methods:
+            return self.methods.index(method)
+        for i, label in enumerate(self.methods):
+            if method in label:
+                return i
+        return None
+
+    def select(self, method='HF', basis=None):
+        """
+        Look up one value.
+
+        Args:
+            method: Method name, e.g. 'HF' or 'CCSD(T)'
+            basis: Basis set name, or None for the first value cell of the method row, the cell the
+                scraper always read: the first 'num bordered' cell from the left, with or without a value
+
+        Returns:
+            Tuple (value, failure) where failure is a cccbdb_failures.Failure when there is no value
+        """
+        i = self._method_row(method)
+        if i is None:
+            return None, Failure(MISSING_METHOD, f"Could not find {method} method row")
+        if basis is None:
+            # a row without value cells has no value for the method, the rows below are other methods
+            cells = np.flatnonzero(self.status[i] != EMPTY)
+            if not len(cells) or self.status[i, cells[0]] == NO_LINK:
+                return None, Failure(MISSING_METHOD, "Could not find value cell")
+            j = cells[0]
+        elif basis in self.bases:
+            j = self.bases.index(basis)
+        else:
+            return None, Failure(MISSING_METHOD, f"Could not find {basis} basis set column")
+
+        if self.status[i, j] in (EMPTY, NO_LINK):
+            return None, Failure(MISSING_METHOD, f"No value for {method}/{self.bases[j]}")
+        if self.status[i, j] == UNREADABLE:
+            return None, Failure(PARSE_FAILURE, f"Could not convert the {method}/{self.bases[j]} value to float")
+        return float(self.values[i, j]), None
+
+    def to_json(self):
+        return {
+            'methods': list(self.methods),
+            'bases': list(self.bases),
+            'values': [[None if math.isnan(value) else value for value in row] for row in self.values.tolist()],
+            'status': self.status.tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        values = [[math.nan if value is None else value for value in row] for row in data['values']]
+        return cls(data['methods'], data['bases'], values, data['status'])
+
+
+class GridStore:
+    """
+    Persistent MethodGrid of every molecule and property that was downloaded, so that
+    choosing another method or basis set is answered locally.
+
+    Args:
+        path: SQLite file of the store
+        ttl: Seconds after which a grid is downloaded again, None to keep grids forever
+    """
+
+    def __init__(self, path, ttl=None):
+        self.hits = 0
+        self._lock = threading.Lock()  # the workers of a run share the store
+        self._store = JSONStore(path, table='grids', ttl=ttl)
+
+    @staticmethod
+    def _key(formula, name, prop):
+        return molecule_key(formula, name) + (prop,)
+
+    def get(self, formula, name, prop):
+        """
+        Returns:
+            Tuple (MethodGrid, CCCBDB name, 'which' id) of a stored grid, or None
+        """
+        entry = self._store.get(self._key(formula, name, prop))
+        if entry is None:
+            return None
+        with self._lock:
+            self.hits += 1
+        return MethodGrid.from_json(entry['grid']), entry['cccbdb_name'], entry['which']
+
+    def put(self, formula, name, prop, grid, cccbdb_name=None, which=None):
+        self._store.put(self._key(formula, name, prop),
+                        {'grid': grid.to_json(), 'cccbdb_name': cccbdb_name, 'which': which})
@@ -0,0 +1,339 @@
+# Runs the whole workflow of the README as a DAG of stages. Every stage gets a fingerprint from the
+# content of its input files, its parameters and the source code it runs, and is only executed again
+# when the fingerprint changed: changing the quadrupole threshold re-runs the quadrupole filter only,
+# and a stage whose output came out byte for byte the same does not re-run the stages after it.
+import argparse
+import ast
+import hashlib
+import json
+import os
+import sys
+import time
+
+from cccbdb_client import add_client_arguments, client_from_args, set_client
+from filter_dipole import filter_molecules_by_dipole
+from filter_for_ions_and_radicals import filter_ions_and_radicals
+from filter_point_group import search_point_group
+from filter_quadrupole import filter_molecules_by_quadrupole
+from fraction_calculator import calculate_fraction
+from html_to_csv import html_to_csv
+from prolate_oblate_check import DEFAULT_NEAR, DEFAULT_RTOL, classify_and_save
+from property_store import store_from_args
+from remove_doubled_formulas import remove_doubled_formulas
+from rotational_constant import extract_rotational_constants_to_csv
+from table_io import FORMATS, add_format_arguments, format_from_args
+from tracing import span
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WORK_DIR = "molecule_filter_TOC/pipeline"
+STATE_FILE = "pipeline_state.json"
+
+
+class Stage:
+    """
+    One step of the workflow.
+
+    Args:
+        name: Name of the stage, used by --force and --until
+        module: Module of the function the stage runs. Its source and the sources of the
+            local modules it imports are part of the fingerprint
+        run: Callable run(inputs, outputs, params, context) that executes the stage
+        inputs: Dictionary from role to input file, either a file of the user or the output of another stage
+        outputs: Dictionary from role to output file
+        params: Dictionary of the parameters that change the results
+    """
+
+    def __init__(self, name, module, run, inputs, outputs, params=None):
+        self.name = name
+        self.module = module
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+
+
+def file_hash(path):
+    """sha256 of the content of a file, read 1 MB at a time."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+_source_files = {}
+
+
+def source_files(module):
+    """
+    The source file of a module of this repository and of all the repository modules it
+    imports, directly or through other modules.
+    """
+    if module in _source_files:
+        return _source_files[module]
+    files = set()
+    pending = [module]
+    while pending:
+        path = os.path.join(REPO_DIR, pending.pop() + '.py')
+        if path in files or not os.path.exists(path):
+            continue  # a module of the standard library or an installed package
+        files.add(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.append(node.module.split('.')[0])
+    _source_files[module] = sorted(files)
+    return _source_files[module]
+
+
+def fingerprint(stage):
+    """Hash of the input files, the parameters, the output paths and the code of a stage."""
+    payload = {
+        'inputs': {role: file_hash(path) for role, path in stage.inputs.items()},
+        'outputs': sorted(stage.outputs.values()),
+        'params': stage.params,
+        'code': {os.path.relpath(path, REPO_DIR): file_hash(path) for path in source_files(stage.module)},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def topological_order(stages):
+    """
+    Order the stages so every stage comes after the stages whose outputs it reads.
+    Raises ValueError when two stages write the same file or the stages depend on each other in a cycle.
+    """
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs.values():
+            if path in producers:
+                raise ValueError(f"{path} is written by both {producers[path].name} and {stage.name}")
+            producers[path] = stage
+
+    ordered = []
+    done = set()
+    visiting = set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"The stages depend on each other in a cycle through {stage.name}")
+        visiting.add(stage.name)
+        for path in stage.inputs.values():
+            if path in producers:
+                visit(producers[path])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+def upstream_stages(stages, stage):
+    """Names of the stages whose outputs stage reads."""
+    producers = {path: other.name for other in stages for path in other.outputs.values()}
+    return {producers[path] for path in stage.inputs.values() if path in producers}
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state, path):
+    # written to a temporary file first, an interrupted run never leaves a broken state file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(stage, record, stage_fingerprint):
+    # the same fingerprint as the last run, and the outputs of that run are still there, unchanged
+    if record is None or record.get('fingerprint') != stage_fingerprint:
+        return False
+    for path in stage.outputs.values():
+        if not os.path.exists(path) or file_hash(path) != record['outputs'].get(path):
+            return False
+    return True
+
+
+def run_pipeline(stages, state_path, context=None, force=(), until=None, dry_run=False):
+    """
+    Run the stages whose fingerprint changed since their last successful run, in dependency order.
+
+    Args:
+        stages: List of Stage
+        state_path: JSON file with the fingerprint and output hashes of every stage's last run
+        context: Dictionary passed to every stage, e.g. the CCCBDB client and the property store
+        force: Names of stages to run even when they are up to date ('all' for every stage)
+        until: Name of the last stage to run, None to run them all
+        dry_run: Only print which stages would run
+
+    Returns:
+        List of the names of the stages that were run (or would run with dry_run)
+    """
+    stages = topological_order(stages)
+    names = [stage.name for stage in stages]
+    unknown = ((set(force) - {'all'}) | ({until} - {None})) - set(names)
+    if unknown:
+        raise ValueError(f"Unknown stage(s) {sorted(unknown)}, the stages are {', '.join(names)}")
+
+    state = load_state(state_path)
+    records = state.setdefault('stages', {})
+    ran = []
+    for stage in stages:
+        if dry_run and upstream_stages(stages, stage) & set(ran):
+            # the inputs are going to change, the fingerprint cannot be known yet
+            print(f"[{stage.name}] would run (an input is rebuilt)")
+            ran.append(stage.name)
+        else:
+            missing = [path for path in stage.inputs.values() if not os.path.exists(path)]
+            if missing:
+                raise FileNotFoundError(f"[{stage.name}] input file(s) not found: {', '.join(missing)}")
+
+            stage_fingerprint = fingerprint(stage)
+            forced = 'all' in force or stage.name in force
+            if not forced and is_up_to_date(stage, records.get(stage.name), stage_fingerprint):
+                print(f"[{stage.name}] up to date, skipped")
+            elif dry_run:
+                print(f"[{stage.name}] would run" + (" (forced)" if forced else ""))
+                ran.append(stage.name)
+            else:
+                print(f"\n[{stage.name}] running")
+                start = time.time()
+                with span('stage', stage=stage.name):
+                    stage.run(stage.inputs, stage.outputs, stage.params, context or {})
+                seconds = time.time() - start
+                missing = [path for path in stage.outputs.values() if not os.path.exists(path)]
+                if missing:
+                    raise RuntimeError(f"[{stage.name}] did not write {', '.join(missing)}")
+                # saved after every stage, so a failed or interrupted run keeps the finished stages
+                records[stage.name] = {
+                    'fingerprint': stage_fingerprint,
+                    'outputs': {path: file_hash(path) for path in stage.outputs.values()},
+                    'seconds': seconds,
+                    'finished_at': time.time(),
+                }
+                save_state(state, state_path)
+                print(f"[{stage.name}] finished in {seconds:.1f} s")
+                ran.append(stage.name)
+        if stage.name == until:
+            break
+    return ran
+
+
+def build_stages(html_file, point_groups_csv, work_dir=DEFAULT_WORK_DIR, table_format='csv', rtol=DEFAULT_RTOL,
+                 near=DEFAULT_NEAR, dipole_threshold=0, quadrupole_threshold=0.3, method='HF', basis=None):
+    """
+    The stages of the workflow of the README, from the saved NIST page to the quadrupole filter.
+    The outputs are written to work_dir, from the point group filter on in table_format.
+
+    Args:
+        html_file: Saved NIST page with the vibrational data
+        point_groups_csv: Point groups of the CCCBDB molecules, written by get_point_group_from_cccbdb.py
+        work_dir: Directory of the outputs and of the pipeline state
+        table_format: 'csv', 'parquet' or 'arrow'
+        rtol, near: Tolerances of the rotor shape classification, see prolate_oblate_check.py
+        dipole_threshold, quadrupole_threshold: Pass thresholds of the dipole and quadrupole filters
+        method, basis: Method and basis set of the dipole and quadrupole values
+    """
+    def path(name, extension='.csv'):
+        return os.path.join(work_dir, name + extension)
+
+    table = FORMATS[table_format]
+    filter_outputs = ('good', 'no_value', 'discarded', 'joined')
+
+    return [
+        Stage('html_to_csv', 'html_to_csv',
+              lambda i, o, p, c: html_to_csv(i['html'], o['table']),
+              {'html': html_file}, {'table': path('0_vibrational_frequencies')}),
+        Stage('ions_and_radicals', 'filter_for_ions_and_radicals',
+              lambda i, o, p, c: filter_ions_and_radicals(i['table'], o['table']),
+              {'table': path('0_vibrational_frequencies')}, {'table': path('1_filtered_for_ions_and_radicals')}),
+        Stage('doubled_formulas', 'remove_doubled_formulas',
+              lambda i, o, p, c: remove_doubled_formulas(i['table'], o['table']),
+              {'table': path('1_filtered_for_ions_and_radicals')}, {'table': path('2_filtered_for_duplicated_vibrations')}),
+        Stage('point_group', 'filter_point_group',
+              lambda i, o, p, c: search_point_group(i['table'], i['point_groups'], o['table'], store=c.get('store')),
+              {'table': path('2_filtered_for_duplicated_vibrations'), 'point_groups': point_groups_csv},
+              {'table': path('3_filtered_with_point_group', table)}),
+        Stage('rotational_constants', 'rotational_constant',
+              lambda i, o, p, c: extract_rotational_constants_to_csv(
+                  i['table'], o['table'], client=c.get('client'), workers=c.get('workers', 1),
+                  previous=o['table'] if c.get('incremental') else None),
+              {'table': path('3_filtered_with_point_group', table)}, {'table': path('5_rotational_constants', table)}),
+        Stage('rotor_shapes', 'prolate_oblate_check',
+              lambda i, o, p, c: classify_and_save(i['table'], work_dir, p['rtol'], p['near'], c.get('store'), table_format),
+              {'table': path('5_rotational_constants', table)},
+              {kind: path('5_' + kind, table) for kind in ('prolate', 'oblate', 'linear', 'prolate_and_linear', 'rotor_shapes')},
+              {'rtol': rtol, 'near': near}),
+        Stage('dipole', 'filter_dipole',
+              lambda i, o, p, c: filter_molecules_by_dipole(
+                  i['table'], *(o[role] for role in filter_outputs), client=c.get('client'),
+                  workers=c.get('workers', 1), resume=c.get('resume', False), threshold=p['threshold'],
+                  previous=[o[role] for role in filter_outputs[:3]] if c.get('incremental') else None),
+              {'table': path('5_prolate_and_linear', table)},
+              dict(zip(filter_outputs, (path(name, table) for name in
+                                        ('5_dipole_moment', '5_dipole_not_found', '5_dipole_discarted', '5_dipole_joined')))),
+              {'threshold': dipole_threshold, 'method': method, 'basis': basis}),
+        Stage('fraction', 'fraction_calculator',
+              lambda i, o, p, c: calculate_fraction(i['table'], o['table'], chunksize=c.get('chunksize'), store=c.get('store')),
+              {'table': path('5_dipole_moment', table)}, {'table': path('5_fraction', table)}),
+        Stage('quadrupole', 'filter_quadrupole',
+              lambda i, o, p, c: filter_molecules_by_quadrupole(
+                  i['table'], *(o[role] for role in filter_outputs), client=c.get('client'),
+                  workers=c.get('workers', 1), resume=c.get('resume', False), threshold=p['threshold'],
+                  previous=[o[role] for role in filter_outputs[:3]] if c.get('incremental') else None),
+              {'table': path('5_fraction', table)},
+              dict(zip(filter_outputs, (path(name, table) for name in
+                                        ('6_quadrupole_passed', '6_quadrupole_no_values', '6_quadrupole_discarted', '6_quadrupole_joined')))),
+              {'threshold': quadrupole_threshold, 'method': method, 'basis': basis}),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the molecule filtration workflow, re-running only the stages whose inputs, parameters or code changed")
+    parser.add_argument('html_file', help='saved NIST page with the vibrational data')
+    parser.add_argument('point_groups_csv', help='point groups of the CCCBDB molecules (get_point_group_from_cccbdb.py)')
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help=f'directory of the outputs and of {STATE_FILE} (default: {DEFAULT_WORK_DIR})')
+    parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL, help='relative tolerance for two rotational constants to be equal')
+    parser.add_argument('--near', type=float, default=DEFAULT_NEAR, help='smallest |kappa| of a near-prolate / near-oblate top')
+    parser.add_argument('--dipole-threshold', type=float, default=0, help='smallest dipole moment that passes the dipole filter (default: 0)')
+    parser.add_argument('--quadrupole-threshold', type=float, default=0.3, help='smallest absolute quadrupole moment that passes the quadrupole filter (default: 0.3)')
+    parser.add_argument('--chunksize', type=int, default=None, help='rows the fraction calculator processes at a time')
+    parser.add_argument('--resume', action='store_true', help='resume the dipole and quadrupole filters from their journals')
+    parser.add_argument('--incremental', action='store_true',
+                        help='the scraping stages only look up the molecules added or changed since their last outputs')
+    parser.add_argument('--force', nargs='+', default=[], metavar='STAGE', help="run these stages even when they are up to date ('all' for every stage)")
+    parser.add_argument('--until', default=None, metavar='STAGE', help='stop after this stage')
+    parser.add_argument('--dry-run', action='store_true', help='only print which stages would run')
+    add_client_arguments(parser)  # also adds --store and --no-store
+    add_format_arguments(parser)
+    args = parser.parse_args()
+
+    client = client_from_args(args)
+    set_client(client)
+    os.makedirs(args.work_dir, exist_ok=True)
+    stages = build_stages(args.html_file, args.point_groups_csv, args.work_dir, format_from_args(args), args.rtol,
+                          args.near, args.dipole_threshold, args.quadrupole_threshold, client.method, client.basis)
+    context = {
+        'client': client,
+        'store': None if args.dry_run else store_from_args(args),
+        'workers': args.workers,
+        'chunksize': args.chunksize,
+        'resume': args.resume,
+        'incremental': args.incremental,
+    }
+    try:
+        ran = run_pipeline(stages, os.path.join(args.work_dir, STATE_FILE), context, args.force, args.until, args.dry_run)
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        sys.exit(f"Error: {e}")
+    print(f"\n{len(ran)} stage(s) {'would run' if args.dry_run else 'run'}: {', '.join(ran) if ran else 'none'}")
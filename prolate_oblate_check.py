@@ -1,137 +1,227 @@
+import argparse
 import pandas as pd
 import numpy as np
 import os
 
-def analyze_molecular_shapes(file_path):
+from property_store import add_store_arguments, store_from_args
+import table_io
+from value_filter import empty_as_before
+
+# Shapes assigned by classify_rotors
+LINEAR = 'linear'
+PROLATE = 'prolate'
+OBLATE = 'oblate'
+SPHERICAL = 'spherical'
+NEAR_PROLATE = 'near-prolate'
+NEAR_OBLATE = 'near-oblate'
+ASYMMETRIC = 'asymmetric'
+UNKNOWN = 'unknown'  # no usable rotational constants
+SHAPES = np.array([LINEAR, SPHERICAL, PROLATE, OBLATE, NEAR_PROLATE, NEAR_OBLATE, ASYMMETRIC, UNKNOWN], dtype=object)
+
+# Default relative tolerance below which two rotational constants count as equal
+DEFAULT_RTOL = 1e-6
+# Default |kappa| from which an asymmetric top counts as a near-symmetric top
+DEFAULT_NEAR = 0.9
+
+OUTPUT_DIR = "molecule_filter_TOC/2025_05_13_change_order"
+
+
+def read_table(file_path):
     """
-    Analyzes molecular shapes based on values in columns 9, 10, and 11.
-    - If two equal values are smaller than the third value: prolate
-    - If two equal values are larger than the third value: oblate
-    - If two values are 0 (or nearly 0) and one is non-zero: linear
-    
-    Args:
-        file_path: Path to the Excel file
-    
-    Returns:
-        Three dataframes: prolates, oblates, and linears
+    Reads an Excel, CSV, Parquet or Arrow file into a DataFrame, based on the file extension.
     """
-    # Try to detect file extension to handle both Excel and CSV files
+    # Try to detect file extension to handle both Excel files and the tables of the other stages
     _, file_extension = os.path.splitext(file_path)
-    
+
     if file_extension.lower() in ['.xlsx', '.xls']:
-        df = pd.read_excel(file_path)
-    elif file_extension.lower() == '.csv':
-        df = pd.read_csv(file_path)
+        return pd.read_excel(file_path)
+    elif file_extension.lower() in table_io.EXTENSIONS:
+        return table_io.read_table(file_path)
     else:
         raise ValueError(f"Unsupported file extension: {file_extension}")
-    
+
+
+def classify_rotors(constants, rtol=DEFAULT_RTOL, near=DEFAULT_NEAR):
+    """
+    Classifies the rotor shape of many molecules at once from their rotational constants.
+
+    The constants of every row are sorted so that A >= B >= C, and Ray's asymmetry
+    parameter kappa = (2B - A - C) / (A - C) is computed (-1 for a prolate, +1 for an
+    oblate symmetric top). Two constants count as equal when they differ by at most
+    rtol times the larger one.
+    - Only the first constant given (the other two NaN): linear
+    - All three equal: spherical
+    - The two smaller equal (B = C < A): prolate
+    - The two larger equal (A = B > C): oblate
+    - kappa <= -near: near-prolate, kappa >= near: near-oblate, otherwise asymmetric
+    - Any other combination of missing constants: unknown
+
+    Args:
+        constants: Array-like of shape (N, 3) with the rotational constants of each molecule
+        rtol: Relative tolerance for two constants to be equal
+        near: Smallest |kappa| of a near-symmetric top
+
+    Returns:
+        Two arrays of length N: the shape of each molecule and its kappa
+        (-1 for linear molecules, NaN for spherical and unknown ones)
+    """
+    constants = np.asarray(constants, dtype=float)
+    missing = np.isnan(constants)
+    linear = ~missing[:, 0] & missing[:, 1] & missing[:, 2]
+    valid = ~missing.any(axis=1)
+
+    # sort descending: A >= B >= C
+    ordered = -np.sort(-constants, axis=1)
+    a, b, c = ordered[:, 0], ordered[:, 1], ordered[:, 2]
+    a_equals_b = np.abs(a - b) <= rtol * np.abs(a)
+    b_equals_c = np.abs(b - c) <= rtol * np.abs(b)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kappa = (2 * b - a - c) / (a - c)
+
+    spherical = valid & a_equals_b & b_equals_c
+    prolate = valid & b_equals_c & ~spherical
+    oblate = valid & a_equals_b & ~spherical
+    # the tolerance may hide a tiny asymmetry, the symmetric tops get their exact kappa
+    kappa = np.where(prolate | linear, -1.0, np.where(oblate, 1.0, kappa))
+    kappa = np.where(spherical | ~(valid | linear), np.nan, kappa)
+
+    # select a small integer code per row and look the names up at the end, much faster than
+    # selecting between strings
+    codes = np.select(
+        [linear, spherical, prolate, oblate, valid & (kappa <= -near), valid & (kappa >= near), valid],
+        np.arange(len(SHAPES) - 1), default=len(SHAPES) - 1)
+    shapes = SHAPES[codes]
+    return shapes, kappa
+
+
+def add_rotor_shapes(df, rtol=DEFAULT_RTOL, near=DEFAULT_NEAR):
+    """
+    Returns a copy of df with the "Rotor Shape" and "Ray Kappa" of every molecule,
+    computed from the rotational constants in columns 9, 10, and 11.
+    """
     # Get the actual column names or indices
-    if len(df.columns) >= 12:  # Make sure we have enough columns
-        # Use direct 0-based indices as specified
-        col1 = 9   # 10th column (0-indexed)
-        col2 = 10  # 11th column (0-indexed)
-        col3 = 11  # 12th column (0-indexed)
-    else:
+    if len(df.columns) < 12:  # Make sure we have enough columns
         raise ValueError(f"The file does not have enough columns. It has {len(df.columns)} columns, but we need at least 12.")
-    
-    # Create empty lists to store results
-    prolates = []
-    oblates = []
-    linears = []
-    
-    # Define a small threshold for considering values as nearly equal or nearly zero
-    epsilon = 1e-10
-    
-    # Analyze each row
-    for index, row in df.iterrows():
-        # Get the three values
-        val1 = row[col1]
-        val2 = row[col2]
-        val3 = row[col3]
-        
-        # Check for linear molecules (only column 9 has a value, columns 10 and 11 are empty or NaN)
-        if pd.notna(val1) and (pd.isna(val2) or val2 == '') and (pd.isna(val3) or val3 == ''):
-            linears.append(row)
-            continue
-        
-        # For non-linear molecules, ensure all values are valid numbers
-        if pd.isna(val1) or pd.isna(val2) or pd.isna(val3):
-            continue
-            
-        # Check if any two values are equal
-        if abs(val1 - val2) < epsilon:
-            equal_value = val1
-            third_value = val3
-        elif abs(val1 - val3) < epsilon:
-            equal_value = val1
-            third_value = val2
-        elif abs(val2 - val3) < epsilon:
-            equal_value = val2
-            third_value = val1
-        else:
-            # If all values are different, skip this row or handle differently
-            continue
-        
-        # Determine shape based on comparison
-        if equal_value < third_value:
-            prolates.append(row)
-        else:  # equal_value > third_value
-            oblates.append(row)
-    
-    # Convert lists to dataframes
-    prolates_df = pd.DataFrame(prolates)
-    oblates_df = pd.DataFrame(oblates)
-    linears_df = pd.DataFrame(linears)
-    
-    return prolates_df, oblates_df, linears_df
-
-def save_results(prolates_df, oblates_df, linears_df):
+
+    # Use direct 0-based indices as specified: the 10th, 11th and 12th column. Empty cells
+    # (and anything else that is not a number) become NaN
+    constants = df.iloc[:, 9:12].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    shapes, kappa = classify_rotors(constants, rtol, near)
+    return df.assign(**{"Rotor Shape": shapes, "Ray Kappa": kappa})
+
+
+def _rows(df, mask):
+    return empty_as_before(df[mask])
+
+
+def split_shapes(shapes_df):
+    """
+    Splits a DataFrame returned by add_rotor_shapes into prolates, oblates and linears,
+    with the columns of the input file.
     """
-    Saves the results to CSV files
-    
+    shapes = shapes_df["Rotor Shape"]
+    columns = shapes_df.drop(columns=["Rotor Shape", "Ray Kappa"])
+    return _rows(columns, shapes == PROLATE), _rows(columns, shapes == OBLATE), _rows(columns, shapes == LINEAR)
+
+
+def analyze_molecular_shapes(file_path, rtol=DEFAULT_RTOL, near=DEFAULT_NEAR):
+    """
+    Analyzes molecular shapes based on values in columns 9, 10, and 11.
+    - If two equal values are smaller than the third value: prolate
+    - If two equal values are larger than the third value: oblate
+    - If only the first value is given: linear
+    Spherical, near-symmetric and asymmetric tops are not in any of the three
+    dataframes, add_rotor_shapes labels every molecule.
+
+    Args:
+        file_path: Path to the Excel, CSV, Parquet or Arrow file
+        rtol: Relative tolerance for two constants to be equal
+        near: Smallest |kappa| of a near-symmetric top
+
+    Returns:
+        Three dataframes: prolates, oblates, and linears
+    """
+    return split_shapes(add_rotor_shapes(read_table(file_path), rtol, near))
+
+def save_results(prolates_df, oblates_df, linears_df, output_dir=OUTPUT_DIR, shapes_df=None, table_format='csv'):
+    """
+    Saves the results to CSV, Parquet or Arrow files
+
     Args:
         prolates_df: DataFrame containing prolate molecules
         oblates_df: DataFrame containing oblate molecules
         linears_df: DataFrame containing linear molecules
         output_dir: Directory to save the output files
+        shapes_df: DataFrame of all molecules with their rotor shape, saved to 5_rotor_shapes (optional)
+        table_format: 'csv', 'parquet' or 'arrow'
     """
-    # Create the output directory if it doesn't exist
-    
     # Define file paths
-    prolates_path = "molecule_filter_TOC/2025_05_13_change_order/5_prolate.csv"
-    oblates_path = "molecule_filter_TOC/2025_05_13_change_order/5_oblate.csv"
-    linears_path = "molecule_filter_TOC/2025_05_13_change_order/5_linear.csv"
-    prolate_linear_path = "molecule_filter_TOC/2025_05_13_change_order/5_prolate_and_linear.csv"
-    
+    extension = table_io.FORMATS[table_format]
+    prolates_path = os.path.join(output_dir, "5_prolate" + extension)
+    oblates_path = os.path.join(output_dir, "5_oblate" + extension)
+    linears_path = os.path.join(output_dir, "5_linear" + extension)
+    prolate_linear_path = os.path.join(output_dir, "5_prolate_and_linear" + extension)
+
     # Save individual files
-    prolates_df.to_csv(prolates_path, index=False)
-    oblates_df.to_csv(oblates_path, index=False)
-    linears_df.to_csv(linears_path, index=False)
-    
+    table_io.write_table(prolates_df, prolates_path)
+    table_io.write_table(oblates_df, oblates_path)
+    table_io.write_table(linears_df, linears_path)
+
     # Combine prolates and linears
     prolate_linear_df = pd.concat([prolates_df, linears_df])
-    prolate_linear_df.to_csv(prolate_linear_path, index=False)
-    
+    table_io.write_table(prolate_linear_df, prolate_linear_path)
+
     print(f"Saved prolate molecules to: {prolates_path}")
     print(f"Saved oblate molecules to: {oblates_path}")
     print(f"Saved linear molecules to: {linears_path}")
     print(f"Saved prolate and linear molecules to: {prolate_linear_path}")
+    if shapes_df is not None:
+        shapes_path = os.path.join(output_dir, "5_rotor_shapes" + extension)
+        table_io.write_table(shapes_df, shapes_path)
+        print(f"Saved all molecules with their rotor shape to: {shapes_path}")
     print(f"Found {len(prolates_df)} prolate molecules, {len(oblates_df)} oblate molecules, and {len(linears_df)} linear molecules.")
+    if shapes_df is not None:
+        counts = shapes_df["Rotor Shape"].value_counts()
+        print("Rotor shapes: " + ", ".join(f"{shape}={count}" for shape, count in counts.items()))
+
+def classify_and_save(file_path, output_dir=OUTPUT_DIR, rtol=DEFAULT_RTOL, near=DEFAULT_NEAR, store=None, table_format='csv'):
+    """
+    Classifies the molecules of file_path and saves the 5_* outputs to output_dir, see save_results.
+    Errors are raised, main() only prints them.
+    """
+    shapes_df = add_rotor_shapes(read_table(file_path), rtol, near)
+    prolates_df, oblates_df, linears_df = split_shapes(shapes_df)
+
+    # Save results
+    save_results(prolates_df, oblates_df, linears_df, output_dir, shapes_df, table_format)
+
+    # the shape of every molecule is also upserted into the property store
+    if store is not None:
+        store.upsert_frame(shapes_df, {"Rotor Shape": "rotor_shape", "Ray Kappa": "ray_kappa"})
+
+
+def main(file_path, output_dir=OUTPUT_DIR, rtol=DEFAULT_RTOL, near=DEFAULT_NEAR, store=None, table_format='csv'):
 
-def main(file_path):
-    
     try:
-        prolates_df, oblates_df, linears_df = analyze_molecular_shapes(file_path)
-        
-        # Save results
-        save_results(prolates_df, oblates_df, linears_df)
-        
+        classify_and_save(file_path, output_dir, rtol, near, store, table_format)
         print("\nAnalysis complete!")
-        
+
     except Exception as e:
         print(f"An error occurred: {e}")
 
 
-
-file_path = "molecule_filter_TOC/2025_05_13_change_order/5_rotational_constants_with_average.csv"
-main(file_path)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify molecules as linear, prolate, oblate or asymmetric tops from their rotational constants")
+    parser.add_argument('file_path', nargs='?', default=None,
+                        help='Excel, CSV, Parquet or Arrow file (default: 5_rotational_constants_with_average in the output directory)')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='directory of the 5_* outputs')
+    parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL, help=f'relative tolerance for two rotational constants to be equal (default: {DEFAULT_RTOL})')
+    parser.add_argument('--near', type=float, default=DEFAULT_NEAR, help=f'smallest |kappa| of a near-prolate / near-oblate top (default: {DEFAULT_NEAR})')
+    add_store_arguments(parser)
+    table_io.add_format_arguments(parser)
+    args = parser.parse_args()
+    table_format = table_io.format_from_args(args)
+    file_path = args.file_path or table_io.find_table(
+        table_io.with_format(os.path.join(OUTPUT_DIR, "5_rotational_constants_with_average.csv"), table_format))
+    main(file_path, args.output_dir, args.rtol, args.near, store_from_args(args), table_format)
@@ -0,0 +1,258 @@
+# Local SQLite store of everything known about each molecule (point group, rotational constants,
+# rotor shape, dipole and quadrupole moments, Stark fractions) and where the values came from.
+# The pipeline stages upsert into it, CSV files are an export.
+import argparse
+import math
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import pandas as pd
+
+from checkpoint import journal_key, molecule_key
+
+DEFAULT_STORE_PATH = 'molecules.sqlite'
+
+# column of the molecules table -> SQL type
+COLUMNS = {
+    'formula': 'TEXT',
+    'name': 'TEXT',
+    'point_group': 'TEXT',
+    'rotational_constant_1': 'REAL',
+    'rotational_constant_2': 'REAL',
+    'rotational_constant_3': 'REAL',
+    'rotor_shape': 'TEXT',
+    'ray_kappa': 'REAL',
+    'dipole': 'REAL',
+    'quadrupole': 'REAL',
+    'stark_1': 'REAL',
+    'stark_2': 'REAL',
+    'stark_3': 'REAL',
+    'cccbdb_name': 'TEXT',
+    'which': 'TEXT',
+}
+
+# columns of the CSV files written by the stages -> columns of the store
+CSV_COLUMNS = {
+    'Point Group': 'point_group',
+    'Rotational Constant 1': 'rotational_constant_1',
+    'Rotational Constant 2': 'rotational_constant_2',
+    'Rotational Constant 3': 'rotational_constant_3',
+    'Rotor Shape': 'rotor_shape',
+    'Ray Kappa': 'ray_kappa',
+    'Dipole Moment': 'dipole',
+    'Quadrupole Moment': 'quadrupole',
+    'Stark 1': 'stark_1',
+    'Stark 2': 'stark_2',
+    'Stark 3': 'stark_3',
+}
+
+# CCCBDB property of a lookup record -> columns of the store
+LOOKUP_COLUMNS = {
+    'rotational': ['rotational_constant_1', 'rotational_constant_2', 'rotational_constant_3'],
+    'dipole': ['dipole'],
+    'quadrupole': ['quadrupole'],
+}
+
+
+def molecule_id(formula, name):
+    """Canonical id of a molecule in the store, the same key the journal uses."""
+    return journal_key(formula, name)
+
+
+def _sql_value(value):
+    # NaN (how pandas marks a missing value) is stored as NULL
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    return value
+
+
+class PropertyStore:
+    """
+    One row per molecule, keyed by molecule_id(formula, name), with indexes on the formula,
+    the (case-insensitive) name, the rotor shape and the dipole moment. A provenance table
+    records for every CCCBDB lookup the method, the failure category and when it was made.
+
+    Every call opens its own SQLite connection, so one store can be used from several
+    threads and processes at the same time.
+
+    Args:
+        path: SQLite file of the store
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        columns = ', '.join(f'"{column}" {sql_type}' for column, sql_type in COLUMNS.items())
+        with closing(self._connect()) as db, db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(f'CREATE TABLE IF NOT EXISTS molecules (id TEXT PRIMARY KEY, name_key TEXT, {columns}, '
+                       'updated_at REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS molecules_formula ON molecules (formula)')
+            db.execute('CREATE INDEX IF NOT EXISTS molecules_name ON molecules (name_key)')
+            db.execute('CREATE INDEX IF NOT EXISTS molecules_shape_dipole ON molecules (rotor_shape, dipole)')
+            db.execute('CREATE INDEX IF NOT EXISTS molecules_dipole ON molecules (dipole)')
+            db.execute('CREATE TABLE IF NOT EXISTS provenance (id TEXT NOT NULL, property TEXT NOT NULL, '
+                       'method TEXT, failure TEXT, fetched_at REAL NOT NULL, PRIMARY KEY (id, property))')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def upsert(self, rows):
+        """
+        Insert or update molecules. Only the columns given in a row are changed, the values
+        other stages stored for the molecule are kept.
+
+        Args:
+            rows: Iterable of dictionaries with 'formula', 'name' and any of COLUMNS
+
+        Returns:
+            Number of rows written
+        """
+        now = time.time()
+        # rows with the same columns are written with one statement
+        batches = {}
+        for row in rows:
+            unknown = set(row) - set(COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown column(s) {sorted(unknown)}, the store has {list(COLUMNS)}")
+            formula, name_key = molecule_key(row['formula'], row.get('name'))
+            values = {column: _sql_value(value) for column, value in row.items()}
+            values['formula'] = formula
+            values['name'] = values.get('name') if isinstance(values.get('name'), str) else None
+            columns = tuple(values)
+            batches.setdefault(columns, []).append(
+                (molecule_id(row['formula'], row.get('name')), name_key, *values.values(), now))
+
+        written = 0
+        with closing(self._connect()) as db, db:
+            for columns, batch in batches.items():
+                names = ', '.join(f'"{column}"' for column in columns)
+                updates = ', '.join(f'"{column}" = excluded."{column}"' for column in columns)
+                placeholders = ', '.join('?' * (len(columns) + 3))
+                db.executemany(f'INSERT INTO molecules (id, name_key, {names}, updated_at) VALUES ({placeholders}) '
+                               f'ON CONFLICT (id) DO UPDATE SET {updates}, updated_at = excluded.updated_at', batch)
+                written += len(batch)
+        return written
+
+    def upsert_frame(self, df, columns=None, formula_column=3, name_column=2):
+        """
+        Upsert the molecules of a DataFrame of one of the pipeline stages.
+
+        Args:
+            df: DataFrame with the formula and name in the usual columns
+            columns: Dictionary from DataFrame column to store column, defaults to the
+                columns of CSV_COLUMNS that are in df
+            formula_column: Position of the formula column (the 4th, as in every stage)
+            name_column: Position of the name column (the 3rd)
+        """
+        if columns is None:
+            columns = {column: CSV_COLUMNS[column] for column in df.columns if column in CSV_COLUMNS}
+        frame = pd.DataFrame({store_column: df[column].to_numpy() for column, store_column in columns.items()})
+        frame['formula'] = df.iloc[:, formula_column].to_numpy()
+        frame['name'] = df.iloc[:, name_column].to_numpy()
+        frame = frame.astype(object).where(frame.notna(), None)
+        return self.upsert(frame.to_dict('records'))
+
+    def record_lookup(self, record, methods=None):
+        """
+        Store the values and provenance of a CCCBDB lookup (a record of
+        cccbdb_properties.fetch_molecule_properties). Properties without a value keep
+        the value stored before, only their failure is recorded.
+
+        Args:
+            record: Lookup record with formula, name, cccbdb_name, which, the properties and failures
+            methods: Dictionary from property to the method its value was read for
+        """
+        methods = methods or {}
+        row = {'formula': record['formula'], 'name': record['name']}
+        if record.get('cccbdb_name') is not None:
+            row['cccbdb_name'] = record['cccbdb_name']
+        if record.get('which') is not None:
+            row['which'] = record['which']
+        properties = [prop for prop in LOOKUP_COLUMNS if prop in record]
+        for prop in properties:
+            value = record[prop]
+            if value is None:
+                continue
+            values = list(value)[:3] if prop == 'rotational' else [value]
+            values += [None] * (len(LOOKUP_COLUMNS[prop]) - len(values))
+            row.update(zip(LOOKUP_COLUMNS[prop], values))
+        self.upsert([row])
+
+        now = time.time()
+        key = molecule_id(record['formula'], record['name'])
+        failures = record.get('failures', {})
+        with closing(self._connect()) as db, db:
+            db.executemany('INSERT OR REPLACE INTO provenance (id, property, method, failure, fetched_at) '
+                           'VALUES (?, ?, ?, ?, ?)',
+                           [(key, prop, methods.get(prop), failures.get(prop), now) for prop in properties])
+
+    def get(self, formula, name=None):
+        """Return the stored columns of a molecule as a dictionary, or None."""
+        with closing(self._connect()) as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute('SELECT * FROM molecules WHERE id = ?', (molecule_id(formula, name),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def query(self, where=None, params=(), columns=None):
+        """
+        Select molecules, e.g. query("rotor_shape = ? AND dipole >= ?", ('prolate', 0.5)).
+        The conditions on formula, name_key, rotor_shape and dipole use the indexes.
+
+        Returns:
+            DataFrame with one row per molecule, in the order the molecules were first stored
+        """
+        selected = ', '.join(f'"{column}"' for column in columns) if columns else '*'
+        sql = f'SELECT {selected} FROM molecules' + (f' WHERE {where}' if where else '') + ' ORDER BY rowid'
+        with closing(self._connect()) as db:
+            return pd.read_sql_query(sql, db, params=params)
+
+    def provenance(self, formula, name=None):
+        """Return the provenance rows of a molecule as a DataFrame."""
+        with closing(self._connect()) as db:
+            return pd.read_sql_query('SELECT property, method, failure, fetched_at FROM provenance WHERE id = ?',
+                                     db, params=(molecule_id(formula, name),))
+
+    def export_csv(self, output_csv, where=None, params=(), columns=None):
+        """Write the selected molecules to a CSV file. Returns the number of molecules written."""
+        df = self.query(where, params, columns)
+        df.to_csv(output_csv, index=False)
+        return len(df)
+
+    def __len__(self):
+        with closing(self._connect()) as db:
+            return db.execute('SELECT COUNT(*) FROM molecules').fetchone()[0]
+
+
+def add_store_arguments(parser):
+    """Add the command line options that choose the property store to an argparse parser."""
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='SQLite property store the results are upserted into')
+    parser.add_argument('--no-store', action='store_true', help='do not write the property store')
+
+
+def store_from_args(args):
+    """Open the store chosen with the options of add_store_arguments(), None with --no-store."""
+    return None if args.no_store else PropertyStore(args.store)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the property store and export the result to CSV")
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='SQLite property store')
+    parser.add_argument('--where', default=None,
+                        help="SQL condition, e.g. \"rotor_shape = 'prolate' AND dipole >= 0.5\"")
+    parser.add_argument('--columns', nargs='+', default=None, help='columns to export (default: all)')
+    parser.add_argument('--export', default=None, help='CSV file to write, prints the molecules otherwise')
+    args = parser.parse_args()
+
+    store = PropertyStore(args.store)
+    if args.export:
+        count = store.export_csv(args.export, args.where, columns=args.columns)
+        print(f"Exported {count} molecules to {args.export}")
+    else:
+        print(store.query(args.where, columns=args.columns).to_string(index=False))
@@ -1,10 +1,25 @@
+import argparse
 import pandas as pd  
 
-input_path = "molecule_filter_TOC/filter1_properties_no_symmetry.csv" # path where the csv is stored
-df = pd.read_csv(input_path)  # load the csv as a dataframe
 
-df_cleaned = df.drop_duplicates(subset='Formula', keep='first')
+def remove_doubled_formulas(input_path, output_path):
+    """
+    Keeps only the first row of every formula.
 
-output_path = "molecule_filter_TOC/filter1_properties_no_symmetry_no_duplicates.csv"  # Replace with the desired path for the cleaned CSV file
-df_cleaned.to_csv(output_path, index=False, encoding="utf-8-sig")  # `index=False` prevents pandas from writing row numbers to the CSV
+    Args:
+        input_path: CSV file with a Formula column
+        output_path: CSV file the cleaned rows are saved to
+    """
+    df = pd.read_csv(input_path)  # load the csv as a dataframe
 
+    df_cleaned = df.drop_duplicates(subset='Formula', keep='first')
+
+    df_cleaned.to_csv(output_path, index=False, encoding="utf-8-sig")  # `index=False` prevents pandas from writing row numbers to the CSV
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep one row per chemical formula")
+    parser.add_argument('input_path', nargs='?', default="molecule_filter_TOC/filter1_properties_no_symmetry.csv")  # path where the csv is stored
+    parser.add_argument('output_path', nargs='?', default="molecule_filter_TOC/filter1_properties_no_symmetry_no_duplicates.csv")  # Replace with the desired path for the cleaned CSV file
+    args = parser.parse_args()
+    remove_doubled_formulas(args.input_path, args.output_path)
@@ -0,0 +1,319 @@
+# Counters, timers and latency histograms of a scraping run: how much time goes to the warm-up GET, the
+# formula search, the selection, the data pages, parsing and sleeping, exported as a JSON summary and as
+# a Prometheus text file (e.g. for the textfile collector of a local node exporter)
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'cccbdb_'
+
+# upper bounds in seconds of the histogram buckets, from a cached page to a slow retry
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> (Prometheus type, help text) of the metrics the client and the fetchers record
+METRICS = {
+    'requests_total': ('counter', 'Requests sent to CCCBDB by phase (warmup, search, select, fetch) and HTTP status'),
+    'request_errors_total': ('counter', 'Requests that raised an exception, by phase and exception type'),
+    'response_bytes_total': ('counter', 'Bytes of the responses received from CCCBDB by phase'),
+    'request_seconds': ('histogram', 'Latency of the requests sent to CCCBDB by phase'),
+    'cache_requests_total': ('counter', 'Requests looked up in the response cache, by result (hit, miss)'),
+    'cache_discards_total': ('counter', 'Cached pages dropped because a lookup found them transient'),
+    'rate_limit_wait_seconds': ('histogram', 'Time a request waited for a token of the rate limiter'),
+    'parse_seconds': ('histogram', 'Time spent parsing the pages, by page (search, selection, rotational, dipole, quadrupole)'),
+    'sleep_seconds': ('histogram', 'Time spent sleeping, by reason (retry backoff, delay between molecules)'),
+    'retries_total': ('counter', 'Retries of a molecule lookup, by failure category'),
+    'misses_total': ('counter', 'Property lookups that gave up without a value, by property and failure category'),
+    'stored_values_total': ('counter', 'Property lookups answered without a request, by source (grid store, negative cache)'),
+    'molecules_total': ('counter', 'Molecules looked up, by result (found when every requested property has a value)'),
+    'molecule_seconds': ('histogram', 'Time to look up all requested properties of one molecule, retries included'),
+    'queue_depth': ('gauge', 'Items waiting in a queue between two stages of the staged lookups, by queue'),
+    'queue_put_wait_seconds': ('histogram', 'Time a stage of the staged lookups was blocked on a full queue, by queue'),
+    'concurrency_limit': ('gauge', 'Requests the adaptive limiter lets in flight at once'),
+    'limit_wait_seconds': ('histogram', 'Time a request waited for the adaptive limiter'),
+    'limit_changes_total': ('counter', 'Changes of the adaptive limit, by reason (p95 window, overload, garbage, circuit)'),
+    'circuit_opens_total': ('counter', 'Times the circuit breaker paused every request after repeated overload failures'),
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram with the count, sum and largest observation."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate of the q quantile, interpolated linearly within its bucket as Prometheus does."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+def _labels(labels):
+    # labels as a sorted tuple, so they can be a dictionary key
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Thread-safe counters and histograms of a scraping run, every value with optional labels.
+
+    Args:
+        buckets: Upper bounds of the histogram buckets in seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        self._started = time.monotonic()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._exporter = None
+
+    def inc(self, name, amount=1, **labels):
+        """Add amount to a counter."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set a gauge to its current value."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """Record a value (usually seconds) in a histogram."""
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Record the seconds spent in the with block in a histogram, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name, **labels):
+        """Value of a counter, the sum over every label set when no labels are given."""
+        with self._lock:
+            if labels:
+                return self._counters.get((name, _labels(labels)), 0)
+            return sum(value for (counter, _), value in self._counters.items() if counter == name)
+
+    def histogram_total(self, name, by=None):
+        """
+        (count, sum) of a histogram over all its label sets, or a dictionary from the values of
+        the label by to (count, sum).
+        """
+        totals = {}
+        with self._lock:
+            for (histogram_name, labels), histogram in self._histograms.items():
+                if histogram_name != name:
+                    continue
+                group = dict(labels).get(by) if by else None
+                count, total = totals.get(group, (0, 0.0))
+                totals[group] = (count + histogram.count, total + histogram.sum)
+        return totals if by else totals.get(None, (0, 0.0))
+
+    def elapsed(self):
+        return time.monotonic() - self._started
+
+    def molecules_per_second(self):
+        elapsed = self.elapsed()
+        return self.counter('molecules_total') / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        """Every counter and histogram (count, sum, mean, p50, p95, p99, max) as a JSON-ready dictionary."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, histogram.summary()) for key, histogram in self._histograms.items())
+        result = {
+            'started': self.started,
+            'elapsed_seconds': self.elapsed(),
+            'molecules_per_second': self.molecules_per_second(),
+            'counters': {},
+            'gauges': {},
+            'histograms': {},
+        }
+        for (name, labels), value in counters:
+            result['counters'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), value in gauges:
+            result['gauges'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), values in histograms:
+            result['histograms'].setdefault(name, []).append({'labels': dict(labels), **values})
+        return result
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, histogram.buckets, list(histogram.counts), histogram.count, histogram.sum)
+                                for key, histogram in self._histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            help_text = METRICS.get(name, (kind, name.replace('_', ' ')))[1]
+            lines.append(f'# HELP {PREFIX}{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}{name} {kind}')
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append(f'{PREFIX}{name}{_label_text(labels)} {_number(value)}')
+        for (name, labels), value in gauges:
+            describe(name, 'gauge')
+            lines.append(f'{PREFIX}{name}{_label_text(labels)} {_number(value)}')
+        for (name, labels), buckets, counts, count, total in histograms:
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + [math.inf], counts):
+                cumulative += bucket_count
+                lines.append(f'{PREFIX}{name}_bucket{_label_text(labels, [("le", _number(float(bound)))])} {cumulative}')
+            lines.append(f'{PREFIX}{name}_sum{_label_text(labels)} {_number(total)}')
+            lines.append(f'{PREFIX}{name}_count{_label_text(labels)} {count}')
+        for name, help_text, value in (
+                ('run_seconds', 'Seconds since the start of the run', self.elapsed()),
+                ('molecules_per_second', 'Molecules looked up per second since the start of the run', self.molecules_per_second())):
+            lines.append(f'# HELP {PREFIX}{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}{name} gauge')
+            lines.append(f'{PREFIX}{name} {_number(float(value))}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path=None, prometheus_path=None):
+        """
+        Write the JSON summary and / or the Prometheus text file. The files are replaced
+        atomically, so a collector never reads half a file.
+        """
+        for path, text in ((json_path, lambda: json.dumps(self.summary(), indent=2)),
+                           (prometheus_path, self.prometheus)):
+            if not path:
+                continue
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text())
+            os.replace(tmp_path, path)
+
+    def start_export(self, json_path=None, prometheus_path=None, interval=15):
+        """Write the files every interval seconds from a background thread until stop_export()."""
+        if not (json_path or prometheus_path) or self._exporter is not None:
+            return
+        stop = threading.Event()
+
+        def export():
+            while not stop.wait(interval):
+                self.write(json_path, prometheus_path)
+
+        thread = threading.Thread(target=export, daemon=True)
+        thread.start()
+        self._exporter = stop
+
+    def stop_export(self):
+        if self._exporter is not None:
+            self._exporter.set()
+            self._exporter = None
+
+    def phase_summary(self):
+        """One line with the requests, their time and the parse and sleep time by phase."""
+        parts = []
+        for phase, (count, total) in sorted(self.histogram_total('request_seconds', by='phase').items()):
+            parts.append(f"{phase} {count} x {total / count:.3f} s" if count else phase)
+        parse_count, parse_total = self.histogram_total('parse_seconds')
+        if parse_count:
+            parts.append(f"parse {parse_count} pages {parse_total:.1f} s")
+        for reason, (count, total) in sorted(self.histogram_total('sleep_seconds', by='reason').items()):
+            parts.append(f"{reason} sleep {total:.1f} s")
+        return ", ".join(parts)
+
+
+def add_metrics_arguments(parser):
+    """Add the --metrics-json, --metrics-prom and --metrics-interval options to an argparse parser."""
+    parser.add_argument('--metrics-json', default=None, metavar='PATH',
+                        help='write the request, parse and sleep timers and counters of the run to this JSON file')
+    parser.add_argument('--metrics-prom', default=None, metavar='PATH',
+                        help='write them in the Prometheus text format, e.g. to the textfile directory of node_exporter (*.prom)')
+    parser.add_argument('--metrics-interval', type=float, default=15,
+                        help='seconds between two updates of the metrics files during the run (default: 15)')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the summary of a metrics file written with --metrics-json")
+    parser.add_argument('json_file', help='file written with --metrics-json')
+    args = parser.parse_args()
+    with open(args.json_file, 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+    print(f"Run of {summary['elapsed_seconds']:.1f} s, {summary['molecules_per_second']:.2f} molecules/sec")
+    for name, values in summary['counters'].items():
+        for value in values:
+            print(f"{name}{_label_text(_labels(value['labels']))} {value['value']}")
+    for name, values in summary.get('gauges', {}).items():
+        for value in values:
+            print(f"{name}{_label_text(_labels(value['labels']))} {value['value']}")
+    for name, values in summary['histograms'].items():
+        for value in values:
+            print(f"{name}{_label_text(_labels(value['labels']))} count={value['count']} sum={value['sum']:.3f} "
+                  f"p50={value['p50']:.3f} p95={value['p95']:.3f} max={value['max']:.3f}")
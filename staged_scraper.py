@@ -0,0 +1,414 @@
+# Looks up CCCBDB properties in stages connected by bounded queues, so the network waits and the HTML
+# parsing of different molecules overlap:
+#
+#   fetch threads --raw pages--> dispatcher --> parse processes --parsing--> collector --parsed--> writer
+#
+# The fetch threads only do the requests (and read a selection page, which decides the next request),
+# a process pool parses the data pages outside of the GIL and a single writer thread turns the parsed
+# values into records, stores them and schedules the retries. When parsing falls behind, the raw pages
+# queue fills up and the fetch threads wait, so the memory held by pages stays bounded.
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cccbdb_client import SEARCH_PAGE, SELECT_PAGE
+from cccbdb_extract import get_extractor
+from cccbdb_failures import NOT_CACHED, NOT_FOUND, TRANSIENT, Failure, classify_exception, status_failure
+from cccbdb_properties import (PROPERTY_PAGES, finish_record, indexed_option, method_key, new_record, parse_property,
+                               select_option, select_value, stored_answers)
+from checkpoint import molecule_key
+from http_cache import CacheMiss
+from tracing import span
+
+DEFAULT_QUEUE_SIZE = 64
+# queues between the stages, in pipeline order
+QUEUES = ('raw', 'parsing', 'parsed')
+UNRECOGNIZED_PAGE = Failure(TRANSIENT, "Landed on unrecognized page")
+STALE_INDEX = Failure(TRANSIENT, "Indexed option does not lead to a data page")
+
+
+def download_pages(client, formula, name, properties):
+    """
+    Search a formula, select the molecule on a selection page and download the data page of
+    every property, without parsing them.
+
+    The page the search lands on is kept as the page of the first property.
+
+    A molecule in the which index of the client is selected with its 'which' id without a search.
+
+    Returns:
+        Dictionary with formula, name, cccbdb_name, which, landing (the property whose data page
+        the search landed on), indexed (True when the 'which' id came from the index),
+        pages (property -> page text), cache_keys (property -> cache key of its page, to discard it)
+        and failures (property -> Failure)
+    """
+    item = {'formula': formula, 'name': name, 'cccbdb_name': None, 'which': None,
+            'landing': properties[0], 'indexed': False, 'pages': {}, 'cache_keys': {},
+            'failures': {}}
+    indexed = indexed_option(client, formula, name)
+
+    def fail(failure, props=properties):
+        item['failures'].update((prop, failure) for prop in props if prop not in item['pages'])
+        return item
+
+    try:
+        with client.session(PROPERTY_PAGES[properties[0]][0]) as session:
+            if indexed is not None:
+                item.update(cccbdb_name=indexed['cccbdb_name'], which=indexed['which'], indexed=True)
+                response = client.post(session, SELECT_PAGE, {'which': indexed['which']})
+            else:
+                response = client.post(session, SEARCH_PAGE, {'formula': formula, 'submit1': 'Submit'})
+            failure = status_failure(response)
+            if failure:
+                return fail(failure)
+            text = response.text
+            if "No entries found" in text:
+                return fail(Failure(NOT_FOUND, f"No entries found for {formula}"))
+
+            # only a page with the selection form can be a selection page, the data pages are left to the parse stage
+            if indexed is None and SELECT_PAGE in text:
+                extractor = client.extractor
+                with client.metrics.timer('parse_seconds', page='search'), span('parse', page='search'):
+                    options = extractor.selection_options(extractor.document(text))
+                if options is not None:
+                    if not options:
+                        return fail(Failure(NOT_FOUND, "No ground/minimum options found"))
+                    selected_option = select_option(options, name)
+                    item['cccbdb_name'], item['which'] = selected_option['name'], selected_option['value']
+                    if client.which_index is not None:
+                        client.which_index.put(formula, name, selected_option, options)
+                    response = client.post(session, SELECT_PAGE, {'which': selected_option['value']}, referer=response.url)
+                    failure = status_failure(response)
+                    if failure:
+                        return fail(failure)
+                    text = response.text
+            item['pages'][properties[0]] = text
+            item['cache_keys'][properties[0]] = response.cache_key
+
+            for prop in properties[1:]:
+                response = client.get(session, PROPERTY_PAGES[prop][1])
+                client.mark_cold(session)
+                failure = status_failure(response)
+                if failure:
+                    item['failures'][prop] = failure
+                else:
+                    item['pages'][prop] = response.text
+                    item['cache_keys'][prop] = response.cache_key
+    except CacheMiss as e:
+        return fail(Failure(NOT_CACHED, str(e)))
+    except Exception as e:
+        return fail(classify_exception(e))
+    return item
+
+
+_extractors = {}
+
+
+def parse_pages(extractor_name, item):
+    """
+    Parse the pages of a download_pages() item, in a worker process of the parse stage.
+
+    Returns:
+        The item without its pages, with parsed (property -> (value, failure) as returned by
+        parse_property()) and parse_seconds (property -> seconds spent parsing its page)
+    """
+    extractor = _extractors.get(extractor_name)
+    if extractor is None:
+        extractor = _extractors[extractor_name] = get_extractor(extractor_name)
+    parsed, seconds = {}, {}
+    for prop, text in item['pages'].items():
+        start = time.perf_counter()
+        document = extractor.document(text)
+        if prop == item['landing'] and item['indexed'] and not extractor.has_data_table(document):
+            parsed[prop] = (None, STALE_INDEX)
+        elif prop == item['landing'] and item['which'] is None and not extractor.has_data_table(document):
+            # an overloaded server answers with pages we do not recognize, so this is worth a retry
+            parsed[prop] = (None, UNRECOGNIZED_PAGE)
+        else:
+            parsed[prop] = parse_property(extractor, prop, document)
+        seconds[prop] = time.perf_counter() - start
+    return dict(item, pages=None, parsed=parsed, parse_seconds=seconds)
+
+
+class _QueueStats:
+    # depth samples of one queue
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.samples = 0
+        self.total = 0
+        self.full = 0
+        self.empty = 0
+
+    def sample(self, depth):
+        self.samples += 1
+        self.total += depth
+        self.full += depth >= self.capacity
+        self.empty += depth == 0
+
+    def average(self):
+        return self.total / self.samples if self.samples else 0.0
+
+    def share(self, count):
+        return count / self.samples if self.samples else 0.0
+
+
+class StagedLookup:
+    """
+    Look up the properties of many molecules with the staged pipeline.
+
+    Args:
+        client: CCCBDBClient, every fetch thread leases its own session
+        properties: Properties to look up, see cccbdb_properties.PROPERTY_PAGES
+        workers: Number of fetch threads
+        parse_processes: Number of parse processes, 0 to parse in one thread of this process
+        queue_size: Capacity of the raw pages and parsed records queues
+        max_retries: Attempts per molecule, defaults to the one of the retry policy of the client
+        method, basis: Method and basis set of the dipole and quadrupole values, default to those of the client
+        sink: Function called as sink(record) by the writer for every finished molecule, or None
+        report_interval: Seconds between two printed reports of the queue depths
+    """
+
+    def __init__(self, client, properties, workers=4, parse_processes=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_retries=None, method=None, basis=None, sink=None, report_interval=10):
+        self.client = client
+        self.properties = list(properties)
+        self.workers = workers
+        self.parse_processes = os.cpu_count() if parse_processes is None else parse_processes
+        self.max_retries = max_retries if max_retries is not None else client.retry_policy.max_retries
+        self.method = method or client.method
+        self.basis = basis if basis is not None else client.basis
+        self.methods = {prop: method_key(prop, self.method, self.basis) for prop in self.properties}
+        self.sink = sink
+        self.report_interval = report_interval
+
+        self.jobs = queue.Queue()
+        self.raw = queue.Queue(maxsize=queue_size)
+        # at most two pages per parse process are submitted, the others wait in the raw queue
+        self.parsing = queue.Queue(maxsize=2 * max(self.parse_processes, 1))
+        self.parsed = queue.Queue(maxsize=queue_size)
+        self.stats = {name: _QueueStats(getattr(self, name).maxsize) for name in QUEUES}
+        self.lookups = {}
+        self.remaining = 0
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    def depths(self):
+        """Number of items in every queue between two stages, and the molecules still to look up."""
+        depths = {name: getattr(self, name).qsize() for name in QUEUES}
+        depths['fetch'] = self.jobs.qsize()
+        return depths
+
+    def _put(self, target, name, item):
+        # a full queue blocks the stage before it, the time it waits shows which stage is too slow
+        start = time.perf_counter()
+        target.put(item)
+        waited = time.perf_counter() - start
+        if waited > 0.001:
+            self.client.metrics.observe('queue_put_wait_seconds', waited, queue=name)
+
+    def _fetch(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            key, attempt, props = job
+            lookup = self.lookups[key]
+            formula, name = lookup['record']['formula'], lookup['record']['name']
+            print(f"Attempt {attempt}/{self.max_retries} for {formula}" + (f" with name: {name}" if name else ""))
+            with span('attempt', formula=formula, attempt=attempt):
+                item = download_pages(self.client, formula, name, props)
+            item.update(key=key, attempt=attempt)
+            self._put(self.raw, 'raw', item)
+
+    def _dispatch(self, pool):
+        extractor_name = self.client.extractor.name
+        while True:
+            item = self.raw.get()
+            if item is None:
+                self.parsing.put(None)
+                return
+            future = pool.submit(parse_pages, extractor_name, item) if item['pages'] else None
+            self._put(self.parsing, 'parsing', (item, future))
+
+    def _collect(self):
+        while True:
+            entry = self.parsing.get()
+            if entry is None:
+                return
+            item, future = entry
+            if future is None:
+                item = dict(item, parsed={}, parse_seconds={})
+            else:
+                try:
+                    item = future.result()
+                except Exception as e:
+                    failure = classify_exception(e)
+                    item = dict(item, parsed={prop: (None, failure) for prop in item['pages']}, parse_seconds={})
+            self._put(self.parsed, 'parsed', item)
+
+    def _write(self):
+        policy = self.client.retry_policy
+        metrics = self.client.metrics
+        while self.remaining:
+            item = self.parsed.get()
+            lookup = self.lookups[item['key']]
+            lookup['pending'] -= 1
+            record, failures = lookup['record'], lookup['failures']
+            for prop, seconds in item['parse_seconds'].items():
+                metrics.observe('parse_seconds', seconds, page=prop)
+            if item['parsed'].get(item['landing'], (None, None))[1] == STALE_INDEX:
+                # every page of the item belongs to whatever the stale id selected, the formula is searched again
+                print(f"Indexed option {item['which']} of {record['formula']} does not lead to a data page, searching again")
+                self.client.discard(item['cache_keys'].get(item['landing']))
+                self.client.which_index.forget(record['formula'], record['name'])
+                lookup['pending'] += 1
+                self.jobs.put((item['key'], item['attempt'], list(item['parsed']) + list(item['failures'])))
+                continue
+            if item['which'] is not None:
+                record['cccbdb_name'], record['which'] = item['cccbdb_name'], item['which']
+
+            missing = []
+            for prop in self.properties:
+                if prop not in item['failures'] and prop not in item['parsed']:
+                    continue
+                if prop in item['parsed']:
+                    if prop == item['landing'] and item['parsed'][prop][1] == UNRECOGNIZED_PAGE:
+                        self.client.report_overload()
+                    if item['parsed'][prop][1] is not None and item['parsed'][prop][1].category == TRANSIENT:
+                        # a retry has to download the page again, not read it back from the cache
+                        self.client.discard(item['cache_keys'].get(prop))
+                    value, failure = select_value(self.client, record, prop, *item['parsed'][prop], self.method, self.basis)
+                else:
+                    value, failure = None, item['failures'][prop]
+                if value is None:
+                    print(f"{failure.message} for {prop} of {record['formula']} on attempt {item['attempt']}")
+                    failures[prop] = failure
+                    missing.append(prop)
+                else:
+                    record[prop] = value
+                    failures.pop(prop, None)
+
+            # permanent misses are not retried, only the properties that failed transiently
+            retry = [prop for prop in missing if policy.should_retry(failures[prop])]
+            if retry and item['attempt'] < self.max_retries and policy.take_retry():
+                for category in sorted({failures[prop].category for prop in retry}):
+                    metrics.inc('retries_total', category=category)
+                delay = policy.delay(item['attempt'])
+                # the fetch threads are not blocked while the molecule waits for its retry
+                lookup['pending'] += 1
+                timer = threading.Timer(delay, self.jobs.put, args=((item['key'], item['attempt'] + 1, retry),))
+                timer.daemon = True
+                timer.start()
+                metrics.observe('sleep_seconds', delay, reason='retry')
+            if not lookup['pending']:
+                self._finish(lookup)
+        self.finished.set()
+
+    def _finish(self, lookup):
+        record = finish_record(self.client, lookup['record'], self.properties, lookup['failures'], self.methods,
+                               lookup['known_misses'])
+        metrics = self.client.metrics
+        metrics.observe('molecule_seconds', time.perf_counter() - lookup['started'])
+        found = all(record[prop] is not None for prop in self.properties)
+        metrics.inc('molecules_total', result='found' if found else 'missing')
+        if self.sink is not None:
+            self.sink(record)
+        self.remaining -= 1
+
+    def _monitor(self, sample_interval=0.2):
+        last_report = time.monotonic()
+        while not self.finished.wait(sample_interval):
+            depths = self.depths()
+            for name, depth in depths.items():
+                self.client.metrics.set('queue_depth', depth, queue=name)
+                if name in self.stats:
+                    self.stats[name].sample(depth)
+            if time.monotonic() - last_report >= self.report_interval:
+                last_report = time.monotonic()
+                print("Queues: " + ", ".join(f"{name} {depths[name]}/{self.stats[name].capacity}" for name in QUEUES)
+                      + f", {depths['fetch']} molecules waiting to be fetched, {self.remaining} to finish")
+        # the gauges end with the (empty) queues of the finished run
+        for name, depth in self.depths().items():
+            self.client.metrics.set('queue_depth', depth, queue=name)
+
+    def report(self):
+        """Print the average depth of every queue and the stage that limits the throughput."""
+        parts = []
+        for name in QUEUES:
+            stats = self.stats[name]
+            parts.append(f"{name} {stats.average():.1f}/{stats.capacity} (full {stats.share(stats.full):.0%})")
+        raw, parsing, parsed = (self.stats[name] for name in QUEUES)
+        # a stage limits the throughput when the queue in front of it is mostly full
+        if parsed.share(parsed.full) > 0.5:
+            limit = "writing the records"
+        elif raw.average() > raw.capacity / 2 or parsing.share(parsing.full) > 0.5:
+            limit = "parsing, more --parse-processes would help"
+        else:
+            limit = "fetching, more --workers (or a higher --max-rate) would help"
+        if raw.samples:
+            print(f"Stage queues (average depth / capacity): {', '.join(parts)} -> throughput limited by {limit}")
+
+    def run(self, molecules):
+        """
+        Look up every molecule.
+
+        Args:
+            molecules: List of (formula, name) tuples
+
+        Returns:
+            List of the records (see cccbdb_properties.fetch_molecule_properties), one per molecule
+            in the order of the molecules; rows with the same molecule_key() share a record
+        """
+        molecules = list(molecules)
+        keys = [molecule_key(formula, name) for formula, name in molecules]
+        for key, (formula, name) in zip(keys, molecules):
+            if key in self.lookups:
+                continue
+            record = new_record(formula, name, self.properties)
+            missing, failures = list(self.properties), {}
+            known_misses = stored_answers(self.client, record, missing, failures, self.methods, self.method, self.basis)
+            self.lookups[key] = {'record': record, 'failures': failures, 'known_misses': known_misses,
+                                 'started': time.perf_counter(), 'pending': 0}
+            self.remaining += 1
+            if missing:
+                self.lookups[key]['pending'] = 1
+                self.jobs.put((key, 1, missing))
+            else:
+                self._finish(self.lookups[key])
+        print(f"{len(molecules)} rows, {len(self.lookups)} distinct molecules, {self.jobs.qsize()} to look up with "
+              f"{self.workers} fetch threads and {self.parse_processes or 'no'} parse processes")
+
+        # the pool is started before the threads; spawned processes do not inherit their locks
+        if self.parse_processes:
+            pool = ProcessPoolExecutor(self.parse_processes, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            pool = ThreadPoolExecutor(1)
+        with pool:
+            fetchers = [threading.Thread(target=self._fetch, name=f'fetch-{i}', daemon=True) for i in range(self.workers)]
+            stages = [threading.Thread(target=self._dispatch, args=(pool,), name='dispatch', daemon=True),
+                      threading.Thread(target=self._collect, name='collect', daemon=True)]
+            writer = threading.Thread(target=self._write, name='write', daemon=True)
+            monitor = threading.Thread(target=self._monitor, name='monitor', daemon=True)
+            for thread in fetchers + stages + [writer, monitor]:
+                thread.start()
+
+            writer.join()
+            self.finished.set()
+            for _ in fetchers:
+                self.jobs.put(None)
+            for thread in fetchers:
+                thread.join()
+            self.raw.put(None)
+            for thread in stages + [monitor]:
+                thread.join()
+        self.report()
+        return [self.lookups[key]['record'] for key in keys]
+
+
+def fetch_records_staged(molecules, properties, client, workers=4, parse_processes=None, queue_size=DEFAULT_QUEUE_SIZE,
+                         sink=None):
+    """Look up the properties of every (formula, name) with a StagedLookup, see StagedLookup.run()."""
+    return StagedLookup(client, properties, workers, parse_processes, queue_size, sink=sink).run(molecules)
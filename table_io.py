@@ -0,0 +1,276 @@
+# Reads and writes the tables passed between the pipeline stages. Arrow IPC and Parquet files keep the
+# column types (a rotational constant stays a float, a point group a string) and are memory-mapped when
+# read; CSV is still read and written for the first inputs and as an export.
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, the stages fall back to CSV without it
+    pa = None
+
+# format -> file extension
+FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+# file extension -> format, .feather files are Arrow IPC files too
+EXTENSIONS = {extension: fmt for fmt, extension in FORMATS.items()}
+EXTENSIONS['.feather'] = 'arrow'
+
+FLOAT = 'float64'
+STRING = 'string'
+
+# fixed type of the columns the stages add, whatever the values of a run look like
+SCHEMA = {
+    'Point Group': STRING,
+    'Rotational Constant 1': FLOAT,
+    'Rotational Constant 2': FLOAT,
+    'Rotational Constant 3': FLOAT,
+    'Rotor Shape': STRING,
+    'Ray Kappa': FLOAT,
+    'Dipole Moment': FLOAT,
+    'Quadrupole Moment': FLOAT,
+    'Stark 1': FLOAT,
+    'Stark 2': FLOAT,
+    'Stark 3': FLOAT,
+}
+
+
+def table_format(path):
+    """Format of a table file ('csv', 'parquet' or 'arrow') from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(f"Unsupported file extension: {extension}, use one of {', '.join(EXTENSIONS)}")
+    return EXTENSIONS[extension]
+
+
+def default_format():
+    """Arrow when pyarrow is installed, CSV otherwise."""
+    return 'arrow' if pa is not None else 'csv'
+
+
+def with_format(path, fmt):
+    """Replace the table extension of path with the one of fmt, e.g. 5_fraction.csv -> 5_fraction.arrow."""
+    root, extension = os.path.splitext(path)
+    if extension.lower() not in EXTENSIONS:
+        root = path
+    return root + FORMATS[fmt]
+
+
+def find_table(path):
+    """
+    Return path if it exists, otherwise the same table in another format that exists, so a stage
+    can read the output a previous stage wrote as CSV (or the other way around).
+    """
+    if os.path.exists(path):
+        return path
+    for fmt in FORMATS:
+        candidate = with_format(path, fmt)
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+
+def _require_pyarrow(path):
+    if pa is None:
+        raise ImportError(f"Reading and writing {path} needs pyarrow: pip install pyarrow")
+
+
+def infer_types(df):
+    """
+    Turn the text columns that only hold numbers (and empty cells) into numeric columns, as
+    pandas.read_csv does. Used for tables built from rows of strings read with the csv module.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if not (df[column].dtype == object or pd.api.types.is_string_dtype(df[column].dtype)):
+            continue
+        values = df[column].replace('', np.nan)
+        numbers = pd.to_numeric(values, errors='coerce')
+        if numbers.notna().sum() == values.notna().sum():
+            df[column] = numbers
+        else:
+            df[column] = values
+    return df
+
+
+def conform(df):
+    """
+    Return df with the column types of a columnar file: the SCHEMA columns get their fixed type,
+    object columns of numbers become numeric and the other object columns text (missing values
+    stay missing), so every column has a single type.
+    """
+    df = df.copy()
+    for position, column in enumerate(df.columns):
+        values = df.iloc[:, position]
+        if SCHEMA.get(column) == FLOAT:
+            df.isetitem(position, pd.to_numeric(values, errors='coerce').astype(float))
+        elif SCHEMA.get(column) == STRING or values.dtype == object:
+            kind = pd.api.types.infer_dtype(values, skipna=True)
+            if SCHEMA.get(column) != STRING and kind in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+                df.isetitem(position, pd.to_numeric(values, errors='coerce'))
+            else:
+                df.isetitem(position, values.map(lambda value: None if pd.isna(value) else str(value)).astype(object))
+    return df
+
+
+def _arrow_table(df, schema=None):
+    df = conform(df)
+    if schema is not None:
+        return pa.Table.from_pandas(df, preserve_index=False).cast(schema)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # columns without any value get the type of a text column, not Arrow's null type
+    fields = [pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field for field in table.schema]
+    return table.cast(pa.schema(fields))
+
+
+def _apply_schema(df):
+    # a column of a fixed type that was written without any value still reads back with that type
+    for column in df.columns.intersection(list(SCHEMA)):
+        if SCHEMA[column] == FLOAT and df[column].dtype != float:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(float)
+    return df
+
+
+def read_table(path, **csv_options):
+    """
+    Read a CSV, Parquet or Arrow IPC file into a DataFrame, by its extension. The columnar files
+    are memory-mapped, so only the pages that are used are read from disk.
+
+    Args:
+        path: File to read
+        csv_options: Keyword arguments passed on to pandas.read_csv for CSV files
+    """
+    fmt = table_format(path)
+    if fmt == 'csv':
+        return pd.read_csv(path, **csv_options)
+    _require_pyarrow(path)
+    if fmt == 'parquet':
+        table = pq.read_table(path, memory_map=True)
+    else:
+        table = feather.read_table(path, memory_map=True)
+    return _apply_schema(table.to_pandas())
+
+
+def iter_table(path, chunksize=None, **csv_options):
+    """
+    Read a table chunksize rows at a time, the whole table at once with chunksize None.
+
+    Yields:
+        DataFrames of at most chunksize rows
+    """
+    if chunksize is None:
+        yield read_table(path, **csv_options)
+        return
+    fmt = table_format(path)
+    if fmt == 'csv':
+        yield from pd.read_csv(path, chunksize=chunksize, **csv_options)
+        return
+    _require_pyarrow(path)
+    if fmt == 'parquet':
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunksize):
+            yield _apply_schema(batch.to_pandas())
+    else:
+        # the memory-mapped table is sliced without copying, only each slice is converted
+        table = feather.read_table(path, memory_map=True)
+        for start in range(0, table.num_rows, chunksize):
+            yield _apply_schema(table.slice(start, chunksize).to_pandas())
+
+
+def write_table(df, path, **csv_options):
+    """
+    Write a DataFrame to a CSV, Parquet or Arrow IPC file, by the extension of path. The
+    columnar files get the fixed types of SCHEMA; the Arrow file is not compressed so that
+    it can be memory-mapped.
+
+    Args:
+        df: DataFrame to write, without its index
+        path: File to write
+        csv_options: Keyword arguments passed on to DataFrame.to_csv for CSV files
+    """
+    fmt = table_format(path)
+    if fmt == 'csv':
+        df.to_csv(path, index=False, **csv_options)
+        return
+    _require_pyarrow(path)
+    table = _arrow_table(df)
+    if fmt == 'parquet':
+        pq.write_table(table, path)
+    else:
+        feather.write_feather(table, path, compression='uncompressed')
+
+
+class TableWriter:
+    """
+    Writes a table chunk by chunk, e.g. while streaming a large file with iter_table().
+    All chunks must have the columns of the first one.
+
+    Args:
+        path: File to write, its extension chooses the format
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = table_format(path)
+        if self.format != 'csv':
+            _require_pyarrow(path)
+        self._writer = None
+        self._schema = None
+        self._chunks = 0
+
+    def write(self, df):
+        if self.format == 'csv':
+            # the first chunk creates the file with the header, the others are appended
+            df.to_csv(self.path, index=False, mode='w' if self._chunks == 0 else 'a', header=self._chunks == 0)
+        else:
+            # the later chunks are cast to the types of the first one
+            table = _arrow_table(df, self._schema)
+            if self._writer is None:
+                self._schema = table.schema
+                if self.format == 'parquet':
+                    self._writer = pq.ParquetWriter(self.path, table.schema)
+                else:
+                    self._writer = pa.ipc.new_file(self.path, table.schema)
+            self._writer.write_table(table)
+        self._chunks += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def add_format_arguments(parser):
+    """Add the command line option that chooses the format of the intermediate tables to an argparse parser."""
+    parser.add_argument('--format', choices=['auto'] + list(FORMATS), default='auto',
+                        help='format of the tables written (and read) between the stages; auto is arrow '
+                             'when pyarrow is installed and csv otherwise')
+
+
+def format_from_args(args):
+    """The table format chosen with the option of add_format_arguments()."""
+    return default_format() if args.format == 'auto' else args.format
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a table between CSV, Parquet and Arrow, e.g. to export an intermediate result as CSV")
+    parser.add_argument('input', help='table to read (.csv, .parquet, .arrow or .feather)')
+    parser.add_argument('output', help='table to write, its extension chooses the format')
+    args = parser.parse_args()
+
+    df = read_table(args.input)
+    write_table(df, args.output)
+    print(f"Wrote {len(df)} rows from {args.input} to {args.output}")
@@ -0,0 +1,121 @@
+# Checks of the adaptive concurrency limit, on its own and against the local CCCBDB simulator
+# (python -m pytest test_adaptive_limit.py)
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from adaptive_limit import AdaptiveLimiter
+from cccbdb_simulator import SimulatorConfig, SimulatorServer, benchmark, synthetic_fixtures, write_input
+
+
+def quiet_limiter(maximum, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return AdaptiveLimiter(maximum, log_interval=0, **kwargs)
+
+
+def run_requests(limiter, count, seconds=0.0, overload=False):
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(count):
+            limiter.acquire()
+            limiter.release(seconds, overload)
+
+
+def run_full(limiter, count):
+    # keeps the limit reached, as busy workers do
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(count):
+            for _ in range(limiter.allowed()):
+                limiter.acquire()
+            for _ in range(limiter.in_flight):
+                limiter.release(0.0)
+
+
+def test_limit_grows_by_one_per_good_window():
+    limiter = quiet_limiter(8, minimum=1, initial=1, window=4)
+    run_full(limiter, 4)
+    assert limiter.allowed() == 2
+    run_full(limiter, 40)
+    limits = [limit for _, limit, _ in limiter.history]
+    assert limits == list(range(1, 9))
+
+
+def test_idle_limit_is_not_raised():
+    limiter = quiet_limiter(8, initial=4, window=5)
+    run_requests(limiter, 20)
+    assert limiter.allowed() == 4
+
+
+def test_slow_window_cuts_the_limit():
+    limiter = quiet_limiter(8, initial=8, window=5, target_p95=0.1)
+    run_requests(limiter, 5, seconds=0.5)
+    assert limiter.allowed() == 4
+
+
+def test_overload_cuts_once_per_p95():
+    limiter = quiet_limiter(16, initial=16, window=100, failure_threshold=10)
+    run_requests(limiter, 3, seconds=0.2, overload=True)
+    # the failures of the requests already in flight do not cut it again
+    assert limiter.allowed() == 8
+    limiter.report_overload()
+    assert limiter.allowed() == 8
+
+
+def test_circuit_opens_and_closes():
+    limiter = quiet_limiter(4, initial=4, failure_threshold=3, open_seconds=0.2)
+    run_requests(limiter, 3, overload=True)
+    assert limiter.opened == 1
+    assert limiter.allowed() == 1
+    start = time.monotonic()
+    run_requests(limiter, 1)
+    # the probe waited for the circuit to half-open, its success closed it
+    assert time.monotonic() - start >= 0.15
+    assert limiter.open_until is None
+
+
+def test_in_flight_never_exceeds_the_limit():
+    limiter = quiet_limiter(3, initial=3, window=1000)
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(20):
+            limiter.acquire()
+            with lock:
+                peak.append(limiter.in_flight)
+            time.sleep(0.001)
+            limiter.release(0.001)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 3
+
+
+def bench(capacity, adaptive):
+    fixtures = synthetic_fixtures(120, seed=1)
+    server = SimulatorServer(fixtures, SimulatorConfig(latency_ms=20, capacity=capacity)).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            input_csv = os.path.join(directory, 'input.csv')
+            write_input(fixtures, input_csv, not_found_ratio=0, seed=1)
+            return benchmark(server, input_csv, workers=12, adaptive=adaptive)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_adaptive_limit_backs_off_an_overloaded_simulator():
+    fixed = bench(capacity=3, adaptive=False)
+    adaptive = bench(capacity=3, adaptive=True)
+    def transient(result):
+        return sum(count for key, count in result['misses'].items() if key.endswith('/transient'))
+
+    assert transient(adaptive) < transient(fixed)
+    assert adaptive['server']['busy'] < fixed['server']['busy']
+    assert adaptive['limiter']['limit'] < 12
+    assert adaptive['metrics']['gauges']
@@ -0,0 +1,89 @@
+# Checks of the journal and of resuming an interrupted run, on its own and against the local CCCBDB simulator
+# (python -m pytest test_checkpoint.py)
+import contextlib
+import io
+import os
+import tempfile
+
+from cccbdb_client import CCCBDBClient
+from cccbdb_failures import RetryPolicy
+from cccbdb_properties import fetch_property
+from cccbdb_simulator import SimulatorConfig, SimulatorServer, synthetic_fixtures
+from checkpoint import Journal
+from concurrent_scraper import fetch_values
+
+
+def quiet_fetch_values(*args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fetch_values(*args, **kwargs)
+
+
+def test_values_are_resumed_from_the_journal():
+    with tempfile.TemporaryDirectory() as directory:
+        journal = Journal(os.path.join(directory, 'run.journal'), 'HF')
+        molecules = [('H2O', 'water'), ('CO', 'carbon monoxide')]
+        quiet_fetch_values(lambda formula, name, client=None: len(formula), molecules, 1, 0, None, journal)
+        fetched = []
+
+        def fetch(formula, name, client=None):
+            fetched.append(formula)
+            return 0
+
+        assert quiet_fetch_values(fetch, molecules, 1, 0, None, journal, resume=True) == [3, 2]
+        assert fetched == []
+        # the values of another method are not taken
+        other = Journal(journal.path, 'B3LYP')
+        assert quiet_fetch_values(fetch, molecules, 1, 0, None, other, resume=True) == [0, 0]
+
+
+def test_give_ups_of_unknown_cause_are_looked_up_again():
+    with tempfile.TemporaryDirectory() as directory:
+        journal = Journal(os.path.join(directory, 'run.journal'))
+        molecules = [('H2O', 'water'), ('CO', 'carbon monoxide'), ('NO', 'nitric oxide')]
+        during_outage = {'H2O': 1.85}
+        values = quiet_fetch_values(lambda formula, name, client=None: during_outage.get(formula), molecules, 1, 0,
+                                    None, journal)
+        assert values == [1.85, None, None]
+        after_outage = {'CO': 0.11, 'NO': 0.16}
+        fetched = []
+
+        def fetch(formula, name, client=None):
+            fetched.append(formula)
+            return after_outage[formula]
+
+        assert quiet_fetch_values(fetch, molecules, 1, 0, None, journal, resume=True) == [1.85, 0.11, 0.16]
+        assert fetched == ['CO', 'NO']
+
+
+def test_transient_give_ups_are_resumed_and_permanent_misses_are_not():
+    fixtures = synthetic_fixtures(3, seed=2, isomer_ratio=0)
+    molecules = [(molecule['formula'], molecule['name']) for molecule in fixtures.molecules]
+    molecules.append(('Xx1', 'unknown molecule'))
+    server = SimulatorServer(fixtures, SimulatorConfig(error_rate=1.0, seed=2)).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            journal = Journal(os.path.join(directory, 'run.journal'), 'rotational')
+
+            def run(resume):
+                client = CCCBDBClient(pool_size=1, base_url=server.url,
+                                      retry_policy=RetryPolicy(max_retries=2, base_delay=0.01, max_delay=0.01))
+                fetch = lambda formula, name, client=None: fetch_property('rotational', formula, name, client=client)
+                return quiet_fetch_values(fetch, molecules, 1, 0, client, journal, resume)
+
+            # every request fails: no molecule is done
+            assert run(resume=False) == [None] * 4
+            assert journal.load() == {}
+
+            # the outage is over, the unknown formula is a permanent miss
+            server.config.error_rate = 0.0
+            values = run(resume=True)
+            assert all(value is not None for value in values[:3]) and values[3] is None
+            assert len(journal.load()) == 4
+
+            # nothing is left to look up
+            searches = server.counts['POST getformx.asp']
+            assert run(resume=True) == values
+            assert server.counts['POST getformx.asp'] == searches
+    finally:
+        server.shutdown()
+        server.server_close()
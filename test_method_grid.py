@@ -0,0 +1,80 @@
+# Checks that the method grid picks the value the scraper read before the grid was kept, within the method row
+# (python -m pytest test_method_grid.py)
+import pytest
+
+from cccbdb_extract import EXTRACTORS, etree
+from cccbdb_failures import MISSING_METHOD, PARSE_FAILURE
+
+HEADER = '<tr><th></th><th>STO-3G</th><th>3-21G</th><th>6-31G*</th></tr>'
+
+PAGES = {
+    'first cell': '<tr><th class="nowrap">HF</th><td class="num bordered"><a>1.25</a></td>'
+                  '<td class="num bordered"><a>1.5</a></td><td class="num bordered"><a>1.75</a></td></tr>',
+    'blank cells first': '<tr><th class="nowrap">HF</th><td></td><td class="num"></td>'
+                         '<td class="num bordered"><a>2.5</a></td></tr>',
+    'value cell without link': '<tr><th class="nowrap">HF</th><td class="num bordered"></td>'
+                               '<td class="num bordered"><a>3.5</a></td><td></td></tr>',
+    'no value cell in the row': '<tr><th class="nowrap">HF</th><td></td><td></td><td></td></tr>'
+                                '<tr><th class="nowrap">B3LYP</th><td></td><td class="num bordered"><a>4.5</a></td><td></td></tr>',
+    'unreadable': '<tr><th class="nowrap">HF</th><td class="num bordered"><a>n/a</a></td>'
+                  '<td class="num bordered"><a>5.5</a></td><td></td></tr>',
+    'no value cell at all': '<tr><th class="nowrap">HF</th><td></td><td></td><td></td></tr>',
+}
+
+EXPECTED = {
+    'first cell': (1.25, None),
+    'blank cells first': (2.5, None),
+    'value cell without link': (None, MISSING_METHOD),
+    'no value cell in the row': (None, MISSING_METHOD),
+    'unreadable': (None, PARSE_FAILURE),
+    'no value cell at all': (None, MISSING_METHOD),
+}
+
+
+def page(rows):
+    return f'<html><body><table id="table2">{HEADER}{rows}</table></body></html>'
+
+
+def old_hf_value(text):
+    # the HF lookup of the scrapers before the grid: the first 'num bordered' cell after the HF th
+    from bs4 import BeautifulSoup
+    table2 = BeautifulSoup(text, 'html.parser').find('table', id='table2')
+    hf_th = table2.find('th', class_='nowrap', string=lambda string: string and 'HF' in string)
+    hf_td = hf_th.find_next('td', class_='num bordered')
+    if not (hf_td and hf_td.a):
+        return None, MISSING_METHOD
+    try:
+        return float(hf_td.a.text.strip()), None
+    except ValueError:
+        return None, PARSE_FAILURE
+
+
+@pytest.mark.parametrize('extractor', [name for name in EXTRACTORS if name != 'lxml' or etree is not None])
+@pytest.mark.parametrize('case', list(PAGES))
+def test_default_basis_reads_the_old_cell(extractor, case):
+    backend = EXTRACTORS[extractor]()
+    grid, failure = backend.method_grid(backend.document(page(PAGES[case])))
+    assert failure is None
+    value, failure = grid.select('HF')
+    assert (value, failure and failure.category) == EXPECTED[case]
+    if case != 'no value cell in the row':
+        # the old lookup went on to the B3LYP row there and took its value as the HF one
+        assert EXPECTED[case] == old_hf_value(page(PAGES[case]))
+
+
+def test_other_methods_do_not_read_the_rows_below():
+    backend = EXTRACTORS['bs4']()
+    rows = ('<tr><th class="nowrap">MP2</th><td></td><td></td><td></td></tr>'
+            '<tr><th class="nowrap">CCSD(T)</th><td class="num bordered"><a>6.5</a></td><td></td><td></td></tr>')
+    grid, _ = backend.method_grid(backend.document(page(rows)))
+    assert grid.select('MP2')[1].category == MISSING_METHOD
+    assert grid.select('CCSD(T)') == (6.5, None)
+
+
+def test_explicit_basis():
+    backend = EXTRACTORS['bs4']()
+    grid, _ = backend.method_grid(backend.document(page(PAGES['value cell without link'])))
+    assert grid.select('HF', '3-21G') == (3.5, None)
+    assert grid.select('HF', 'STO-3G')[1].category == MISSING_METHOD
+    assert grid.select('HF', 'cc-pVTZ')[1].category == MISSING_METHOD
+    assert len(grid) == 1
@@ -0,0 +1,244 @@
+# Opt-in tracing and profiling of a run. Spans (molecule -> attempt -> warmup/search/select/fetch/parse/sleep)
+# are written as a Chrome trace (chrome://tracing, https://ui.perfetto.dev), and a profiler samples the
+# stacks of every thread into a collapsed-stack file for flamegraph.pl or https://speedscope.app.
+# While tracing is off, span() returns a shared do-nothing context manager.
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_tracer = None
+_profiler = None
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class Tracer:
+    """
+    Collects the spans of every thread as complete ('X') events of the Chrome trace format.
+    Spans of a thread nest by their times, so a trace viewer shows one row of nested spans
+    per worker thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.perf_counter_ns()
+        self.events = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, args):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.started) / 1000,  # microseconds
+            'dur': (end - start) / 1000,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': {key: value if isinstance(value, (int, float, bool)) or value is None else str(value)
+                     for key, value in args.items()},
+        }
+        with self._lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    def write(self, path=None):
+        """Write the Chrome trace JSON file."""
+        path = path or self.path
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                    for tid, name in threads.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
+def span(name, /, **args):
+    """
+    Context manager recording a span of the current thread while tracing is on.
+
+    Args:
+        name: Name of the span, e.g. 'molecule', 'attempt', 'search', 'parse' or 'sleep'
+        args: Values shown with the span, e.g. formula='H2O'
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, args)
+
+
+def enabled():
+    return _tracer is not None
+
+
+def start_tracing(path):
+    """Record the spans of every thread until stop_tracing(), which writes them to path."""
+    global _tracer
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def stop_tracing():
+    """Stop recording spans and write the Chrome trace file. Returns its path, or None when tracing was off."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    count = tracer.write()
+    print(f"Trace of {count} spans saved to {tracer.path} (open it in chrome://tracing or https://ui.perfetto.dev)")
+    return tracer.path
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread every interval seconds from a background thread and counts
+    the distinct stacks. The counts are written in the collapsed-stack format, one
+    'outer;...;inner count' line per stack, with the thread name as the outermost frame.
+    """
+
+    def __init__(self, path, interval=0.005):
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f'thread-{ident}'))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"{self.samples} stack samples saved to {self.path} (flamegraph.pl {self.path} > flamegraph.svg, or https://speedscope.app)")
+
+
+class CProfileProfiler:
+    """
+    Deterministic cProfile of the calling thread (the lookups in worker threads are not seen,
+    the sampling profiler sees every thread). Writes the pstats file to path and a collapsed-stack
+    file with the caller -> callee edges of the profile to path + '.folded'.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+        stats = pstats.Stats(self.profile)
+        # cProfile keeps caller -> callee times, not whole stacks: every function is folded under
+        # its callers, which is enough to see where the time goes in a flamegraph
+        with open(self.path + '.folded', 'w', encoding='utf-8') as f:
+            for (filename, line, function), (_, _, inline, _, callers) in stats.stats.items():
+                callee = f"{function} ({os.path.basename(filename)}:{line})"
+                if not callers:
+                    f.write(f"{callee} {int(inline * 1e6)}\n")
+                for (caller_file, caller_line, caller_function), caller_stats in callers.items():
+                    caller = f"{caller_function} ({os.path.basename(caller_file)}:{caller_line})"
+                    f.write(f"{caller};{callee} {int(caller_stats[2] * 1e6)}\n")
+        print(f"Profile saved to {self.path} (python -m pstats {self.path}) and {self.path}.folded")
+        stats.sort_stats('cumulative').print_stats(15)
+
+
+def start_profiling(path, mode='sample', interval=0.005):
+    """
+    Profile the run until stop_profiling().
+
+    Args:
+        path: Output file, collapsed stacks for mode 'sample', pstats for mode 'cprofile'
+        mode: 'sample' (every thread, stacks sampled every interval seconds) or 'cprofile'
+        interval: Seconds between two samples
+    """
+    global _profiler
+    _profiler = SamplingProfiler(path, interval) if mode == 'sample' else CProfileProfiler(path)
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiling():
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+
+
+def add_tracing_arguments(parser):
+    """Add the --trace, --profile, --profile-mode and --profile-interval options to an argparse parser."""
+    parser.add_argument('--trace', default=None, metavar='PATH',
+                        help='write the spans of every molecule, attempt, request, parse and sleep to this Chrome trace JSON file')
+    parser.add_argument('--profile', default=None, metavar='PATH',
+                        help='profile the whole run into this file (collapsed stacks for a flamegraph, or pstats with --profile-mode cprofile)')
+    parser.add_argument('--profile-mode', choices=['sample', 'cprofile'], default='sample',
+                        help='sample the stacks of every thread, or cProfile the main thread (default: sample)')
+    parser.add_argument('--profile-interval', type=float, default=5, help='milliseconds between two stack samples (default: 5)')
+
+
+def tracing_from_args(args):
+    """Start the tracing and profiling asked for on the command line, the files are written when the script exits."""
+    if getattr(args, 'trace', None):
+        start_tracing(args.trace)
+        atexit.register(stop_tracing)
+    if getattr(args, 'profile', None):
+        start_profiling(args.profile, args.profile_mode, args.profile_interval / 1000)
+        atexit.register(stop_profiling)
@@ -0,0 +1,54 @@
+# Splits the molecules of a filter into passed / no value / discarded with boolean masks
+import pandas as pd
+
+
+def partition_by_value(df, values, column, threshold, absolute=False, formulas=None):
+    """
+    Attach the looked up values to the rows and split the rows by them.
+
+    A row passes when its value is >= threshold (abs(value) >= threshold with absolute=True).
+    Rows without a value (None/NaN) are kept in the joined output, without a value, like
+    the filters always did.
+
+    Parameters:
+        df: DataFrame of the molecules
+        values: One value per row of df, in row order, None where no value was found
+        column: Name of the column the values are stored in, e.g. "Dipole Moment"
+        threshold: Smallest value that passes the filter
+        absolute: Compare the magnitude of the values with the threshold
+        formulas: Formula of every row, to print the outcome of each molecule (optional, this is a
+                  Python loop over the rows, so the filters only pass them with --verbose)
+
+    Returns:
+        (good, no_value, discarded, joined) DataFrames, each in the row order of df.
+        no_value has no value column, joined is good and no_value together.
+    """
+    values = pd.Series(values, index=df.index, dtype=float)  # None becomes NaN
+    found = values.notna()
+    compared = values.abs() if absolute else values
+    passed = found & (compared >= threshold)
+
+    if formulas is not None:
+        outcomes = pd.Series("FILTERED OUT", index=df.index).mask(passed, "PASSED").mask(~found, "NONE PASSED")
+        for formula, value, outcome in zip(formulas, values.astype(object).where(found, None), outcomes):
+            print(f"{formula}: {column} = {value} - {outcome}")
+
+    with_value = df.assign(**{column: values})
+    good = with_value[passed]
+    discarded = with_value[found & ~passed]
+    no_value = df[~found]
+    joined = with_value[passed | ~found]
+    if not passed.any():
+        # only rows without a value, the joined output never had the value column then
+        joined = joined.drop(columns=column)
+    return tuple(empty_as_before(frame) for frame in (good, no_value, discarded, joined))
+
+
+def empty_as_before(frame):
+    """
+    The frame to write for an output: an empty output used to be written as an empty CSV without
+    header, so an empty frame becomes a DataFrame without columns and replayed and old runs write
+    the same files. Also used for the rotor shape outputs of prolate_oblate_check.py.
+    """
+    return frame if len(frame) else pd.DataFrame()
+
@@ -0,0 +1,65 @@
+# Persistent index of the CCCBDB option ('which' id) every molecule was resolved to, so that a later lookup
+# selects it with one POST of gotonex.asp instead of searching the formula and parsing the selection page
+import threading
+
+from checkpoint import molecule_key
+from json_store import JSONStore
+
+
+class WhichIndex:
+    """
+    Maps (formula, name) to the selected 'which' id and CCCBDB name, and every formula to the ground
+    state / minimum options of its selection page.
+
+    An entry is only a shortcut: when the selection it leads to is not a data page any more, the
+    lookup forgets it and searches the formula again.
+
+    Args:
+        path: SQLite file of the index
+        ttl: Seconds after which a molecule is searched again, None to keep the entries until they are forgotten
+    """
+
+    def __init__(self, path, ttl=None):
+        self.hits = 0
+        self.forgotten = 0
+        self._lock = threading.Lock()
+        self._store = JSONStore(path, table='which_ids', ttl=ttl)
+
+    @staticmethod
+    def _options_key(formula):
+        return 'options', str(formula).strip()
+
+    def get(self, formula, name):
+        """
+        Returns:
+            Dictionary with which, cccbdb_name and options (see options()) of an indexed molecule, or None
+        """
+        entry = self._store.get(molecule_key(formula, name))
+        if entry is None:
+            return None
+        with self._lock:
+            self.hits += 1
+        return dict(entry, options=self.options(formula) or [])
+
+    def options(self, formula):
+        """The ground state / minimum options of the selection page of formula, or None when it was not indexed."""
+        return self._store.get(self._options_key(formula))
+
+    def put(self, formula, name, option, options):
+        """
+        Index the option a molecule was resolved to.
+
+        Args:
+            option: Selected option, a dictionary with at least value (the 'which' id) and name
+            options: Every ground state / minimum option of the selection page
+        """
+        self._store.put(self._options_key(formula), [{key: value for key, value in entry.items() if key != 'row_text'}
+                                                     for entry in options])
+        self._store.put(molecule_key(formula, name), {'which': option['value'], 'cccbdb_name': option['name']})
+
+    def forget(self, formula, name):
+        """Drop a molecule whose 'which' id did not lead to its data page, and the options of its formula."""
+        self._store.delete(molecule_key(formula, name))
+        self._store.delete(self._options_key(formula))
+        with self._lock:
+            self.forgotten += 1